@@ -0,0 +1,129 @@
+import hashlib, json, sqlite3, time, zlib
+
+#################################################################################################
+##############################     sentence annotation cache     ################################
+#################################################################################################
+
+## default maximum size of the cached annotations, in bytes, after compression
+CACHE_MAX_BYTES = 2 * 1024 ** 3
+
+
+def pipeline_signature(nlp, lang):
+  '''
+  Describe a Stanza pipeline for the cache keys : the language, and the model file of each processor, which identifies the package and the processor set
+  Inputs:
+  	nlp : stanza Pipeline object : the pipeline made by `load_nlp`
+  	lang : str : the language code of the pipeline
+  Returns:
+  	signature : str : a json string
+  '''
+  models = {name: processor.config.get('model_path') for name, processor in nlp.processors.items()}
+  return json.dumps({"lang": lang, "processors": models}, sort_keys=True)
+
+
+def sentence_key(signature, token_lines):
+  '''
+  Make the cache key of a sentence : a hash of the pipeline signature and of the input columns of its tokens (id, form, lemma, upos, xpos, feats), which are all the parser sees. Columns are stripped of surrounding whitespace, so that the same sentence written with different spacing has the same key.
+  Inputs:
+  	signature : str : as made by `pipeline_signature`
+  	token_lines : list : token lines of the sentence, as yielded by `read_conll_sentences`
+  Returns:
+  	key : str : a sha256 hex digest
+  '''
+  sha256 = hashlib.sha256(signature.encode('utf-8'))
+  for line in token_lines:
+    fields = [field.strip() for field in line.split('\t')[:6]]
+    sha256.update(("\t".join(fields) + "\n").encode('utf-8'))
+  return sha256.hexdigest()
+
+
+class AnnotationCache:
+  '''
+  Persistent cache of annotated sentences, stored in a SQLite file as compressed conll token lines, with least-recently-used eviction once the cache exceeds its maximum size
+  Inputs:
+  	cache_file : str : absolute path to the SQLite file, created if it does not exist
+  	signature : str : the signature of the pipeline whose annotations are cached, as made by `pipeline_signature`
+  	max_bytes : int : maximum size of the cached annotations
+  '''
+  def __init__(self, cache_file, signature, max_bytes=CACHE_MAX_BYTES):
+    self.signature = signature
+    self.max_bytes = max_bytes
+    self.connection = sqlite3.connect(cache_file, timeout=60)
+    self.connection.execute("CREATE TABLE IF NOT EXISTS annotations (key TEXT PRIMARY KEY, value BLOB, size INTEGER, last_used REAL)")
+    self.connection.execute("CREATE INDEX IF NOT EXISTS annotations_last_used ON annotations (last_used)")
+    self.connection.commit()
+    self.hits, self.misses = 0, 0
+
+  def key(self, token_lines):
+    '''
+    Make the cache key of a sentence for the pipeline of this cache, see `sentence_key`
+    '''
+    return sentence_key(self.signature, token_lines)
+
+  def get_many(self, keys):
+    '''
+    Look up sentences in the cache, marking the ones found as recently used ; hits and misses are counted for every key, so that a sentence occurring several times counts as often
+    Inputs:
+    	keys : iterable : cache keys, as made by `sentence_key`, with a key repeated for each occurrence of its sentence
+    Returns:
+    	found : dict : the annotated token lines of each key found, as a single string
+    '''
+    keys = list(keys)
+    # each sentence is looked up once
+    distinct = list(dict.fromkeys(keys))
+    found = {}
+    # sqlite limits the number of parameters of a query
+    for start in range(0, len(distinct), 500):
+      batch = distinct[start:start + 500]
+      rows = self.connection.execute(f"SELECT key, value FROM annotations WHERE key IN ({','.join('?' * len(batch))})", batch)
+      for key, value in rows:
+        found[key] = zlib.decompress(value).decode('utf-8')
+    now = time.time()
+    self.connection.executemany("UPDATE annotations SET last_used = ? WHERE key = ?", [(now, key) for key in found])
+    self.connection.commit()
+    n_found = sum(key in found for key in keys)
+    self.hits += n_found
+    self.misses += len(keys) - n_found
+    return found
+
+  def put_many(self, annotations):
+    '''
+    Store annotated sentences, then evict the least recently used ones if the cache has outgrown its maximum size
+    Inputs:
+    	annotations : dict : the annotated token lines of each key, as a single string
+    '''
+    now = time.time()
+    rows = []
+    for key, lines in annotations.items():
+      value = zlib.compress(lines.encode('utf-8'))
+      rows.append((key, value, len(value), now))
+    self.connection.executemany("INSERT OR REPLACE INTO annotations VALUES (?, ?, ?, ?)", rows)
+    self.connection.commit()
+    self.evict()
+
+  def evict(self):
+    '''
+    Delete the least recently used sentences until the cache is back under 90% of its maximum size
+    '''
+    total = self.connection.execute("SELECT COALESCE(SUM(size), 0) FROM annotations").fetchone()[0]
+    if total <= self.max_bytes:
+      return
+    target = total - int(self.max_bytes * 0.9)
+    freed, keys = 0, []
+    for key, size in self.connection.execute("SELECT key, size FROM annotations ORDER BY last_used"):
+      keys.append((key,))
+      freed += size
+      if freed >= target:
+        break
+    self.connection.executemany("DELETE FROM annotations WHERE key = ?", keys)
+    self.connection.commit()
+
+  def hit_rate(self):
+    '''
+    Get the share of sentences found in the cache since it was opened
+    '''
+    lookups = self.hits + self.misses
+    return self.hits / lookups if lookups > 0 else 0.0
+
+  def close(self):
+    self.connection.close()
@@ -0,0 +1,101 @@
+import mmap, os
+
+#################################################################################################
+###############################     sidecar article index     ###################################
+#################################################################################################
+
+## columns of the index files : one line per article, tab separated, after a header line
+INDEX_COLUMNS = ["url_hash", "article_num", "site", "file", "offset", "length"]
+
+
+def index_path(data_file):
+  '''
+  Get the path of the sidecar index of a data file
+  Inputs:
+  	data_file : str : absolute path to a conll or xml file
+  Returns:
+  	index_file : str : absolute path to the index file, written next to the data file
+  '''
+  return f'{data_file}.idx'
+
+
+def write_index(data_file, entries):
+  '''
+  Write the sidecar index of a data file
+  Inputs:
+  	data_file : str : absolute path to the conll or xml file which has been written
+  	entries : list : a list of (url_hash, article_num, site, offset, length) tuples, one per article, with offset and length in bytes
+  Returns:
+  	no return object : the index file is written next to the data file
+  '''
+  # the data file is stored as a basename, so that the data and index can be moved together
+  file_name = os.path.basename(data_file)
+  with open(index_path(data_file), 'w', encoding='UTF-8') as f:
+    _ = f.write("\t".join(INDEX_COLUMNS) + "\n")
+    for url_hash, article_num, site, offset, length in entries:
+      site = str(site).replace("\t", " ")
+      _ = f.write(f'{url_hash}\t{article_num}\t{site}\t{file_name}\t{offset}\t{length}\n')
+
+
+def load_index(index_file):
+  '''
+  Load an index file
+  Inputs:
+  	index_file : str : absolute path to an index file
+  Returns:
+  	entries : list : a list of dictionaries with the keys of INDEX_COLUMNS, where `file` is an absolute path and `offset` and `length` are integers
+  '''
+  index_dir = os.path.dirname(os.path.abspath(index_file))
+  entries = []
+  with open(index_file, 'r', encoding='UTF-8') as f:
+    _ = f.readline()
+    for line in f:
+      entry = dict(zip(INDEX_COLUMNS, line.rstrip("\n").split("\t")))
+      entry["file"] = os.path.join(index_dir, entry["file"])
+      entry["offset"] = int(entry["offset"])
+      entry["length"] = int(entry["length"])
+      entries.append(entry)
+  return entries
+
+
+def find_articles(index_file, url_hash=None, article_num=None, site=None):
+  '''
+  Find the entries of an index matching all the criteria given
+  Inputs:
+  	index_file : str : absolute path to an index file
+  	url_hash : str : the hash of the url of the article, as made by `url_to_hex_id`, which is also the prefix of `sent_ID`
+  	article_num : str or int : the `Article_num` of the article
+  	site : str : the site of the article
+  Returns:
+  	matches : list : the matching entries, as returned by `load_index`
+  '''
+  criteria = {"url_hash": url_hash, "article_num": article_num, "site": site}
+  criteria = {key: str(value) for key, value in criteria.items() if value is not None}
+  return [entry for entry in load_index(index_file) if all(entry[key] == value for key, value in criteria.items())]
+
+
+def read_article(entry):
+  '''
+  Read a single article from its data file, seeking straight to it through mmap without parsing the rest of the file
+  Inputs:
+  	entry : dict : an index entry, as returned by `load_index` or `find_articles`
+  Returns:
+  	article : str : the conll sentences or the TEI.2 element of the article
+  '''
+  with open(entry["file"], 'rb') as f:
+    with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+      article = mm[entry["offset"]:entry["offset"] + entry["length"]]
+  return article.decode('UTF-8')
+
+
+def read_article_by_url(index_file, url):
+  '''
+  Read all the occurrences of an article in a data file from its URL
+  Inputs:
+  	index_file : str : absolute path to an index file
+  	url : str : the url of the article
+  Returns:
+  	articles : list : the text of each matching article, as returned by `read_article`
+  '''
+  from make_conll import url_to_hex_id
+  return [read_article(entry) for entry in find_articles(index_file, url_hash=url_to_hex_id(url))]
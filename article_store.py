@@ -0,0 +1,88 @@
+import json, os
+from compressed_io import open_file, strip_compression
+
+#################################################################################################
+###############################     shared article store     ####################################
+#################################################################################################
+
+## extension of the store made for each json file of step 1 : an uncompressed Arrow IPC file, so that it can be memory-mapped
+STORE_SUFFIX = '.arrow'
+
+## number of articles per record batch of the store : a worker reads the store a batch at a time, so the memory it holds for its input is that of a batch, not of a file
+BATCH_SIZE = 256
+
+## the store attached by the current process, by name, with its modification time, memory map and reader ; only the last store is kept, so that a worker does not hold the stores of all the files it processed
+_attached = {}
+
+
+def store_path(json_file):
+  '''
+  Get the path of the store of a json file, written next to it
+  '''
+  return strip_compression(json_file)[:-len('.json')] + STORE_SUFFIX
+
+
+def build_store(json_file):
+  '''
+  Load the articles of a json file once, and write them to its store : one row per article, in the order of the json file, with a column per key of the articles, text and metadata alike, in record batches of BATCH_SIZE articles. The store is only written again when the json file is newer.
+  Inputs:
+  	json_file : str : absolute path to a json file written by step 1
+  Returns:
+  	store_file : str : absolute path to the store
+  '''
+  import pyarrow as pa
+  store_file = store_path(json_file)
+  if os.path.exists(store_file) and os.path.getmtime(store_file) >= os.path.getmtime(json_file):
+    return store_file
+  with open_file(json_file, 'r') as f:
+    articles = list(json.load(f).values())
+  keys = list(articles[0].keys()) if articles else ["url", "txt"]
+  schema = pa.schema([(key, pa.string()) for key in keys])
+  # written to a temporary file then renamed, so that a worker never attaches to a store being written
+  with pa.OSFile(f'{store_file}.tmp', 'wb') as sink, pa.ipc.new_file(sink, schema) as writer:
+    for batch_start in range(0, len(articles), BATCH_SIZE):
+      batch = articles[batch_start:batch_start + BATCH_SIZE]
+      # the values are kept as the strings written in the conll comments, and nulls as nulls
+      writer.write_batch(pa.record_batch([[None if article.get(key) is None else str(article[key]) for article in batch] for key in keys], schema=schema))
+  os.replace(f'{store_file}.tmp', store_file)
+  return store_file
+
+
+def attach(store_file):
+  '''
+  Attach to a store by name : the file is memory-mapped, so the record batches are read from the page cache, shared by all the workers, without being copied or deserialised. The store attached before is dropped.
+  Returns:
+  	reader : pyarrow RecordBatchFileReader : the reader of the store, backed by the mapped file
+  '''
+  import pyarrow as pa
+  mtime = os.path.getmtime(store_file)
+  if store_file not in _attached or _attached[store_file][0] != mtime:
+    # the map of the store attached before is released once no batch read from it is in use
+    _attached.clear()
+    source = pa.memory_map(store_file, 'r')
+    _attached[store_file] = (mtime, source, pa.ipc.open_file(source))
+  return _attached[store_file][2]
+
+
+def iter_articles(store_file, start=0, stop=None):
+  '''
+  Read a slice of the articles of a store, a record batch at a time
+  Inputs:
+  	store_file : str : absolute path to the store
+  	start : int : index of the first article
+  	stop : int : default = None ; index after the last article, None for the end of the store
+  Yields:
+  	article : dict : the text and metadata of each article, with the keys of the json file, in their order
+  '''
+  reader = attach(store_file)
+  batch_start = 0
+  for i in range(reader.num_record_batches):
+    # a batch read from the map is zero-copy : only the rows of the batch in the slice are turned into Python objects
+    batch = reader.get_batch(i)
+    first = max(start - batch_start, 0)
+    last = batch.num_rows if stop is None else min(stop - batch_start, batch.num_rows)
+    if first < last:
+      yield from batch.slice(first, last - first).to_pylist()
+    batch_start += batch.num_rows
+    if stop is not None and batch_start >= stop:
+      return
@@ -0,0 +1,108 @@
+import argparse, json, os, statistics, subprocess, sys, time
+
+#################################################################################################
+##################################      import-time benchmark      ##############################
+#################################################################################################
+
+## run from the root of the repository, so that the scripts can be imported
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_DIR)
+from cc_news import COMMANDS
+
+## packages that must not be loaded by importing a script, only by the functions which need them
+HEAVY_MODULES = ["torch", "stanza", "spacy", "numpy", "polars", "pyarrow", "huggingface_hub", "requests"]
+
+
+def time_command(command, repeat):
+  '''
+  Time a command in fresh interpreters
+  Inputs:
+  	command : list : the command to run
+  	repeat : int : number of runs
+  Returns:
+  	seconds : float : median wall time of the runs
+  '''
+  runs = []
+  for _ in range(repeat):
+    start = time.perf_counter()
+    subprocess.run(command, cwd=REPO_DIR, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    runs.append(time.perf_counter() - start)
+  return statistics.median(runs)
+
+
+def import_profile(module):
+  '''
+  Import a module in a fresh interpreter with `-X importtime`, and list the heavy packages it loaded
+  Inputs:
+  	module : str : name of the module
+  Returns:
+  	profile : dict : cumulative import time of the module in seconds, the heavy packages loaded and the 5 slowest top-level imports
+  '''
+  code = f"import sys, {module}; print(','.join(m for m in {HEAVY_MODULES!r} if m in sys.modules))"
+  result = subprocess.run([sys.executable, "-X", "importtime", "-c", code], cwd=REPO_DIR, capture_output=True, text=True)
+  if result.returncode != 0:
+    return {"error": result.stderr.strip().splitlines()[-1]}
+  ## lines of -X importtime : "import time: self [us] | cumulative | imported package", nested imports being indented
+  cumulative = {}
+  for line in result.stderr.splitlines():
+    if line.startswith("import time:") is False or "cumulative" in line:
+      continue
+    _, total, name = line[len("import time:"):].split("|")
+    if name.startswith("  ") is False:
+      cumulative[name.strip()] = int(total) / 1e6
+  slowest = sorted(cumulative.items(), key=lambda item: item[1], reverse=True)[:5]
+  loaded = result.stdout.strip()
+  return {"import_s": cumulative.get(module, 0.0), "heavy_loaded": loaded.split(",") if loaded else [], "slowest": slowest}
+
+
+def compare(results, baseline, tolerance):
+  '''
+  Compare the startup times with a previous run
+  Inputs:
+  	results : dict : the results of this run
+  	baseline : dict : the results of a previous run
+  	tolerance : float : relative slowdown above which a command is reported
+  Returns:
+  	regressions : list : a message for each command slower than the baseline by more than the tolerance
+  '''
+  regressions = []
+  for command, result in results["commands"].items():
+    previous = baseline.get("commands", {}).get(command)
+    if previous is None:
+      continue
+    if result["help_s"] > previous["help_s"] * (1 + tolerance):
+      regressions.append(f'{command} --help : {previous["help_s"]:.3f}s -> {result["help_s"]:.3f}s')
+  return regressions
+
+
+def main(argv=None):
+  parser = argparse.ArgumentParser(description="Time the startup of each command of cc_news.py in fresh interpreters, and check that no heavy package is loaded at import")
+  parser.add_argument("-repeat", type=int, default=5, help="number of runs of each command")
+  parser.add_argument("-output", default="", help="json file to write the results to")
+  parser.add_argument("-baseline", default="", help="json file of a previous run to compare with")
+  parser.add_argument("-tolerance", type=float, default=0.2, help="relative slowdown reported as a regression")
+  args = parser.parse_args(argv)
+
+  results = {"python": sys.version.split()[0], "bare_interpreter_s": time_command([sys.executable, "-c", "pass"], args.repeat), "commands": {}}
+  for command, module in COMMANDS.items():
+    result = {"module": module, "help_s": time_command([sys.executable, "cc_news.py", command, "--help"], args.repeat)}
+    result.update(import_profile(module))
+    results["commands"][command] = result
+    print(f'{command:<10} {result["help_s"]:.3f}s  heavy modules loaded: {result.get("heavy_loaded", result.get("error"))}')
+
+  if args.output:
+    with open(args.output, 'w', encoding='UTF-8') as f:
+      json.dump(results, f, indent=1)
+  failed = [command for command, result in results["commands"].items() if result.get("heavy_loaded")]
+  if args.baseline:
+    with open(args.baseline, 'r', encoding='UTF-8') as f:
+      regressions = compare(results, json.load(f), args.tolerance)
+    for message in regressions:
+      print(f"regression : {message}")
+    failed += regressions
+  if failed:
+    sys.exit(1)
+
+
+if __name__ == "__main__":
+  main()
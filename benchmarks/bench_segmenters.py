@@ -0,0 +1,154 @@
+import argparse, glob, json, os, statistics, sys, time
+
+#################################################################################################
+##############################     segmentation backend benchmark     ###########################
+#################################################################################################
+
+## run from the root of the repository, so that the scripts can be imported
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_DIR)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from synthetic_corpus import make_rows, parse_mix
+from segmenters import BACKENDS, get_segmenter
+from compressed_io import open_file
+
+
+def load_texts(input_pattern, lang, n_rows, seed):
+  '''
+  Get the tidied texts of the articles to segment : from the json files written by step 1, or from a synthetic corpus when no files are given
+  Inputs:
+  	input_pattern : str : glob pattern of json files in a 1_conllised_json folder ; empty for a synthetic corpus
+  	lang : str : language of the synthetic corpus
+  	n_rows : int : number of synthetic articles
+  	seed : int : seed of the synthetic corpus
+  Returns:
+  	texts : list : the text of each article, tidied as in step 2
+  '''
+  from make_conll import tidy_text
+  if not input_pattern:
+    return [tidy_text(text) for text in make_rows(n_rows, "2020", parse_mix(lang), seed=seed)["plain_text"]]
+  texts = []
+  for json_file in sorted(glob.glob(input_pattern)):
+    with open_file(json_file, 'r') as f:
+      texts += [tidy_text(valueset['txt']) for valueset in json.load(f).values()]
+  return texts
+
+
+def token_spans(text, sentences):
+  '''
+  Locate the tokens of a segmentation in the text
+  Returns:
+  	tokens : set : (start, end) of each token
+  	starts : set : start of each sentence after the first
+  '''
+  tokens, starts, position = set(), set(), 0
+  for s, sentence in enumerate(sentences):
+    for t, token in enumerate(sentence):
+      start = text.find(token, position)
+      if start < 0:
+        continue
+      position = start + len(token)
+      tokens.add((start, position))
+      if t == 0 and s > 0:
+        starts.add(start)
+  return tokens, starts
+
+
+def agreement(texts, segmentations, reference, n_examples=0):
+  '''
+  Compare the segmentations of a backend with those of the reference backend
+  Inputs:
+  	texts : list : the texts segmented
+  	segmentations : list : the sentences of each text given by the backend
+  	reference : list : the sentences of each text given by the reference backend
+  	n_examples : int : number of sentences differing from the reference to return
+  Returns:
+  	scores : dict : token F1, sentence boundary F1, and share of articles and sentences segmented as the reference
+  	examples : list : (backend, reference) pairs of differing sentences, as text
+  '''
+  token_found, token_reference, boundary_found, boundary_reference = 0, 0, 0, 0
+  token_matched, boundary_matched, same_articles, same_sentences, n_sentences = 0, 0, 0, 0, 0
+  examples = []
+  for text, sentences, reference_sentences in zip(texts, segmentations, reference):
+    tokens, starts = token_spans(text, sentences)
+    reference_tokens, reference_starts = token_spans(text, reference_sentences)
+    token_found, token_reference, token_matched = token_found + len(tokens), token_reference + len(reference_tokens), token_matched + len(tokens & reference_tokens)
+    boundary_found, boundary_reference, boundary_matched = boundary_found + len(starts), boundary_reference + len(reference_starts), boundary_matched + len(starts & reference_starts)
+    same_articles += sentences == reference_sentences
+    reference_set = {tuple(sentence) for sentence in reference_sentences}
+    n_sentences += len(reference_sentences)
+    same_sentences += sum(tuple(sentence) in reference_set for sentence in sentences)
+    if len(examples) < n_examples and sentences != reference_sentences:
+      for sentence, reference_sentence in zip(sentences, reference_sentences):
+        if sentence != reference_sentence:
+          examples.append((" ".join(sentence), " ".join(reference_sentence)))
+          break
+  scores = {
+    "token_f1": 2 * token_matched / (token_found + token_reference) if token_found + token_reference else 1.0,
+    "boundary_f1": 2 * boundary_matched / (boundary_found + boundary_reference) if boundary_found + boundary_reference else 1.0,
+    "same_sentences": same_sentences / n_sentences if n_sentences else 1.0,
+    "same_articles": same_articles / len(texts) if texts else 1.0,
+  }
+  return scores, examples
+
+
+def time_backend(segmenter, texts, repeat):
+  '''
+  Time a backend on all the texts, with a fresh backend for each run after the first, so that no run benefits from the cache of the previous one
+  Returns:
+  	seconds : float : median time of the runs
+  	segmentations : list : the sentences of each text
+  '''
+  runs = []
+  for run in range(repeat):
+    if run > 0:
+      segmenter = get_segmenter(segmenter.lang, segmenter.name)
+    start = time.perf_counter()
+    segmentations = list(segmenter.segment_batch(texts))
+    runs.append(time.perf_counter() - start)
+  return statistics.median(runs), segmentations
+
+
+def main(argv=None):
+  parser = argparse.ArgumentParser(description="Time the sentence segmentation backends of step 2, and measure the agreement of each backend with spacy, the reference backend")
+  parser.add_argument("-input", default="", help="glob pattern of json files written by step 1, e.g. '/data/cc_fr/2020/1_conllised_json/*.json' ; by default, synthetic articles are segmented")
+  parser.add_argument("-lang", default="fr", help="language of the texts")
+  parser.add_argument("-rows", type=int, default=2000, help="number of synthetic articles")
+  parser.add_argument("-seed", type=int, default=0, help="seed of the synthetic articles")
+  parser.add_argument("-backends", default=",".join(BACKENDS), help="comma-separated backends to run")
+  parser.add_argument("-repeat", type=int, default=3, help="number of runs of each backend")
+  parser.add_argument("-examples", type=int, default=5, help="number of sentences differing from spacy shown for each backend")
+  parser.add_argument("-output", default="", help="json file to write the results to")
+  args = parser.parse_args(argv)
+
+  texts = load_texts(args.input, args.lang, args.rows, args.seed)
+  n_bytes = sum(len(text.encode('UTF-8')) for text in texts)
+  print(f"{len(texts)} articles, {n_bytes / 1e6:.1f} MB")
+  results = {"python": sys.version.split()[0], "config": {"input": args.input, "lang": args.lang, "rows": len(texts), "seed": args.seed}, "backends": {}}
+  reference = None
+  for backend in ["spacy"] + [backend for backend in args.backends.split(",") if backend != "spacy"]:
+    try:
+      segmenter = get_segmenter(args.lang, backend)
+    except ValueError as e:
+      print(f"{backend:<8} skipped : {e}")
+      continue
+    seconds, segmentations = time_backend(segmenter, texts, args.repeat)
+    result = {"seconds": seconds, "articles_per_s": len(texts) / seconds, "mb_per_s": n_bytes / 1e6 / seconds, "sentences": sum(len(sentences) for sentences in segmentations), "tokens": sum(len(sentence) for sentences in segmentations for sentence in sentences)}
+    if backend == "spacy":
+      reference = segmentations
+    elif reference is not None:
+      scores, examples = agreement(texts, segmentations, reference, args.examples)
+      result.update(scores)
+      for found, expected in examples:
+        print(f"  {backend} : {found}\n  spacy : {expected}\n")
+    results["backends"][backend] = result
+    scores = f'token F1 {result["token_f1"]:.4f} boundary F1 {result["boundary_f1"]:.4f} same sentences {result["same_sentences"]:.4f}' if "token_f1" in result else ""
+    print(f'{backend:<8} {result["articles_per_s"]:>10.1f} articles/s {result["mb_per_s"]:>8.2f} MB/s {result["sentences"]:>8} sentences {result["tokens"]:>9} tokens  {scores}')
+
+  if args.output:
+    with open(args.output, 'w', encoding='UTF-8') as f:
+      json.dump(results, f, indent=1)
+
+
+if __name__ == "__main__":
+  main()
@@ -0,0 +1,232 @@
+import argparse, glob, json, logging, multiprocessing, os, resource, shutil, statistics, sys, time
+from concurrent.futures import ProcessPoolExecutor
+
+#################################################################################################
+##############################     pipeline stage benchmark     #################################
+#################################################################################################
+
+## run from the root of the repository, so that the scripts can be imported
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_DIR)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from synthetic_corpus import write_shards, parse_mix, stub_parse_file
+
+## the stages benchmarked, in pipeline order : each stage reads the files written by the stages before it
+STAGES = ["filter_parquet", "make_arrays", "make_conll_strings_from_json_with_allmetas", "send_to_files", "stub_stanza", "process_file", "consolidate_xmls"]
+
+## marker written in the year folders made by the benchmark : only those are deleted when the benchmark is run again
+MARKER = '.bench_stages'
+
+
+def peak_rss_mb():
+  '''
+  Get the peak resident set size of the current process in MB ; ru_maxrss is in kilobytes on Linux and in bytes on macOS
+  '''
+  peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+  return peak / 1024 ** 2 if sys.platform == "darwin" else peak / 1024
+
+
+def stage_files(year_dir, folder, pattern):
+  return sorted(glob.glob(f'{year_dir}/{folder}/{pattern}'))
+
+
+def run_stage(stage, year_dir, lang):
+  '''
+  Run a stage on all the files of its input folder, timing only the function benchmarked : the inputs it takes in memory are rebuilt before the clock starts. Meant to run in a fresh process, so that the peak RSS is that of the stage
+  Inputs:
+  	stage : str : one of STAGES
+  	year_dir : str : absolute path to the year folder of the synthetic corpus
+  	lang : str : language code, for filtering, segmentation and the XML
+  Returns:
+  	result : dict : seconds, rows and bytes processed, peak RSS before and after the timed call
+  '''
+  import make_conll, send_to_xml
+  from conll_reader import read_conll_sentences
+  year = os.path.basename(year_dir)
+  shards = stage_files(year_dir, "0_raw_parquet", "*.parquet")
+  rows, n_bytes, seconds = 0, 0, 0.0
+
+  if stage == "filter_parquet":
+    for shard in shards:
+      start = time.perf_counter()
+      trimmed = make_conll.filter_parquet(shard, "lang", lang)
+      seconds += time.perf_counter() - start
+      rows += len(trimmed)
+      n_bytes += os.path.getsize(shard)
+
+  elif stage == "make_arrays":
+    ## the json files for the next stage are written here, outside the timed call
+    for shard in shards:
+      trimmed = make_conll.filter_parquet(shard, "lang", lang)
+      start = time.perf_counter()
+      my_arrays = make_conll.make_arrays(trimmed)
+      seconds += time.perf_counter() - start
+      rows += len(trimmed)
+      n_bytes += trimmed.estimated_size()
+      make_conll.run_exporter_to_json_dict(my_arrays, shard, "A", year, "lang", lang)
+
+  elif stage == "make_conll_strings_from_json_with_allmetas":
+    nlp = make_conll.define_pipe(lang)
+    for json_file in stage_files(year_dir, "1_conllised_json", "*.json"):
+      start = time.perf_counter()
+      file_output = make_conll.make_conll_strings_from_json_with_allmetas(json_file, nlp)
+      seconds += time.perf_counter() - start
+      with open(json_file, 'r', encoding='UTF-8') as f:
+        rows += len(json.load(f))
+      n_bytes += os.path.getsize(json_file)
+
+  elif stage == "send_to_files":
+    nlp = make_conll.define_pipe(lang)
+    for json_file in stage_files(year_dir, "1_conllised_json", "*.json"):
+      file_output = make_conll.make_conll_strings_from_json_with_allmetas(json_file, nlp)
+      start = time.perf_counter()
+      make_conll.send_to_files(json_file, file_output, token_budget=make_conll.TOKEN_BUDGET)
+      seconds += time.perf_counter() - start
+      rows += len(file_output)
+      n_bytes += sum(len(sentence.encode('UTF-8')) for sentence in file_output)
+
+  elif stage == "stub_stanza":
+    os.makedirs(f'{year_dir}/3_conllu_out', exist_ok=True)
+    for conll_file in stage_files(year_dir, "2_conllu", "*.conll"):
+      output_file = conll_file.replace('2_conllu', '3_conllu_out').replace('.conll', f'.__{lang}_OUT.conll')
+      start = time.perf_counter()
+      rows += stub_parse_file(conll_file, output_file)
+      seconds += time.perf_counter() - start
+      n_bytes += os.path.getsize(conll_file)
+
+  elif stage == "process_file":
+    os.makedirs(f'{year_dir}/4_xml', exist_ok=True)
+    logger = logging.getLogger("bench_stages")
+    for conll_file in stage_files(year_dir, "3_conllu_out", "*.conll"):
+      start = time.perf_counter()
+      if send_to_xml.process_file(conll_file, year, lang, logger) == 1:
+        raise RuntimeError(f'XML conversion failed for {conll_file}')
+      seconds += time.perf_counter() - start
+      rows += sum(1 for _ in read_conll_sentences(conll_file))
+      n_bytes += os.path.getsize(conll_file)
+
+  elif stage == "consolidate_xmls":
+    ## consolidate_xmls globs the folders of the production hierarchy : the function it wraps is timed on the synthetic files instead
+    outputfilename = f'{year_dir}/{year}_consolidated_{lang}.xml'
+    xml_files = [xml_file for xml_file in stage_files(year_dir, "4_xml", "*.xml") if xml_file != outputfilename]
+    start = time.perf_counter()
+    send_to_xml.consolidate_files(xml_files, outputfilename)
+    seconds += time.perf_counter() - start
+    rows = sum(send_to_xml.count_sentences(xml_file) for xml_file in xml_files)
+    n_bytes = sum(os.path.getsize(xml_file) for xml_file in xml_files)
+
+  else:
+    raise ValueError(f"Unknown stage: {stage}")
+  return {"seconds": seconds, "rows": rows, "bytes": n_bytes, "peak_rss_mb": peak_rss_mb()}
+
+
+def reset_outputs(year_dir, stage):
+  '''
+  Remove the outputs of a stage, so that every repeat writes them from scratch
+  '''
+  outputs = {"make_arrays": ["1_conllised_json"], "send_to_files": ["2_conllu"], "stub_stanza": ["3_conllu_out"], "process_file": ["4_xml"]}
+  for folder in outputs.get(stage, []):
+    shutil.rmtree(f'{year_dir}/{folder}', ignore_errors=True)
+    os.makedirs(f'{year_dir}/{folder}', exist_ok=True)
+
+
+def run_benchmark(year_dir, lang, stages, repeat):
+  '''
+  Run each stage `repeat` times, each time in a fresh process
+  Inputs:
+  	year_dir : str : absolute path to the year folder of the synthetic corpus
+  	lang : str : language code
+  	stages : list : stages to run, in pipeline order
+  	repeat : int : number of runs of each stage
+  Returns:
+  	results : dict : for each stage, the median seconds, rows/sec and MB/sec and the highest peak RSS of its runs
+  '''
+  context = multiprocessing.get_context("spawn")
+  results = {}
+  for stage in stages:
+    runs = []
+    for _ in range(repeat):
+      reset_outputs(year_dir, stage)
+      with ProcessPoolExecutor(max_workers=1, mp_context=context) as executor:
+        runs.append(executor.submit(run_stage, stage, year_dir, lang).result())
+    seconds = statistics.median(run["seconds"] for run in runs)
+    result = {
+      "seconds": seconds,
+      "rows": runs[0]["rows"],
+      "bytes": runs[0]["bytes"],
+      "rows_per_s": runs[0]["rows"] / seconds if seconds > 0 else 0.0,
+      "mb_per_s": runs[0]["bytes"] / 1e6 / seconds if seconds > 0 else 0.0,
+      "peak_rss_mb": max(run["peak_rss_mb"] for run in runs),
+    }
+    results[stage] = result
+    print(f'{stage:<44} {result["rows_per_s"]:>12.1f} rows/s {result["mb_per_s"]:>8.2f} MB/s {result["peak_rss_mb"]:>8.1f} MB peak')
+  return results
+
+
+def compare(results, baseline, tolerance):
+  '''
+  Compare the stages with a previous run
+  Inputs:
+  	results : dict : the results of this run
+  	baseline : dict : the results of a previous run
+  	tolerance : float : relative change above which a stage is reported
+  Returns:
+  	regressions : list : a message for each stage slower, or using more memory, than the baseline by more than the tolerance
+  '''
+  regressions = []
+  for stage, result in results["stages"].items():
+    previous = baseline.get("stages", {}).get(stage)
+    if previous is None:
+      continue
+    if result["rows_per_s"] < previous["rows_per_s"] * (1 - tolerance):
+      regressions.append(f'{stage} : {previous["rows_per_s"]:.1f} -> {result["rows_per_s"]:.1f} rows/s')
+    if result["peak_rss_mb"] > previous["peak_rss_mb"] * (1 + tolerance):
+      regressions.append(f'{stage} : {previous["peak_rss_mb"]:.1f} -> {result["peak_rss_mb"]:.1f} MB peak RSS')
+  return regressions
+
+
+def main(argv=None):
+  parser = argparse.ArgumentParser(description="Generate a synthetic CC-News corpus and time each stage of the pipeline on it, with Stanza replaced by a stub")
+  parser.add_argument("-work_dir", required=True, help="folder for the synthetic corpus, written in the standard hierarchy under WORK_DIR/YEAR ; a year folder not made by the benchmark is not overwritten, use a scratch folder such as /tmp/bench")
+  parser.add_argument("-year", default="2020", help="year of the synthetic articles")
+  parser.add_argument("-lang", default="fr", help="language benchmarked : the other languages of the mix are filtered out in step 1")
+  parser.add_argument("-shards", type=int, default=2, help="number of parquet files")
+  parser.add_argument("-rows", type=int, default=1000, help="number of articles per parquet file")
+  parser.add_argument("-mix", default="fr=0.6,en=0.4", help="weight of each language, e.g. fr=0.6,en=0.4")
+  parser.add_argument("-seed", type=int, default=0, help="seed of the generator : the same seed gives the same corpus")
+  parser.add_argument("-stages", default=",".join(STAGES), help="comma-separated stages to run, in pipeline order")
+  parser.add_argument("-repeat", type=int, default=3, help="number of runs of each stage")
+  parser.add_argument("-output", default="", help="json file to write the results to")
+  parser.add_argument("-baseline", default="", help="json file of a previous run to compare with")
+  parser.add_argument("-tolerance", type=float, default=0.2, help="relative change reported as a regression")
+  parser.add_argument("--force", action="store_true", help="delete the year folder even if it was not made by the benchmark")
+  args = parser.parse_args(argv)
+
+  config = {"year": args.year, "lang": args.lang, "shards": args.shards, "rows": args.rows, "mix": args.mix, "seed": args.seed}
+  year_dir = f'{args.work_dir}/{args.year}'
+  # the year folder is deleted to start from a fresh corpus : refuse to delete a folder holding data the benchmark did not make
+  if os.path.isdir(year_dir) and os.listdir(year_dir) and not os.path.exists(f'{year_dir}/{MARKER}') and not args.force:
+    parser.error(f"{year_dir} is not empty and was not made by the benchmark : use a scratch -work_dir, or --force to delete it")
+  shutil.rmtree(year_dir, ignore_errors=True)
+  write_shards(args.work_dir, args.year, args.shards, args.rows, parse_mix(args.mix), seed=args.seed)
+  open(f'{year_dir}/{MARKER}', 'w').close()
+  stages = [stage for stage in STAGES if stage in args.stages.split(",")]
+  results = {"python": sys.version.split()[0], "config": config, "stages": run_benchmark(year_dir, args.lang, stages, args.repeat)}
+
+  if args.output:
+    with open(args.output, 'w', encoding='UTF-8') as f:
+      json.dump(results, f, indent=1)
+  if args.baseline:
+    with open(args.baseline, 'r', encoding='UTF-8') as f:
+      baseline = json.load(f)
+    if baseline.get("config") != config:
+      print(f"warning : the baseline was run on a different corpus : {baseline.get('config')}")
+    regressions = compare(results, baseline, args.tolerance)
+    for message in regressions:
+      print(f"regression : {message}")
+    if regressions:
+      sys.exit(1)
+
+
+if __name__ == "__main__":
+  main()
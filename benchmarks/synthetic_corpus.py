@@ -0,0 +1,176 @@
+import argparse, os, random, sys
+
+#################################################################################################
+##############################     synthetic CC-News corpus     #################################
+#################################################################################################
+
+## run from the root of the repository, so that the scripts can be imported
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_DIR)
+from conll_reader import read_conll_sentences
+from compressed_io import open_file
+
+## the columns of the CC-News parquet files, in their order
+COLUMNS = ["requested_url", "plain_text", "published_date", "title", "author", "sitename", "responded_url", "publisher", "warc_path", "crawl_date", "language"]
+
+## a small vocabulary per language, function words first : enough for the sentencizer and the tokenizer to meet the punctuation, elisions and abbreviations of real text
+VOCABULARY = {
+  "fr": "le la les de des du un une et à en que qui dans pour pas sur au avec est sont a ont été plus par ce cette il elle ils nous vous on M. l'État d'après aujourd'hui gouvernement ministre président ville pays année semaine marché entreprise projet travail école santé police élection accord économie réforme Paris Lyon Marseille".split(),
+  "en": "the of and to a in that is for on was with he it as at by from they we has have been said would Mr. Dr. U.S. government minister president city country year week market company project work school health police election deal economy reform London Sydney Chicago".split(),
+  "de": "der die das und zu den von mit ist im für auf nicht sich dem ein eine auch es an werden aus er hat dass sie nach bei Dr. z.B. Regierung Minister Präsident Stadt Land Jahr Woche Markt Unternehmen Projekt Arbeit Schule Gesundheit Polizei Wahl Berlin München Hamburg".split(),
+  "it": "il la di che e a in un per è non una sono da del della con si le lo ha dei nel alla anche come sig. dott. governo ministro presidente città paese anno settimana mercato azienda progetto lavoro scuola salute polizia elezioni Roma Milano Napoli".split(),
+  "es": "el la de que y a en los se del las un por con no una su para es al lo como más pero sus le ha Sr. Dra. gobierno ministro presidente ciudad país año semana mercado empresa proyecto trabajo escuela salud policía elecciones Madrid Barcelona Sevilla".split(),
+  "fro": "li le la les de del et a en que qui ne pas est fu ot sont il ele cil cele mout bien si com par sor au as son sa ses l'ost d'armes qu'il n'i s'en rois chevaliers dame sire terre cort jor guerre pais cuer amor Artus Lancelot Rollant Karles Paris".split(),
+  "frm": "le la les de du des et a en que qui ne pas est fut ont sont il elle ceulx ceste moult bien ainsi comme par sur au aux son sa ses l'ost d'armes qu'il n'y s'en roy chevalier dame seigneur terre court jour guerre paix cueur amour Paris Bourgogne Orléans".split(),
+  "ang": "se seo þæt þa and on to of in mid he heo hit wæs is synd hæfde cwæð ne swa eac ofer æfter þonne cyning ealdorman folc land burh dæg gear god eorl þegn mann wif here scip Ælfred Wessex Lundenburh Eoforwic".split(),
+  "grc": "ὁ ἡ τό καί δέ τοῦ τῆς τόν τήν ἐν εἰς οὐ μέν γάρ ἀλλά ὡς πρός ἐπί ἐκ ὅτι οὖν ἄν δ' ἀλλ' λόγος πόλις ἀνήρ θεός βασιλεύς δῆμος πόλεμος νόμος στρατηγός ναῦς ἡμέρα Ἀθῆναι Σπάρτη Πέρσαι".split(),
+}
+
+## top-level domain of the synthetic sites of each language
+TLDS = {"fr": "fr", "en": "com", "de": "de", "it": "it", "es": "es", "fro": "fr", "frm": "fr", "ang": "uk", "grc": "gr"}
+
+## the marks ending the sentences of each language, the first ones being drawn more often ; Greek asks questions with a semicolon
+SENTENCE_MARKS = {"grc": [".", ".", ".", ".", ";", "·"]}
+DEFAULT_MARKS = [".", ".", ".", ".", "?", "!"]
+
+
+def parse_mix(mix_arg):
+  '''
+  Parse a language mix such as `fr=0.6,en=0.4` into a dictionary of weights
+  '''
+  mix = {}
+  for part in mix_arg.split(","):
+    lang, weight = part.split("=") if "=" in part else (part, "1")
+    if lang.strip() not in VOCABULARY:
+      raise ValueError(f"No vocabulary for language {lang}")
+    mix[lang.strip()] = float(weight)
+  return mix
+
+
+def make_sentence(rng, words, marks=DEFAULT_MARKS):
+  '''
+  Make a sentence of 4 to 30 words drawn from a vocabulary, function words being drawn more often, as in real text, ended by one of `marks`
+  '''
+  n_words = rng.randint(4, 30)
+  sentence = [words[min(int(rng.expovariate(1 / 12)), len(words) - 1)] for _ in range(n_words)]
+  # commas, quotes and a final mark, so that the tokenizer has punctuation to split off
+  if n_words > 10 and rng.random() < 0.5:
+    sentence[rng.randint(2, n_words - 2)] += ","
+  if rng.random() < 0.1:
+    position = rng.randint(0, n_words - 2)
+    sentence[position] = f"“{sentence[position]}"
+    sentence[position + 1] = f"{sentence[position + 1]}”"
+  text = " ".join(sentence)
+  return text[0].upper() + text[1:] + rng.choice(marks)
+
+
+def make_article(rng, words, marks=DEFAULT_MARKS):
+  '''
+  Make the plain text of an article : paragraphs of sentences, separated by line breaks as in CC-News
+  '''
+  paragraphs = []
+  for _ in range(rng.randint(1, 8)):
+    paragraphs.append(" ".join(make_sentence(rng, words, marks) for _ in range(rng.randint(1, 6))))
+  return "\n".join(paragraphs)
+
+
+def make_rows(n_rows, year, mix, n_sites=20, seed=0):
+  '''
+  Make the rows of a synthetic shard, deterministically for a given seed
+  Inputs:
+  	n_rows : int : number of articles
+  	year : str : year of the publication dates
+  	mix : dict : weight of each language, as made by `parse_mix`
+  	n_sites : int : number of sites per language
+  	seed : int : seed of the random generator
+  Returns:
+  	columns : dict : a list of values for each of COLUMNS
+  '''
+  rng = random.Random(seed)
+  langs, weights = list(mix), list(mix.values())
+  columns = {name: [] for name in COLUMNS}
+  for n in range(n_rows):
+    lang = rng.choices(langs, weights)[0]
+    site_num = rng.randint(0, n_sites - 1)
+    site = f"site{site_num}-{lang}.{TLDS[lang]}"
+    month, day = rng.randint(1, 12), rng.randint(1, 28)
+    url = f"https://www.{site}/{year}/{month:02d}/{day:02d}/article-{seed}-{n}"
+    columns["requested_url"].append(url)
+    columns["plain_text"].append(make_article(rng, VOCABULARY[lang], SENTENCE_MARKS.get(lang, DEFAULT_MARKS)))
+    columns["published_date"].append(f"{year}-{month:02d}-{day:02d}")
+    columns["title"].append(make_sentence(rng, VOCABULARY[lang])[:-1])
+    # some articles have no author, as in CC-News
+    columns["author"].append(None if rng.random() < 0.2 else f"Author {rng.randint(0, 200)}")
+    columns["sitename"].append(site)
+    # a few articles are redirected
+    columns["responded_url"].append(url if rng.random() < 0.9 else url.replace("https://www.", "https://amp."))
+    columns["publisher"].append(f"Publisher {site_num} {lang}")
+    columns["warc_path"].append(f"crawl-data/CC-NEWS/{year}/{month:02d}/CC-NEWS-{year}{month:02d}{day:02d}{rng.randint(0, 235959):06d}-{rng.randint(0, 9999):05d}.warc.gz")
+    columns["crawl_date"].append(f"{year}-{month:02d}-{min(day + 1, 28):02d}T{rng.randint(0, 23):02d}:{rng.randint(0, 59):02d}:00")
+    columns["language"].append(lang)
+  return columns
+
+
+def write_shards(work_dir, year, n_shards, rows_per_shard, mix, n_sites=20, seed=0):
+  '''
+  Write synthetic shards to the 0_raw_parquet folder of a year in the standard hierarchy
+  Inputs:
+  	work_dir : str : absolute path to the folder holding the year folders
+  	year : str : year of the publication dates
+  	n_shards : int : number of parquet files
+  	rows_per_shard : int : number of articles per file
+  	mix : dict : weight of each language, as made by `parse_mix`
+  	n_sites : int : number of sites per language
+  	seed : int : seed of the first shard, each shard having its own
+  Returns:
+  	shard_files : list : absolute paths to the parquet files written
+  '''
+  import polars as pl
+  parquet_dir = f'{work_dir}/{year}/0_raw_parquet'
+  os.makedirs(parquet_dir, exist_ok=True)
+  shard_files = []
+  for shard in range(n_shards):
+    shard_file = f'{parquet_dir}/{year}-{shard:05d}.parquet'
+    df = pl.DataFrame(make_rows(rows_per_shard, year, mix, n_sites=n_sites, seed=seed + shard), schema={name: pl.String for name in COLUMNS})
+    df.write_parquet(shard_file)
+    shard_files.append(shard_file)
+  return shard_files
+
+
+def stub_parse_file(input_file, output_file):
+  '''
+  Stand in for Stanza in step 3, so that steps 3 and 4 can be run without models : the conll columns are filled with a deterministic annotation, each word headed by the previous one, and the sent_id Stanza adds is added
+  Inputs:
+  	input_file : str : absolute path to a conll file written by `send_to_files`
+  	output_file : str : absolute path to the parsed file
+  Returns:
+  	n_sentences : int : number of sentences written
+  '''
+  n_sentences = 0
+  with open_file(output_file, 'w') as w:
+    for index, (comments, token_lines) in enumerate(read_conll_sentences(input_file)):
+      if not any(comment.startswith('# sent_id = ') for comment in comments):
+        comments = comments + [f'# sent_id = {index}']
+      lines = []
+      for line in token_lines:
+        fields = line.split('\t')
+        word_id = int(fields[0])
+        head, deprel = (0, "root") if word_id == 1 else (word_id - 1, "dep")
+        lines.append(f'{word_id}\t{fields[1]}\t{fields[1].lower()}\tX\t_\t_\t{head}\t{deprel}\t_\t_')
+      _ = w.write("\n".join(comments + lines) + "\n\n")
+      n_sentences += 1
+  return n_sentences
+
+
+if __name__ == "__main__":
+  parser = argparse.ArgumentParser(description="Write synthetic CC-News shards to WORK_DIR/YEAR/0_raw_parquet")
+  parser.add_argument("-work_dir", required=True, help="folder holding the year folders")
+  parser.add_argument("-year", default="2020", help="year of the publication dates")
+  parser.add_argument("-shards", type=int, default=2, help="number of parquet files")
+  parser.add_argument("-rows", type=int, default=1000, help="number of articles per file")
+  parser.add_argument("-mix", default="fr=0.6,en=0.4", help="weight of each language, e.g. fr=0.6,en=0.4")
+  parser.add_argument("-sites", type=int, default=20, help="number of sites per language")
+  parser.add_argument("-seed", type=int, default=0, help="seed of the random generator")
+  args = parser.parse_args()
+  for shard_file in write_shards(args.work_dir, args.year, args.shards, args.rows, parse_mix(args.mix), n_sites=args.sites, seed=args.seed):
+    print(shard_file)
@@ -0,0 +1,54 @@
+import sys, importlib
+
+#################################################################################################
+##################################      command line entry point      ###########################
+#################################################################################################
+
+## the module running each subcommand : only the module of the subcommand given is imported, so that the heavy dependencies of the other steps (torch for Stanza, spacy, polars) are never loaded
+COMMANDS = {
+  "download": "get_parquetfiles",
+  "conll": "make_conll",
+  "parse": "run_stanza",
+  "xml": "send_to_xml",
+  "parquet": "send_to_parquet",
+  "pipeline": "run_pipeline",
+  "stats": "corpus_stats",
+}
+
+USAGE = '''\
+usage: cc_news.py COMMAND [ARGS]
+
+Run a step of the pipeline, with the arguments of its script : `cc_news.py COMMAND --help` shows them
+
+commands:
+  download    step 1 : download parquet files from the HF repo (get_parquetfiles.py)
+  conll       steps 1 and 2 : parquet to json, json to conll (make_conll.py)
+  parse       step 3 : parse conll files with Stanza (run_stanza.py)
+  xml         step 4 : conll to TEI XML (send_to_xml.py)
+  parquet     step 4 : conll to a parquet token dataset (send_to_parquet.py)
+  pipeline    steps 1 to 4 together (run_pipeline.py)
+  stats       merge and query the corpus statistics written in step 4 (corpus_stats.py)
+'''
+
+
+def main(argv=None):
+  '''
+  Run the `main` function of the module of a subcommand with the rest of the arguments
+  Inputs:
+  	argv : list : the arguments, the subcommand first ; defaults to the arguments of the script
+  '''
+  argv = sys.argv[1:] if argv is None else argv
+  if len(argv) == 0 or argv[0] in ("-h", "--help"):
+    print(USAGE)
+    return
+  if argv[0] not in COMMANDS:
+    print(f"unknown command {argv[0]}\n\n{USAGE}")
+    sys.exit(2)
+  module = importlib.import_module(COMMANDS[argv[0]])
+  # show the name of the subcommand rather than the name of the module in the usage messages
+  sys.argv[0] = f"cc_news.py {argv[0]}"
+  module.main(argv[1:])
+
+
+if __name__ == "__main__":
+  main()
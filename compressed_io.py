@@ -0,0 +1,127 @@
+import glob, io, json, os
+
+#################################################################################################
+##############################     compressed file streams     ##################################
+#################################################################################################
+
+## the compression of a file is given by its extension, after the extension of its format, e.g. x_2020_part01.conll.zst
+SUFFIXES = {"zstd": ".zst", "gzip": ".gz"}
+
+## the compression settings are passed to the worker processes through the environment, which the workers inherit whether the pools fork or spawn them
+COMPRESSION_ENV = "CC_NEWS_COMPRESSION"
+
+## default settings : zstd level 3 compresses about as well as gzip level 6 at several times the speed ; threads = 0 compresses in the writing thread, as pools already keep every core busy
+DEFAULT_OPTIONS = {"zstd_level": 3, "gzip_level": 6, "threads": 0}
+
+
+def add_compression_arguments(parser):
+  '''
+  Add the compression options to the argument parser of a script
+  '''
+  parser.add_argument("--compress", type=str, default=None, choices=["zstd", "gzip", "none"], help="compression of the files written ; by default, files are compressed as the file they are made from")
+  parser.add_argument("--compress_level", type=int, default=None, help="compression level ; default 3 for zstd (1-22), 6 for gzip (1-9)")
+  parser.add_argument("--compress_threads", type=int, default=0, help="threads compressing each zstd file, -1 for one per core ; 0 compresses in the writing process")
+
+
+def set_compression_options(level=None, threads=0):
+  '''
+  Set the compression level and threads of the current process and of the worker processes it starts
+  Inputs:
+  	level : int : compression level for both zstd and gzip ; None for the defaults
+  	threads : int : number of threads compressing each zstd file
+  '''
+  options = dict(DEFAULT_OPTIONS, threads=threads)
+  if level is not None:
+    options["zstd_level"], options["gzip_level"] = level, level
+  os.environ[COMPRESSION_ENV] = json.dumps(options)
+
+
+def compression_options():
+  return json.loads(os.environ[COMPRESSION_ENV]) if COMPRESSION_ENV in os.environ else DEFAULT_OPTIONS
+
+
+def compression_of(path):
+  '''
+  Get the compression of a file from its extension
+  Returns:
+  	compression : str : `zstd`, `gzip`, or None for an uncompressed file
+  '''
+  for compression, suffix in SUFFIXES.items():
+    if path.endswith(suffix):
+      return compression
+  return None
+
+
+def strip_compression(path):
+  '''
+  Remove the compression extension of a path, e.g. to make the names of the files derived from it
+  '''
+  compression = compression_of(path)
+  return path[:-len(SUFFIXES[compression])] if compression is not None else path
+
+
+def with_compression(path, compression):
+  '''
+  Set the compression extension of an output path
+  Inputs:
+  	path : str : the path, with or without a compression extension
+  	compression : str : `zstd`, `gzip` or `none` ; None keeps the extension of the path, so that outputs are compressed as their input. zstd falls back on gzip when the zstandard package is missing
+  Returns:
+  	path : str : the path with the extension of the compression
+  '''
+  if compression is None:
+    return path
+  if compression == "zstd":
+    try:
+      import zstandard
+    except ImportError:
+      print("zstandard is not installed : compressing with gzip instead")
+      compression = "gzip"
+  return strip_compression(path) + SUFFIXES.get(compression, "")
+
+
+def open_file(path, mode='r'):
+  '''
+  Open a file for streaming, compressing or decompressing it as given by its extension
+  Inputs:
+  	path : str : absolute path to the file
+  	mode : str : `r`, `w`, `rb` or `wb` ; text modes are UTF-8
+  Returns:
+  	f : file object
+  '''
+  compression = compression_of(path)
+  binary = 'b' in mode
+  if compression is None:
+    return open(path, mode) if binary else open(path, mode, encoding='UTF-8')
+
+  options = compression_options()
+  if compression == "gzip":
+    import gzip
+    f = gzip.open(path, mode[0] + 'b', compresslevel=options["gzip_level"])
+  else:
+    import zstandard
+    if mode[0] == 'r':
+      f = io.BufferedReader(zstandard.ZstdDecompressor().stream_reader(open(path, 'rb'), closefd=True))
+    else:
+      compressor = zstandard.ZstdCompressor(level=options["zstd_level"], threads=options["threads"])
+      f = compressor.stream_writer(open(path, 'wb'), closefd=True)
+  return f if binary else io.TextIOWrapper(f, encoding='UTF-8')
+
+
+def glob_data(pattern):
+  '''
+  Find the files matching a pattern, compressed or not ; when a file is found both compressed and not, or with two compressions, as left by runs with different `--compress` options, only the most recently written is kept, so that its content is not processed twice
+  Inputs:
+  	pattern : str : a glob pattern ending with the extension of the format, e.g. `*.conll`
+  Returns:
+  	files : list : the files found, with those matching the pattern followed by a compression extension
+  '''
+  files = glob.glob(pattern)
+  for suffix in SUFFIXES.values():
+    files += glob.glob(pattern + suffix)
+  newest = {}
+  for path in files:
+    name = strip_compression(path)
+    if name not in newest or os.path.getmtime(path) > os.path.getmtime(newest[name]):
+      newest[name] = path
+  return [path for path in files if newest[strip_compression(path)] == path]
@@ -0,0 +1,67 @@
+import glob, json, os
+
+#################################################################################################
+###############################     conll part manifests     ####################################
+#################################################################################################
+
+## suffix of the manifest written by `send_to_files` for the parts of each json file
+MANIFEST_SUFFIX = '_manifest.json'
+
+
+def part_stem(conll_file):
+  '''
+  Get the name of the part a conll file derives from : parsed files and their xml keep the part name before their first dot, e.g. x_2020_part01.__en_OUT.conll
+  '''
+  return os.path.basename(conll_file).split('.')[0]
+
+
+def write_manifest(manifest_file, parts):
+  '''
+  Write the manifest of the parts made from a json file
+  Inputs:
+  	manifest_file : str : absolute path to the manifest
+  	parts : dict : for the name of each part, as given by `part_stem`, a dictionary with its number of tokens, sentences and articles
+  Returns:
+  	no return object : a file is written
+  '''
+  with open(manifest_file, 'w', encoding='UTF-8') as f:
+    json.dump(parts, f, indent=1)
+
+
+def load_manifests(file_list):
+  '''
+  Load the manifests covering a list of files : manifests are looked for in the folder of each file, and in the 2_conllu folder next to it, where `send_to_files` writes them
+  Inputs:
+  	file_list : list : absolute paths to conll or xml files
+  Returns:
+  	parts : dict : for the name of each part, its entry in the manifest
+  '''
+  folders = set()
+  for input_file in file_list:
+    folder = os.path.dirname(os.path.abspath(input_file))
+    folders.add(folder)
+    folders.add(os.path.join(os.path.dirname(folder), '2_conllu'))
+  parts = {}
+  for folder in sorted(folders):
+    for manifest_file in glob.glob(f'{folder}/*{MANIFEST_SUFFIX}'):
+      with open(manifest_file, 'r', encoding='UTF-8') as f:
+        parts.update(json.load(f))
+  return parts
+
+
+def sort_by_cost(file_list):
+  '''
+  Sort files from the most to the least costly to process, so that the largest files are started first and a large file submitted last does not hold up the whole run. The cost of a file is its number of tokens in the manifests ; if a file has no manifest entry, all files are sorted on their size in bytes instead, so that costs are always compared in the same unit.
+  Inputs:
+  	file_list : list : absolute paths to conll or xml files
+  Returns:
+  	sorted_files : list : the files, most costly first
+  	costs : dict : the cost of each file
+  '''
+  parts = load_manifests(file_list)
+  if all(part_stem(input_file) in parts for input_file in file_list):
+    costs = {input_file: parts[part_stem(input_file)]["tokens"] for input_file in file_list}
+  else:
+    costs = {input_file: os.path.getsize(input_file) for input_file in file_list}
+  sorted_files = sorted(file_list, key=lambda input_file: costs[input_file], reverse=True)
+  return sorted_files, costs
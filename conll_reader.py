@@ -0,0 +1,72 @@
+from compressed_io import open_file
+
+#################################################################################################
+##############################     line-oriented conll reader     ###############################
+#################################################################################################
+
+
+def read_conll_sentences(input_file):
+  '''
+  Stream the sentences of a conll file without building Stanza Document/Sentence/Token objects
+  Inputs:
+  	input_file : str : absolute path to a conll or conllu file, compressed or not, see `open_file`
+  Yields:
+  	(comments, token_lines) : tuple : comments is the list of comment lines (starting with #) of the sentence, in file order, as Stanza exposes them in `sent.comments`; token_lines is the list of token lines of the sentence, without their line break
+  Notes:
+  	Blank lines end a sentence. A block made only of comment lines with no token line is not a sentence : its comments are carried over to the next sentence, as Stanza does when reading a conll file.
+  '''
+  comments, token_lines = [], []
+  with open_file(input_file, 'r') as f:
+    for line in f:
+      line = line.strip()
+      if not line:
+        if token_lines:
+          yield comments, token_lines
+          comments, token_lines = [], []
+        continue
+      if line.startswith('#'):
+        comments.append(line)
+      else:
+        token_lines.append(line)
+  # last sentence of a file without a final blank line
+  if token_lines:
+    yield comments, token_lines
+
+
+def count_tokens(token_lines):
+  '''
+  Count the tokens of a sentence as `len(sent.tokens)` does for a Stanza sentence : a multi-word token range (1-2) counts as one token, the words it covers are not counted again, and empty nodes (1.1) are ignored
+  Inputs:
+  	token_lines : list : token lines of a sentence, as yielded by `read_conll_sentences`
+  Returns:
+  	n_tokens : int : the number of tokens in the sentence
+  '''
+  n_tokens = 0
+  range_end = 0
+  for line in token_lines:
+    token_id = line.split('\t', 1)[0]
+    if '.' in token_id:
+      continue
+    if '-' in token_id:
+      n_tokens += 1
+      range_end = int(token_id.split('-')[1])
+      continue
+    if int(token_id) > range_end:
+      n_tokens += 1
+  return n_tokens
+
+
+def max_sentence_length(input_file):
+  '''
+  Get the length in tokens of the longest sentence of a conll file in a single streaming pass
+  Inputs:
+  	input_file : str : absolute path to a conll or conllu file
+  Returns:
+  	max_len : int : the number of tokens in the longest sentence, 0 if the file has no sentences
+  '''
+  max_len = 0
+  for comments, token_lines in read_conll_sentences(input_file):
+    n_tokens = count_tokens(token_lines)
+    if n_tokens > max_len:
+      max_len = n_tokens
+  return max_len
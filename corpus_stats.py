@@ -0,0 +1,240 @@
+import argparse, collections, glob, json, os, sqlite3
+from compressed_io import strip_compression
+
+#################################################################################################
+###############################     corpus statistics store     #################################
+#################################################################################################
+
+## suffix of the statistics written by `send_to_xml` next to each xml file
+STATS_SUFFIX = '.stats.json'
+
+## name of the statistics store, in the year folder above 4_xml
+STORE_NAME = 'corpus_stats.sqlite'
+
+## the metadata the counts are grouped by, which queries can group on
+GROUPS = ["year", "month", "site", "publi"]
+
+## the counts are kept per file, so that a file converted again replaces its own rows ; lemma_totals holds the frequencies summed over all files, kept up to date on every merge so that frequency queries do not scan the rows of every file
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS files (file TEXT PRIMARY KEY, lang TEXT, year TEXT, tokens INTEGER, sentences INTEGER, articles INTEGER, mtime REAL);
+CREATE TABLE IF NOT EXISTS counts (file TEXT, year TEXT, month TEXT, site TEXT, publi TEXT, tokens INTEGER, sentences INTEGER, articles INTEGER);
+CREATE INDEX IF NOT EXISTS counts_file ON counts (file);
+CREATE TABLE IF NOT EXISTS lemmas (file TEXT, lang TEXT, lemma TEXT, upos TEXT, count INTEGER);
+CREATE INDEX IF NOT EXISTS lemmas_file ON lemmas (file);
+CREATE TABLE IF NOT EXISTS lemma_totals (lang TEXT, lemma TEXT, upos TEXT, count INTEGER, PRIMARY KEY (lang, lemma, upos));
+'''
+
+
+def stats_path(data_file):
+  '''
+  Get the path of the statistics of an xml file, written next to it ; the compression extension of the xml file is left out of the name
+  '''
+  return f'{strip_compression(data_file)}{STATS_SUFFIX}'
+
+
+def store_path(data_file):
+  '''
+  Get the path of the statistics store of an xml file : the store is shared by all the files of a year, and written in the year folder
+  '''
+  return os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(data_file))), STORE_NAME)
+
+
+class FileStats:
+  '''
+  Count the tokens, sentences and articles of a conll file per year, month, site and publisher, and the frequency of each lemma and UPOS tag, while the sentences are streamed to the XML writer : no second pass over the file is needed
+  '''
+  def __init__(self, year):
+    self.year = year
+    self.counts = {}
+    self.lemmas = collections.Counter()
+
+  def track(self, sentences):
+    '''
+    Count the sentences of a stream as they go through, and yield them unchanged
+    Inputs:
+    	sentences : iterable : (comments, token_lines) tuples, as yielded by `read_conll_sentences`
+    Yields:
+    	(comments, token_lines) : tuple : each sentence of the stream
+    '''
+    art_num_prev = None
+    for comments, token_lines in sentences:
+      key = (self.year, comments[11].replace("# month=",""), comments[6].replace("# site=",""), comments[8].replace("# publi=",""))
+      counts = self.counts.setdefault(key, [0, 0, 0])
+      if comments[0] != art_num_prev:
+        counts[2] += 1
+        art_num_prev = comments[0]
+      counts[1] += 1
+      for line in token_lines:
+        fields = line.split('\t', 4)
+        # multi-word tokens (1-2) and empty nodes (1.1) are not counted as tokens
+        if fields[0].isdigit():
+          counts[0] += 1
+          self.lemmas[(fields[2], fields[3])] += 1
+      yield comments, token_lines
+
+  def dump(self, data_file, lang):
+    '''
+    Write the statistics of a file next to it, as json
+    Inputs:
+    	data_file : str : absolute path to the xml file the statistics describe
+    	lang : str : language code
+    Returns:
+    	stats_file : str : absolute path to the statistics written
+    '''
+    stats = {
+      "file": os.path.basename(data_file),
+      "lang": lang,
+      "year": self.year,
+      "counts": [[*key, *counts] for key, counts in self.counts.items()],
+      "lemmas": [[lemma, upos, count] for (lemma, upos), count in self.lemmas.items()],
+    }
+    stats_file = stats_path(data_file)
+    with open(stats_file, 'w', encoding='UTF-8') as f:
+      json.dump(stats, f, ensure_ascii=False)
+    return stats_file
+
+
+def connect(store):
+  '''
+  Open the statistics store, making its tables on first use
+  '''
+  conn = sqlite3.connect(store, timeout=60)
+  conn.executescript(SCHEMA)
+  return conn
+
+
+def remove_file(conn, file_name):
+  '''
+  Remove the rows of a file from the store, and take its lemmas off the totals
+  '''
+  conn.execute("INSERT INTO lemma_totals SELECT lang, lemma, upos, -count FROM lemmas WHERE file = ? ON CONFLICT (lang, lemma, upos) DO UPDATE SET count = count + excluded.count", (file_name,))
+  conn.execute("DELETE FROM lemma_totals WHERE count = 0")
+  for table in ["files", "counts", "lemmas"]:
+    conn.execute(f"DELETE FROM {table} WHERE file = ?", (file_name,))
+
+
+def merge_stats(store, stats_files):
+  '''
+  Merge the statistics of files into the store : a file already in the store has its rows replaced, and statistics unchanged since they were last merged are skipped, so that the store can be updated after every run
+  Inputs:
+  	store : str : absolute path to the SQLite store, made if missing
+  	stats_files : list : absolute paths to statistics written by `FileStats.dump`
+  Returns:
+  	n_merged : int : number of files merged
+  '''
+  n_merged = 0
+  conn = connect(store)
+  try:
+    with conn:
+      merged = dict(conn.execute("SELECT file, mtime FROM files"))
+      for stats_file in stats_files:
+        mtime = os.path.getmtime(stats_file)
+        with open(stats_file, 'r', encoding='UTF-8') as f:
+          stats = json.load(f)
+        if merged.get(stats["file"]) == mtime:
+          continue
+        remove_file(conn, stats["file"])
+        tokens, sentences, articles = [sum(row[4 + i] for row in stats["counts"]) for i in range(3)]
+        conn.execute("INSERT INTO files VALUES (?, ?, ?, ?, ?, ?, ?)", (stats["file"], stats["lang"], stats["year"], tokens, sentences, articles, mtime))
+        conn.executemany("INSERT INTO counts VALUES (?, ?, ?, ?, ?, ?, ?, ?)", [(stats["file"], *row) for row in stats["counts"]])
+        conn.executemany("INSERT INTO lemmas VALUES (?, ?, ?, ?, ?)", [(stats["file"], stats["lang"], *row) for row in stats["lemmas"]])
+        conn.execute("INSERT INTO lemma_totals SELECT lang, lemma, upos, count FROM lemmas WHERE file = ? ON CONFLICT (lang, lemma, upos) DO UPDATE SET count = count + excluded.count", (stats["file"],))
+        n_merged += 1
+  finally:
+    conn.close()
+  return n_merged
+
+
+def drop_stats(store, data_files):
+  '''
+  Take the statistics of files which have been removed out of the store
+  Inputs:
+  	store : str : absolute path to the SQLite store
+  	data_files : list : absolute paths to the xml files removed
+  Returns:
+  	n_dropped : int : number of files taken out of the store
+  '''
+  conn = connect(store)
+  try:
+    with conn:
+      merged = {file_name for file_name, in conn.execute("SELECT file FROM files")}
+      file_names = [os.path.basename(data_file) for data_file in data_files if os.path.basename(data_file) in merged]
+      for file_name in file_names:
+        remove_file(conn, file_name)
+  finally:
+    conn.close()
+  return len(file_names)
+
+
+def query_counts(store, by=("site",), year=None):
+  '''
+  Get the number of tokens, sentences and articles per group of metadata
+  Inputs:
+  	store : str : absolute path to the SQLite store
+  	by : list : the metadata to group by, from GROUPS
+  	year : str : default = None ; restrict the counts to a year
+  Returns:
+  	rows : list : a tuple per group, with the values of `by` then the tokens, sentences and articles, the largest groups first
+  '''
+  unknown = [group for group in by if group not in GROUPS]
+  if unknown:
+    raise ValueError(f"Unknown groups: {unknown} ; use {GROUPS}")
+  columns = ", ".join(by)
+  where, args = ("WHERE year = ?", (year,)) if year is not None else ("", ())
+  conn = connect(store)
+  try:
+    return conn.execute(f"SELECT {columns}, SUM(tokens) AS tokens, SUM(sentences), SUM(articles) FROM counts {where} GROUP BY {columns} ORDER BY tokens DESC", args).fetchall()
+  finally:
+    conn.close()
+
+
+def query_lemmas(store, lang=None, upos=None, top=50):
+  '''
+  Get the most frequent lemmas of the corpus, from the totals kept up to date by `merge_stats`
+  Inputs:
+  	store : str : absolute path to the SQLite store
+  	lang : str : default = None ; restrict the lemmas to a language
+  	upos : str : default = None ; restrict the lemmas to a UPOS tag
+  	top : int : number of lemmas returned
+  Returns:
+  	rows : list : a (lang, lemma, upos, count) tuple per lemma, the most frequent first
+  '''
+  conditions = [(column, value) for column, value in [("lang", lang), ("upos", upos)] if value is not None]
+  where = ("WHERE " + " AND ".join(f"{column} = ?" for column, _ in conditions)) if conditions else ""
+  conn = connect(store)
+  try:
+    return conn.execute(f"SELECT lang, lemma, upos, count FROM lemma_totals {where} ORDER BY count DESC LIMIT ?", (*[value for _, value in conditions], top)).fetchall()
+  finally:
+    conn.close()
+
+
+def main(argv=None):
+  '''
+  Command line entry point : run with the arguments in argv, or with the arguments of the script if argv is None
+  '''
+  parser = argparse.ArgumentParser(description="Merge the statistics written by send_to_xml.py into a store, and query the store")
+  parser.add_argument("-store", required=True, help="path to the SQLite statistics store, e.g. /data/cc_fr/2020/corpus_stats.sqlite")
+  parser.add_argument("-merge", default="", help="folder of xml files whose statistics are merged into the store before it is queried")
+  parser.add_argument("-by", default="site", help=f"comma-separated metadata to group the counts by, from {','.join(GROUPS)}")
+  parser.add_argument("-year", default=None, help="restrict the counts to a year")
+  parser.add_argument("-lemmas", action="store_true", help="show the most frequent lemmas instead of the counts")
+  parser.add_argument("-lang", default=None, help="restrict the lemmas to a language")
+  parser.add_argument("-upos", default=None, help="restrict the lemmas to a UPOS tag")
+  parser.add_argument("-top", type=int, default=50, help="number of rows shown")
+  args = parser.parse_args(argv)
+
+  if args.merge:
+    stats_files = sorted(glob.glob(f'{args.merge}/*{STATS_SUFFIX}'))
+    print(f"{merge_stats(args.store, stats_files)} of {len(stats_files)} files merged into {args.store}")
+  if args.lemmas:
+    for row in query_lemmas(args.store, lang=args.lang, upos=args.upos, top=args.top):
+      print("\t".join(str(value) for value in row))
+  else:
+    by = [group.strip() for group in args.by.split(",")]
+    print("\t".join(by + ["tokens", "sentences", "articles"]))
+    for row in query_counts(args.store, by=by, year=args.year)[:args.top]:
+      print("\t".join(str(value) for value in row))
+
+
+if __name__ == "__main__":
+  main()
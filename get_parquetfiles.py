@@ -1,6 +1,6 @@
-import os, requests, argparse
-from huggingface_hub import HfApi, HfFolder, hf_hub_url
+import os, argparse
 from tqdm import tqdm
+from profiling import add_profile_arguments, profile_run
 
 def download_files_for_year(year, repo_id, local_dir):
   '''
@@ -11,6 +11,9 @@ def download_files_for_year(year, repo_id, local_dir):
   Return :
     no return object : files will be downloaded
   '''
+  # requests and huggingface_hub are imported here, so that the command line starts without loading them
+  import requests
+  from huggingface_hub import HfApi, HfFolder, hf_hub_url
   # talking to the HF API
   token = HfFolder.get_token()
   api = HfApi()
@@ -47,15 +50,22 @@ def download_files_for_year(year, repo_id, local_dir):
     
         print(f"✅ Downloaded {filename} → {local_path}")
     
-if __name__ == "__main__":
+def main(argv=None):
+    '''
+    Command line entry point : run with the arguments in argv, or with the arguments of the script if argv is None
+    '''
     parser = argparse.ArgumentParser(description="Download specific parquet files from  a HF repo to a specified directory.")
-    parser.add_argument(
-        "-year",help="YEAR for folder in standard hierarchy "
-        "-repo", help="path to HF repo"
-        "-local_dir", help="absolute path to local directory where files will be downloaded"
-    )
-    args = parser.parse_args()
+    parser.add_argument("-year", help="YEAR for folder in standard hierarchy")
+    parser.add_argument("-repo", help="path to HF repo")
+    parser.add_argument("-local_dir", help="absolute path to local directory where files will be downloaded")
+    add_profile_arguments(parser)
+    args = parser.parse_args(argv)
     year = str(args.year)
     repo = str(args.repo)
     local_dir = str(args.local_dir)
-    download_files_for_year(year, repo_id, local_dir)
\ No newline at end of file
+    with profile_run(args.profile, "get_parquetfiles", mode=args.profile_mode, top=args.profile_top):
+        download_files_for_year(year, repo, local_dir)
+
+
+if __name__ == "__main__":
+    main()
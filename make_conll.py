@@ -2,8 +2,8 @@
 import argparse
 import glob
 import hashlib
+import itertools
 import json
-import math
 import os
 import re
 import time
@@ -11,22 +11,37 @@ from functools import partial
 from multiprocessing import Pool, cpu_count
 
 # Third-party
-from spacy.pipeline import Sentencizer
-import numpy as np
+# polars, numpy and spacy are imported in the functions using them, so that the command line starts without loading them ; spacy is imported by the spacy segmentation backend only
 from tqdm import tqdm
-import polars as pl
 
+# Local
+from article_index import write_index, index_path
+from conll_manifest import MANIFEST_SUFFIX, part_stem, write_manifest
+from segmenters import BACKENDS, get_segmenter
+from quality_filter import parse_thresholds
+from article_store import build_store, store_path, iter_articles as iter_store_articles
+from profiling import add_profile_arguments, profile_run, profiled
+from compressed_io import add_compression_arguments, set_compression_options, open_file, with_compression, strip_compression, compression_of, glob_data
 
-def filter_parquet(this_file, filter_type, filter_value):
+# a special string for the empty conll fields of the token lines
+LINE_TAIL = "\t_\t_\t_\t_\t_\t_\t_\t_\n"
+
+# default number of tokens to which to limit conll files : about the size of the 50 000 sentence files, with runtimes that can be predicted from the manifest
+TOKEN_BUDGET = 750000
+
+
+def filter_parquet(this_file, filter_type, filter_value, prefilter=None):
   '''
   Trim a polars dataframe to only the rows where the `filter_value` matches in the `filter_type` column or the `requested_url` column contains `this_domain` to restrict data to a specific website.
   Inputs:
     this_file (str): absolute reference to a parquet file to parse with Polars
     filter_type (str) : `lang` to filter on language, `domain` to filter on domain
     filter_value (str) : a language code if filtering on the language column, or a domain + top level extension if filtering on a website
+    prefilter (dict) : default = None ; thresholds of the text quality prefilter, as made by `parse_thresholds` in `quality_filter`, applied to the rows which match the filter, and a report of the rows rejected is written next to the parquet file. The language score is only computed when filtering on language
   Return:
     trimmed (df) : a Polars df collected from only the rows matching the filter
   '''
+  import polars as pl
   df = pl.scan_parquet(this_file)  
 
   filter_map = { "lang": pl.col("language") == filter_value,
@@ -37,6 +52,13 @@ def filter_parquet(this_file, filter_type, filter_value):
 
   filtered_df = df.filter(filter_map[filter_type])
   
+  if prefilter is not None:
+    from quality_filter import prefilter as quality_prefilter, write_report
+    trimmed, report = quality_prefilter(filtered_df, lang=filter_value if filter_type == "lang" else None, thresholds=prefilter)
+    report_file = write_report(this_file, report)
+    print(f"Prefilter kept {report['kept']} of {report['rows']} rows, report in {report_file}")
+    return trimmed
+
   trimmed = filtered_df.collect()
     
   return trimmed
@@ -52,6 +74,7 @@ def make_arrays(trimmed):
     my_arrays (list) : a list of arrays of metadata
   
   '''
+  import numpy as np
   df = trimmed
   years_list, days_list, months_list = [],[],[]
   
@@ -84,7 +107,7 @@ def make_arrays(trimmed):
 
 
 
-def run_exporter_to_json_dict(my_arrays, this_file, mode, year, filter_type, filter_value):
+def run_exporter_to_json_dict(my_arrays, this_file, mode, year, filter_type, filter_value, compression=None):
   '''
   Export the arrays to a json file
   Inputs:
@@ -94,8 +117,9 @@ def run_exporter_to_json_dict(my_arrays, this_file, mode, year, filter_type, fil
     year (string) : 4 character string to indicate year being processed
     filter_type (str) : `lang` to filter on language, `domain` to filter on domain
     filter_value (str) : a language code if filtering on the language column, or a domain + top level extension if filtering on a website
+    compression (str) : default = None ; `zstd` or `gzip` to compress the json files, see `with_compression`
   Returns:
-    no return object. A json file will be printed in the same location as the source parquet file
+    outputfiles (list) : absolute paths to the json files printed, one per target year, in the `1_conllised_json` folder matching the `0_raw_parquet` folder of the source parquet file
 
   '''
   # get the list of metadata arrays out of the my_arrays list
@@ -105,7 +129,8 @@ def run_exporter_to_json_dict(my_arrays, this_file, mode, year, filter_type, fil
   source_short = this_file.replace(".parquet","")
   if filter_type =="domain":  
     domain_tidy = re.sub(r'www_|_com','', filter_value.replace('.','_'))
-    source_short = source_short.replace(f'{year}/',f'{year}/{domain_tidy}_')
+    # prefix the file name rather than the year folder, so that the prefix stays on the file whatever the folders between the year and the file
+    source_short = os.path.join(os.path.dirname(source_short), f'{domain_tidy}_{os.path.basename(source_short)}')
 
   source_short = source_short.replace('0_raw_parquet','1_conllised_json')
 
@@ -115,6 +140,7 @@ def run_exporter_to_json_dict(my_arrays, this_file, mode, year, filter_type, fil
   else:
     target_years = sorted(set(years_arr))
 
+  outputfiles = []
   # for each target_year, make a dictionary : in this dictionary, the keys will be integers, and the values will be dictionaries build from the metadata arrays
   for target_year in target_years:
     tidy_dict = {}
@@ -125,13 +151,15 @@ def run_exporter_to_json_dict(my_arrays, this_file, mode, year, filter_type, fil
         tidy_dict[i] = values
 
     ## add the target_year to the path where the json will be written, then write to the file
-    outputfile = f'{source_short}_{target_year}.json'
-    with open(outputfile, 'w', encoding='UTF-8') as k:
+    outputfile = with_compression(f'{source_short}_{target_year}.json', compression)
+    with open_file(outputfile, 'w') as k:
       json.dump(tidy_dict, k)
     print(f'Printed file {outputfile}')
+    outputfiles.append(outputfile)
+  return outputfiles
 
 
-def get_json_from_parquet(filter_type, filter_value, number, mode, year, local_dir=None):
+def get_json_from_parquet(filter_type, filter_value, number, mode, year, local_dir=None, compression=None, prefilter=None):
   '''
   TO DO : tweak the args to allow these_domains to be specified as a list in CLI
   
@@ -143,6 +171,8 @@ def get_json_from_parquet(filter_type, filter_value, number, mode, year, local_d
     mode (string) : indicate whether to process in strict mode or not. If processing in strict mode, using `S`, the year in the crawl_date metadata must match the year specified in the `year` argument. 
     year (str) : a year as 4 characters
     local_dir : str : default = None ; option to specify local dir in which to work
+    compression : str : default = None ; `zstd` or `gzip` to compress the json files
+    prefilter : dict : default = None ; thresholds of the text quality prefilter, see `filter_parquet`
   Returns :
     No return object : a file will be printed or an error message will be printed to the console.
   
@@ -165,14 +195,14 @@ def get_json_from_parquet(filter_type, filter_value, number, mode, year, local_d
   for this_file in tqdm(sorted(these_files)):
     year = os.path.basename(this_file)[:4]
     try:
-      trimmed= filter_parquet(this_file, filter_type, filter_value)
+      trimmed= filter_parquet(this_file, filter_type, filter_value, prefilter=prefilter)
       if len(trimmed) ==0:
         print(f"\nNo hits in {os.path.basename(this_file)}")
         
       if len(trimmed) > 0:
         my_arrays = make_arrays(trimmed)
         
-        run_exporter_to_json_dict(my_arrays, this_file, mode, year, filter_type, filter_value)
+        run_exporter_to_json_dict(my_arrays, this_file, mode, year, filter_type, filter_value, compression=compression)
     except Exception as e:
       report = this_file, e
       exportlog.append(report)
@@ -181,37 +211,17 @@ def get_json_from_parquet(filter_type, filter_value, number, mode, year, local_d
       print(item)
 
 
-def define_pipe(lang):
+def define_pipe(lang, segmenter="spacy"):
   '''
-  Load the spacy nlp object for the specified language and add a sentencizer to the pipeline
+  Load the segmentation backend for the specified language, which splits the text of the articles into sentences of tokens
   Inputs:
-  	lang (str) : language code indicating the spacy language pipeline to load to get the language specific tokenizer
+  	lang (str) : language code indicating the language specific tokenizer to use
+  	segmenter (str) : `spacy` for a blank spacy pipeline with a sentencizer, `rules` for the faster regex and abbreviation-list backend, see `segmenters`
   Returns:
-  	nlp (spacy pipeline object) : a spacy pipeline for the language specified with a tokenizer and sentencizer 
+  	nlp (Segmenter) : a segmentation backend for the language specified ; a ValueError is raised if the backend does not support the language
   
   '''
-  if lang =="de":
-    from spacy.lang.de import German
-    nlp = German()
-  if lang == "it":
-    from spacy.lang.it import Italian
-    nlp = Italian()
-  if lang =="en":
-    from spacy.lang.en import English
-    nlp= English()
-  if lang == "es":
-    from spacy.lang.es import Spanish
-    nlp = Spanish()
-  
-  if lang == "fr":
-    from spacy.lang.fr import French
-    nlp = French()
-  if lang not in ['fr','de','en','it','es']:
-    print(f"lang {lang} not supported ")
-  
-  sentencizer = Sentencizer()
-
-  nlp.add_pipe("sentencizer")
+  nlp = get_segmenter(lang, segmenter)
   return nlp
   
 def url_to_hex_id(url):
@@ -237,118 +247,196 @@ def url_to_hex_id(url):
 
 ## to do?? add functionality to consolidate all to 1x file by adding offset ; offset can be added to k at line 70
 
+def tidy_text(text):
+  '''
+  Tidy the text of an article before it is segmented : non-breaking spaces, carriage returns, line breaks and tabs become spaces, and runs of spaces are reduced
+  '''
+  text = re.sub('\xa0',' ', text)
+  text = re.sub('\x0D', ' ', text)
+  text = re.sub('\r|\n|\t',' ',text)
+  text = re.sub('(  )+',' ',text)
+  text = re.sub('  ',' ',text)
+  return text
+
+def iter_conll_sentences(articles, nlp):
+  '''
+  Make the conll string of each sentence of a stream of articles, as the articles are segmented
+  Inputs:
+  	articles : iterable : the dictionary of each article, with its text under `txt` and its metadata, in the order they are written to the comments
+  	nlp : Segmenter : segmentation backend for the specified language, as made by `define_pipe`
+  Yields:
+  	current_sent_tidy : str : the conll string of a sentence, with its comment lines
+  '''
+  ## tidy the text of every article, then pass the texts to the segmentation backend as a batch, which gives the sentences of each article in turn ; tee only holds the articles the backend has read ahead
+  articles, text_articles = itertools.tee(articles)
+  texts = (tidy_text(valueset['txt']) for valueset in text_articles)
+  for k, (valueset, sentences) in enumerate(zip(articles, nlp.segment_batch(texts))):
+    this_url = valueset['url']
+    hex_id = url_to_hex_id(this_url)
+    metas = "".join([(f'# {key}={value}\n') for key,value in valueset.items() if 'txt' not in key])    
+    ## iterate over the sentences, adding the metatext from the tokens and the metadata from the dictionary to make the sentence-level annotations
+    for s, sentence in enumerate(sentences):
+      current_sent = []
+      
+      meta_text = " ".join(sentence)
+      meta_lines = f"\n# Article_num = {str(k+1)}\n# sent_ID = {hex_id}-{int(s+1)}\n# sent_id_serial = {int(s+1)}\n{metas}\n# text = {meta_text}\n"
+      current_sent.append(meta_lines)
+      ## iterate over the tokens in the sentence to make token-level conll strings
+      for t, token in enumerate(sentence):
+        line = (f'{int(t)+1}\t{token}{LINE_TAIL}')
+        current_sent.append(line)
+      # add a line break at the end of every sentence
+      current_sent.append("\n")
+      # at the end of every sentence, join all the lines into a single string
+      current_sent_tidy = "".join([c for c in current_sent])  
+      yield current_sent_tidy
+
 def make_conll_strings_from_json_with_allmetas(input_file, nlp, method=None, tidy_dict=None):
   '''
   Make a list of conll strings for each input file
   Inputs:
   	input_file : str : absolute path to a json file
-  	nlp : spacy nlp pipeline : nlp pipeline with tokenizer and sentencizer for the specified language
+  	nlp : Segmenter : segmentation backend for the specified language, as made by `define_pipe`
   Return:
   	file_output : list : a list of conll_strings, each article itself being a list of conll strings, which together constitute a valid conll document object
   '''
 
-  # define a special string for the empty conll fields
-  line_tail = "\t_\t_\t_\t_\t_\t_\t_\t_\n"
-  
   # if method is not none, 
   if method is not None:
     json_input_parsed = tidy_dict
   else:
   ##  open, read and parse the json data into a python dictionary
-    with open(input_file, 'r', encoding="UTF-8") as j:
+    with open_file(input_file, 'r') as j:
       json_input = j.read()
     json_input_parsed = json.loads(json_input)
 
-
-  # make a list to store the processed conll strings for each document, and make list of keys
-  file_output = []
-  key_list = list(json_input_parsed.keys())
-  ## iterate over the list of keys getting the text from the dictionary, and apply some text tidying steps before passing the raw text to the nlp object which will give a doc object
-  for k, input_key in enumerate(key_list):
-    valueset = json_input_parsed[input_key]
-    this_art = valueset['txt']
-    this_art = re.sub('\xa0',' ', this_art)
-    this_art = re.sub('\x0D', ' ', this_art)
-    this_art = re.sub('\r|\n|\t',' ',this_art)
-    this_art = re.sub('(  )+',' ',this_art)
-    this_art = re.sub('  ',' ',this_art)
-    this_url = valueset['url']
-    hex_id = url_to_hex_id(this_url)
-    doc = nlp(this_art)
-    ## iterate over the sentences, adding the metatext from the doc object and the metadata from the dictionary to make the sentence-level annotations
-    for s, sentence in enumerate(doc.sents):
-      current_sent = []
-      
-      metas = "".join([(f'# {key}={value}\n') for key,value in valueset.items() if 'txt' not in key])    
-      meta_text = " ".join([token.__str__() for token in sentence])
-      meta_lines = f"\n# Article_num = {str(k+1)}\n# sent_ID = {hex_id}-{int(s+1)}\n# sent_id_serial = {int(s+1)}\n{metas}\n# text = {meta_text}\n"
-      current_sent.append(meta_lines)
-      ## iterate over the tokens in the sentence to make token-level conll strings
-      for t, token in enumerate(sentence):
-        line = (f'{int(t)+1}\t{token.text}{line_tail}')
-        # print(f'{int(t)+1}\t{token.text}')
-        current_sent.append(line)
-      # add a line break at the end of every sentence
-      current_sent.append("\n")
-      # at the end of every sentence, join all the lines into a single string
-      current_sent_tidy = "".join([c for c in current_sent])  
-      file_output.append(current_sent_tidy)
-      
+  file_output = list(iter_conll_sentences(json_input_parsed.values(), nlp))
   return file_output
 
-def send_to_files(input_file, file_output, chunk_size=50000):
+def sentence_article_key(sentence):
   '''
-  Print conll strings to output file, in chunks of 50 000 sentences, to limit filesizes
+  Get the keys identifying the article of a conll sentence string made by `make_conll_strings_from_json_with_allmetas`
   Inputs:
-  	input_file (str) : absolute path to the json file taken as input
-  	file_output (str) : absolute output path to which a file will be written
-	chunk_size (int) : number of sentences to which to limit files ; default =50000, which yields 0.5-1.0 million words per file 
-  Returns : no return object ; a file is exported to the specified location
+  	sentence (str) : the conll string of a sentence, with its comment lines
+  Returns:
+  	art_key (tuple) : (url_hash, article_num, site) for the article
   '''
+  article_num = re.search(r'^# Article_num = (.*)$', sentence, re.M).group(1)
+  url_hash = re.search(r'^# sent_ID = (.*)-\d+$', sentence, re.M).group(1)
+  site = re.search(r'^# site=(.*)$', sentence, re.M).group(1)
+  return url_hash, article_num, site
 
-  # Calculate the number of files needed
-  num_files = math.ceil(len(file_output) / chunk_size)
-  
-  # Loop through the data in chunks and write to separate files
-  for i in range(num_files):
-      # Determine the start and end of the current chunk
-      start_idx = i * chunk_size
-      end_idx = start_idx + chunk_size
-      # Extract the current chunk of data
-      chunk = file_output[start_idx:end_idx]
-      subpart_num = f"{i + 1:02d}"
-      output_file = input_file.replace('.json', f'_part{subpart_num}.conll').replace('1_conllised_json','2_conllu')
-      # Write the chunk to a new file
-      with open(output_file, 'w', encoding='UTF-8') as f:
-          for line in tqdm(chunk, desc=f"Writing file {i+1}/{num_files}"):
-              outline = "".join([item for item in line])
+def iter_part_runs(file_output, chunk_size=50000, token_budget=None):
+  '''
+  Plan how a stream of sentences is split into parts, holding no more than an article in memory
+  Inputs:
+  	file_output (iterable) : the conll strings of the sentences, as made by `iter_conll_sentences`
+  	chunk_size (int) : number of sentences per part, used when no token budget is given
+  	token_budget (int) : maximum number of tokens per part ; parts are cut between articles, so that no article is split across parts, and an article longer than the budget makes a part of its own
+  Yields:
+  	(part, art_key, sentences, tokens) : tuple : the index of a part, then a run of consecutive sentences of an article which go to that part, with the key of the article, as given by `sentence_article_key`, and the number of tokens of the run
+  '''
+  part, part_tokens, n_sentences = 0, 0, 0
+  for art_key, group in itertools.groupby(file_output, key=sentence_article_key):
+    sentences = list(group)
+    sent_tokens = [sentence.count(LINE_TAIL) for sentence in sentences]
+    if token_budget is not None:
+      art_tokens = sum(sent_tokens)
+      if part_tokens > 0 and part_tokens + art_tokens > token_budget:
+        part, part_tokens = part + 1, 0
+      part_tokens += art_tokens
+      yield part, art_key, sentences, art_tokens
+      continue
+    # without a budget, parts are cut every chunk_size sentences, splitting the article at the cut
+    start = 0
+    while start < len(sentences):
+      end = start + min(len(sentences) - start, chunk_size - n_sentences % chunk_size)
+      yield n_sentences // chunk_size, art_key, sentences[start:end], sum(sent_tokens[start:end])
+      n_sentences += end - start
+      start = end
+
+def send_to_files(input_file, file_output, chunk_size=50000, token_budget=None, compression=None):
+  '''
+  Print conll strings to output files, with a sidecar index giving the byte offset and length of each article in each file, and a manifest giving the number of tokens, sentences and articles of each file
+  Inputs:
+  	input_file (str) : absolute path to the json file taken as input
+  	file_output (iterable) : the conll strings of the sentences, a list or a stream as made by `iter_conll_sentences` ; the sentences are written as they come, so that only the article being written is held in memory
+	chunk_size (int) : number of sentences to which to limit files when no token budget is given ; default =50000, which yields 0.5-1.0 million words per file 
+	token_budget (int) : default = None ; number of tokens to which to limit files, cutting files between articles, see `iter_part_runs`
+	compression (str) : default = None ; compression of the files written, see `with_compression` ; by default, files are compressed as the json file. Compressed files have no index, as offsets in the compressed stream cannot be seeked to
+  Returns :
+  	output_files (list) : absolute paths to the files exported, each with its index, to the specified location ; the parts of an earlier run of the json file not written again are removed
+  '''
+  runs = iter_part_runs(file_output, chunk_size=chunk_size, token_budget=token_budget)
+
+  # Loop through the parts and write to separate files
+  output_files, manifest = [], {}
+  for part, part_runs in itertools.groupby(runs, key=lambda run: run[0]):
+      subpart_num = f"{part + 1:02d}"
+      output_file = with_compression(input_file.replace('.json', f'_part{subpart_num}.conll').replace('1_conllised_json','2_conllu'), compression)
+      # Write the part to a new file, keeping track of the bytes written for each article : an article split across two files has an entry in the index of each
+      entries, offset, n_tokens, n_sentences = [], 0, 0, 0
+      with open_file(output_file, 'wb') as f:
+          for _, art_key, sentences, tokens in part_runs:
+              outline = "".join(sentences).encode('UTF-8')
               _ = f.write(outline)
+              entries.append([*art_key, offset, len(outline)])
+              offset += len(outline)
+              n_tokens += tokens
+              n_sentences += len(sentences)
+      if compression_of(output_file) is None:
+          write_index(output_file, entries)
+      manifest[part_stem(output_file)] = {"tokens": n_tokens, "sentences": n_sentences, "articles": len(entries)}
+      output_files.append(output_file)
+  write_manifest(strip_compression(input_file).replace('.json', MANIFEST_SUFFIX).replace('1_conllised_json','2_conllu'), manifest)
+  # the parts of an earlier run which are not in the new manifest, made with another token budget or compression, are removed with their index, so that no article is parsed twice
+  kept = set(output_files) | {index_path(output_file) for output_file in output_files if compression_of(output_file) is None}
+  part_prefix = strip_compression(input_file).replace('.json', '_part').replace('1_conllised_json','2_conllu')
+  for stale_file in glob_data(f'{glob.escape(part_prefix)}*.conll') + glob.glob(f'{glob.escape(part_prefix)}*.conll.idx'):
+      if stale_file not in kept and stale_file[len(part_prefix):].split('.')[0].isdigit():
+          os.remove(stale_file)
+  return output_files
               
 
-def process_one_file(input_file, nlp):
+def process_one_file(input_file, nlp, token_budget=TOKEN_BUDGET, compression=None, article_store=False):
   '''
   Function to serve as base for the partial function to be run once per pool
   Inputs :
     input_file: str : absolute path to input file to process
-    nlp : a spacy nlp pipeline object
+    nlp : Segmenter : a segmentation backend, as made by `define_pipe`
+    token_budget : int : number of tokens to which to limit conll files ; None to cut files every 50 000 sentences
+    compression : str : compression of the conll files, see `send_to_files`
+    article_store : bool : read the articles from the store of the json file, made by `build_store`, a batch at a time, rather than parsing the json file
+  Returns :
+    output_files : list : absolute paths to the conll files written
   '''
 
-  file_output = make_conll_strings_from_json_with_allmetas(input_file, nlp)
+  if article_store:
+    articles = iter_store_articles(store_path(input_file))
+  else:
+    with open_file(input_file, 'r') as j:
+      articles = json.load(j).values()
   print(f"processing {input_file}")      
-  send_to_files(input_file, file_output, chunk_size=50000)
+  # the sentences are streamed from the segmentation backend to the conll files
+  output_files = send_to_files(input_file, iter_conll_sentences(articles, nlp), chunk_size=50000, token_budget=token_budget, compression=compression)
+  return output_files
   
 
-def sent_json_to_conll(year, lang, nproc):
+def sent_json_to_conll(year, lang, nproc, token_budget=TOKEN_BUDGET, compression=None, segmenter="spacy", article_store=False):
   '''
   define the processing pipeline to run as in __main__
   Inputs :
   	year : string : year for which to process files
   	lang : string : language to be processed
   	nproc : int : number of processors to use in the pool
+  	token_budget : int : number of tokens to which to limit conll files ; None to cut files every 50 000 sentences
+  	compression : str : compression of the conll files, see `send_to_files`
+  	segmenter : str : segmentation backend, see `define_pipe`
+  	article_store : bool : load the articles of each json file once into a memory-mapped store, from which the workers read them a batch at a time, see `article_store`
   '''
 
   # step1 : gen list of files
-  input_files = glob.glob(f'/Volumes/HC3Beta/uncompressed_parquet/cc_{lang}/{year}/1_conllised_json/*.json')
+  input_files = glob_data(f'/Volumes/HC3Beta/uncompressed_parquet/cc_{lang}/{year}/1_conllised_json/*.json')
   print(f'{len(input_files)} to process')
   
   ## step2 make pool and use 2 safety-checks : n procs is less than cpu_count() and that nprocs is not less than the number of files to process.
@@ -360,9 +448,13 @@ def sent_json_to_conll(year, lang, nproc):
     print(f"Using pool size: {pool_size}")
   
   ## define nlp pipeline and make worker functuin
-  nlp = define_pipe(lang)
-  print(f'nlp loaded for {lang}')
-  worker_func = partial(process_one_file, nlp=nlp)
+  nlp = define_pipe(lang, segmenter)
+  print(f'{segmenter} segmenter loaded for {lang}')
+  if article_store:
+    # the stores are made before the pool starts, so that each json file is parsed once, in this process only
+    for input_file in tqdm(input_files, desc="Building article stores", unit="file"):
+      build_store(input_file)
+  worker_func = profiled(partial(process_one_file, nlp=nlp, token_budget=token_budget, compression=compression, article_store=article_store), "conll")
   
   # map work to pool
   with Pool(pool_size) as pool, tqdm(total=len(input_files), desc="Processing", unit="file") as pbar:
@@ -392,7 +484,10 @@ def parse_years(year_args):
   return years
     
 
-if __name__ == "__main__":
+def main(argv=None):
+    '''
+    Command line entry point : run with the arguments in argv, or with the arguments of the script if argv is None
+    '''
     parser = argparse.ArgumentParser(description="run step 1 to convert parquet to json files. Speed = about 30s per parquet file ≈ 4GB of parquet per min from external HDD\nrun step 2 to convert json to conllu files.")
 
     parser.add_argument(
@@ -416,12 +511,19 @@ if __name__ == "__main__":
     parser.add_argument(
         "-skip",default="",help="skip steps 1 -process parquet- or 2 -process json-")    
     parser.add_argument("--nproc", type=int, default=4, help="Number of parallel processes")
+    parser.add_argument("--token_budget", type=int, default=TOKEN_BUDGET, help="Number of tokens to which to limit conll files, cutting between articles ; 0 to cut every 50 000 sentences")
     parser.add_argument(
         "-lang", type=str, default="en",
         help="Language code (e.g., en, fr, de)"
     )
-
-    args = parser.parse_args()
+    parser.add_argument("--prefilter", nargs="?", const="", default=None, help="step 1 : reject the articles whose text is too short, mostly digits, markup or repeated lines, or not in the language filtered on, writing a report next to each parquet file ; optionally comma-separated thresholds over the defaults of quality_filter.py, e.g. min_chars=500,min_lang_score=off")
+    parser.add_argument("--article_store", action="store_true", help="step 2 : load the articles of each json file once into a memory-mapped Arrow file, from which the workers read batches of articles, instead of each worker parsing a whole json file")
+    parser.add_argument("--segmenter", type=str, default="spacy", choices=BACKENDS, help="sentence segmentation backend for step 2 : spacy (reference) or rules (faster regex and abbreviation lists)")
+    add_profile_arguments(parser)
+    add_compression_arguments(parser)
+
+    args = parser.parse_args(argv)
+    set_compression_options(args.compress_level, args.compress_threads)
     
     nproc = args.nproc
     year_arg = args.year
@@ -433,9 +535,14 @@ if __name__ == "__main__":
     mode = args.mode
     local_dir= args.local_dir
     skip_value = args.skip
-    for year in tidy_years:
-        if "1" not in skip_value:
-            get_json_from_parquet(filter_type, filter_value, number, mode, year, local_dir=local_dir)
-        if "2" not in skip_value:
-            sent_json_to_conll(year, lang, nproc)
+    prefilter = parse_thresholds(args.prefilter) if args.prefilter is not None else None
+    with profile_run(args.profile, "make_conll", mode=args.profile_mode, top=args.profile_top):
+        for year in tidy_years:
+            if "1" not in skip_value:
+                get_json_from_parquet(filter_type, filter_value, number, mode, year, local_dir=local_dir, compression=args.compress, prefilter=prefilter)
+            if "2" not in skip_value:
+                sent_json_to_conll(year, lang, nproc, token_budget=args.token_budget or None, compression=args.compress, segmenter=args.segmenter, article_store=args.article_store)
+
 
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,244 @@
+import collections, contextlib, cProfile, glob, io, json, os, pstats, signal, sys
+
+#################################################################################################
+##################################          profiling           #################################
+#################################################################################################
+
+## the profiling settings are passed to the worker processes through the environment, which the workers inherit whether the pools fork or spawn them
+PROFILE_ENV = "CC_NEWS_PROFILE"
+
+## default interval between two samples of the sampling profiler, in seconds of CPU time
+SAMPLE_INTERVAL = 0.005
+
+## the profiler of each stage in the current process, with the pid of the process, so that a forked worker does not reuse the profiler of its parent
+_profilers = {}
+
+
+def add_profile_arguments(parser):
+  '''
+  Add the profiling options to the argument parser of a script
+  '''
+  parser.add_argument("--profile", type=str, default=None, help="folder to write profiles to : the main process and every worker process are profiled, and the profiles of each stage are merged into a hotspot table, and collapsed stacks for flame graphs")
+  parser.add_argument("--profile_mode", type=str, default="sample", choices=["sample", "cprofile"], help="sample : low-overhead sampling of the call stack ; cprofile : exact call counts and times with cProfile")
+  parser.add_argument("--profile_top", type=int, default=30, help="number of functions in the hotspot tables")
+
+
+def frame_name(code):
+  '''
+  Name a function in the collapsed stacks and hotspot tables
+  '''
+  return f'{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})'
+
+
+class StackSampler:
+  '''
+  Sampling profiler : a SIGPROF timer interrupts the main thread every `interval` seconds of CPU time, and the call stack found is counted. The overhead depends on the interval, not on the number of calls, so hot loops are not slowed down as with cProfile.
+  '''
+  def __init__(self, interval=SAMPLE_INTERVAL):
+    self.interval = interval
+    self.stacks = collections.Counter()
+    self.previous_handler = None
+
+  def sample(self, signum, frame):
+    stack = []
+    while frame is not None:
+      stack.append(frame_name(frame.f_code))
+      frame = frame.f_back
+    self.stacks[";".join(reversed(stack))] += 1
+
+  def start(self):
+    self.previous_handler = signal.signal(signal.SIGPROF, self.sample)
+    signal.setitimer(signal.ITIMER_PROF, self.interval, self.interval)
+
+  def stop(self):
+    signal.setitimer(signal.ITIMER_PROF, 0, 0)
+    signal.signal(signal.SIGPROF, self.previous_handler or signal.SIG_DFL)
+
+  def dump(self, path):
+    '''
+    Write the stacks sampled so far as collapsed stacks : one line per stack, the frames from the outermost, separated by `;`, then the number of samples
+    '''
+    with open(f'{path}.collapsed', 'w', encoding='UTF-8') as f:
+      for stack, count in self.stacks.items():
+        _ = f.write(f'{stack} {count}\n')
+
+
+class CallProfiler:
+  '''
+  cProfile wrapped with the interface of StackSampler
+  '''
+  def __init__(self):
+    self.profile = cProfile.Profile()
+
+  def start(self):
+    self.profile.enable()
+
+  def stop(self):
+    self.profile.disable()
+
+  def dump(self, path):
+    self.profile.dump_stats(f'{path}.prof')
+
+
+def get_profiler(stage, settings):
+  '''
+  Get the profiler of a stage in the current process, making it on first use
+  Inputs:
+  	stage : str : name of the stage
+  	settings : dict : mode and interval, as set by `profile_run`
+  Returns:
+  	profiler : StackSampler or CallProfiler
+  '''
+  if stage not in _profilers or _profilers[stage][0] != os.getpid():
+    if settings["mode"] == "cprofile":
+      # a forked worker inherits the profile hook of its parent
+      sys.setprofile(None)
+      profiler = CallProfiler()
+    else:
+      profiler = StackSampler(settings["interval"])
+    _profilers[stage] = (os.getpid(), profiler)
+  return _profilers[stage][1]
+
+
+class ProfiledTask:
+  '''
+  Wrap the function run by the workers of a pool, so that each worker profiles the tasks it runs. The profile of a worker is written after each task, as the pools terminate their workers without letting them run exit handlers.
+  '''
+  def __init__(self, func, stage):
+    self.func = func
+    self.stage = stage
+
+  def __call__(self, *args, **kwargs):
+    settings = json.loads(os.environ[PROFILE_ENV])
+    profiler = get_profiler(self.stage, settings)
+    profiler.start()
+    try:
+      return self.func(*args, **kwargs)
+    finally:
+      profiler.stop()
+      stage_dir = f'{settings["dir"]}/{self.stage}'
+      os.makedirs(stage_dir, exist_ok=True)
+      profiler.dump(f'{stage_dir}/worker-{os.getpid()}')
+
+
+def profiled(func, stage):
+  '''
+  Get the function to pass to a pool for a stage : the function wrapped in a ProfiledTask when profiling is on, the function itself otherwise
+  Inputs:
+  	func : callable : the function run by the workers, picklable
+  	stage : str : name of the stage, under which the profiles of the workers are merged
+  Returns:
+  	func : callable
+  '''
+  if PROFILE_ENV not in os.environ:
+    return func
+  return ProfiledTask(func, stage)
+
+
+def read_collapsed(collapsed_files):
+  '''
+  Merge collapsed stack files
+  Returns:
+  	stacks : Counter : number of samples of each stack
+  '''
+  stacks = collections.Counter()
+  for collapsed_file in collapsed_files:
+    with open(collapsed_file, 'r', encoding='UTF-8') as f:
+      for line in f:
+        stack, count = line.rstrip('\n').rsplit(' ', 1)
+        stacks[stack] += int(count)
+  return stacks
+
+
+def hotspot_table(stacks, top=30):
+  '''
+  Make a table of the functions in which most samples were taken : `self` counts the samples in the function itself, `total` the samples in the function and the functions it called
+  Inputs:
+  	stacks : Counter : number of samples of each stack
+  	top : int : number of functions in the table
+  Returns:
+  	table : str : the table, sorted on self samples
+  '''
+  n_samples = sum(stacks.values())
+  self_counts, total_counts = collections.Counter(), collections.Counter()
+  for stack, count in stacks.items():
+    frames = stack.split(";")
+    self_counts[frames[-1]] += count
+    # a recursive function is counted once per stack
+    for frame in set(frames):
+      total_counts[frame] += count
+  lines = [f'{n_samples} samples', f'{"self %":>8} {"total %":>8} {"self":>8} {"total":>8}  function']
+  for frame, count in self_counts.most_common(top):
+    lines.append(f'{100 * count / n_samples:>8.2f} {100 * total_counts[frame] / n_samples:>8.2f} {count:>8} {total_counts[frame]:>8}  {frame}')
+  return "\n".join(lines) + "\n"
+
+
+def merge_stage(profile_dir, stage, top=30):
+  '''
+  Merge the profiles written by the main process and the workers for a stage, and write its report next to the stage folder
+  Inputs:
+  	profile_dir : str : the folder of the profiles
+  	stage : str : name of the stage
+  	top : int : number of functions in the hotspot table
+  Returns:
+  	table : str : the hotspot table, also written to {stage}_hotspots.txt ; the merged profile is written to {stage}.collapsed for the sampling profiler, {stage}.prof for cProfile
+  '''
+  collapsed_files = sorted(glob.glob(f'{profile_dir}/{stage}/*.collapsed'))
+  prof_files = sorted(glob.glob(f'{profile_dir}/{stage}/*.prof'))
+  if len(collapsed_files) > 0:
+    stacks = read_collapsed(collapsed_files)
+    with open(f'{profile_dir}/{stage}.collapsed', 'w', encoding='UTF-8') as f:
+      for stack, count in stacks.most_common():
+        _ = f.write(f'{stack} {count}\n')
+    table = hotspot_table(stacks, top) if len(stacks) > 0 else "0 samples\n"
+  elif len(prof_files) > 0:
+    stream = io.StringIO()
+    stats = pstats.Stats(*prof_files, stream=stream)
+    stats.dump_stats(f'{profile_dir}/{stage}.prof')
+    stats.sort_stats("tottime").print_stats(top)
+    table = stream.getvalue()
+  else:
+    return ""
+  with open(f'{profile_dir}/{stage}_hotspots.txt', 'w', encoding='UTF-8') as f:
+    _ = f.write(table)
+  return table
+
+
+@contextlib.contextmanager
+def profile_run(profile_dir, stage, mode="sample", top=30, interval=SAMPLE_INTERVAL):
+  '''
+  Profile the main process while the block runs, and let the pools started in the block profile their workers with `profiled`. When the block ends, the profiles of each stage are merged and their hotspot tables are printed.
+  Inputs:
+  	profile_dir : str : folder to write the profiles to ; profiling is off when None
+  	stage : str : name of the stage for the main process
+  	mode : str : `sample` for the sampling profiler, `cprofile` for cProfile
+  	top : int : number of functions in the hotspot tables
+  	interval : float : interval between two samples of the sampling profiler
+  '''
+  if profile_dir is None:
+    yield
+    return
+  # remove the profiles and reports of a previous run, which would be merged with this one or left next to it
+  for pattern in ['*/*-*.collapsed', '*/*-*.prof', '*.collapsed', '*.prof', '*_hotspots.txt']:
+    for old_file in glob.glob(f'{profile_dir}/{pattern}'):
+      os.remove(old_file)
+  os.makedirs(f'{profile_dir}/{stage}', exist_ok=True)
+  settings = {"dir": os.path.abspath(profile_dir), "mode": mode, "interval": interval}
+  previous_env = os.environ.get(PROFILE_ENV)
+  os.environ[PROFILE_ENV] = json.dumps(settings)
+  profiler = CallProfiler() if mode == "cprofile" else StackSampler(interval)
+  profiler.start()
+  try:
+    yield
+  finally:
+    profiler.stop()
+    profiler.dump(f'{settings["dir"]}/{stage}/parent-{os.getpid()}')
+    if previous_env is None:
+      del os.environ[PROFILE_ENV]
+    else:
+      os.environ[PROFILE_ENV] = previous_env
+    for stage_dir in sorted(glob.glob(f'{profile_dir}/*/')):
+      stage_name = os.path.basename(os.path.dirname(stage_dir))
+      table = merge_stage(profile_dir, stage_name, top)
+      if table:
+        print(f'\n{stage_name} :: {profile_dir}/{stage_name}_hotspots.txt\n{table}')
@@ -0,0 +1,188 @@
+import functools, importlib.util, json, os
+from segmenters import SPACY_FALLBACKS
+
+#################################################################################################
+###############################     text quality prefilter     ##################################
+#################################################################################################
+
+## thresholds of the prefilter : a row is rejected when one of its measures is below a `min_` or above a `max_` threshold ; a threshold set to None is not applied
+DEFAULT_THRESHOLDS = {
+  "min_chars": 200,
+  "max_chars": None,
+  "min_alpha_ratio": 0.6,
+  "max_digit_ratio": 0.15,
+  "max_markup_ratio": 0.03,
+  "min_avg_word_len": 2.5,
+  "max_avg_word_len": 12.0,
+  "max_repeated_lines": 0.3,
+  "min_lang_score": 0.8,
+}
+
+## the measure each threshold applies to, as made by `quality_measures`
+MEASURES = {name: name[4:] for name in DEFAULT_THRESHOLDS}
+
+## characters of tables, templates and markup left in the text by the extraction
+MARKUP_RE = r'[<>{}\[\]|=\\#*^~_]'
+
+## the languages the target language is told apart from by the language score
+PROFILE_LANGS = ["en", "fr", "de", "it", "es", "pt", "nl"]
+
+## number of characters at the start of each text the language score is computed on : enough to tell the language, and the cost of the score does not grow with the length of the articles
+LANG_SAMPLE_CHARS = 2000
+
+## number of rejected rows listed in the report of a shard, with their url and reasons
+REPORT_ROWS = 1000
+
+
+def parse_thresholds(threshold_arg):
+  '''
+  Parse thresholds such as `min_chars=500,min_lang_score=off` over the defaults
+  Inputs:
+  	threshold_arg : str : comma-separated name=value pairs, `off` or `none` to not apply a threshold ; empty for the defaults
+  Returns:
+  	thresholds : dict : a value or None for each of DEFAULT_THRESHOLDS
+  '''
+  thresholds = dict(DEFAULT_THRESHOLDS)
+  for part in filter(None, [part.strip() for part in threshold_arg.split(",")]):
+    name, _, value = part.partition("=")
+    if name not in DEFAULT_THRESHOLDS:
+      raise ValueError(f"Unknown threshold: {name} ; use {list(DEFAULT_THRESHOLDS)}")
+    thresholds[name] = None if value.lower() in ("off", "none") else float(value)
+  return thresholds
+
+
+@functools.lru_cache(maxsize=None)
+def load_stop_words(lang):
+  '''
+  Load the spacy stop word list of a language : the list is read from its module alone, as importing the language package would import spacy and the tokenizer data of the language
+  Returns:
+  	stop_words : set : the stop words, empty when spacy has no list for the language
+  '''
+  spacy_spec = importlib.util.find_spec("spacy")
+  if spacy_spec is None:
+    return set()
+  stop_words_file = os.path.join(spacy_spec.submodule_search_locations[0], "lang", lang, "stop_words.py")
+  if not os.path.exists(stop_words_file):
+    return set()
+  spec = importlib.util.spec_from_file_location(f"_stop_words_{lang}", stop_words_file)
+  module = importlib.util.module_from_spec(spec)
+  spec.loader.exec_module(module)
+  return module.STOP_WORDS
+
+
+@functools.lru_cache(maxsize=None)
+def lang_profiles(lang):
+  '''
+  Make the character trigram profile of a language and of the languages it is told apart from, from the spacy stop word lists : function words make up much of any text, so their trigrams are enough to tell languages apart, without a model or data to download. Only the trigrams of one language are kept in its profile.
+  Inputs:
+  	lang : str : language code ; fro, frm and ang use the lists of the language spacy tokenizes them as
+  Returns:
+  	profiles : dict : the trigrams of each language, the target language first ; empty when spacy has no stop words for the language, or none of its trigrams are its own
+  '''
+  trigrams = {}
+  # a language scored with the list of another, such as fro with the French list, is not told apart from that language
+  spacy_lang = SPACY_FALLBACKS.get(lang, lang)
+  for profile_lang in [lang] + [other for other in PROFILE_LANGS if other not in (lang, spacy_lang)]:
+    stop_words = load_stop_words(SPACY_FALLBACKS.get(profile_lang, profile_lang))
+    if not stop_words:
+      if profile_lang == lang:
+        return {}
+      continue
+    trigrams[profile_lang] = {f" {word} "[i:i + 3] for word in stop_words if word.isalpha() for i in range(len(word))}
+  profiles = {}
+  for profile_lang, grams in trigrams.items():
+    others = set().union(*[other_grams for other_lang, other_grams in trigrams.items() if other_lang != profile_lang])
+    profiles[profile_lang] = sorted(grams - others)
+  # no trigram is left to the target language when its list is shared by the others : it gets no language score
+  if not profiles[lang]:
+    return {}
+  return profiles
+
+
+def quality_measures(lang=None, text_col="plain_text"):
+  '''
+  Make the measures of the prefilter as polars expressions over the text, so that they are computed in the scan of the parquet file, over all the rows at once
+  Inputs:
+  	lang : str : default = None ; language the text should be in, for the language score ; no score is computed when None or when the language has no profile
+  	text_col : str : the column of the text
+  Returns:
+  	measures : list : an expression per measure, named as in MEASURES
+  '''
+  import polars as pl
+  text = pl.col(text_col).fill_null("")
+  n_chars = text.str.len_chars()
+  denominator = pl.max_horizontal(n_chars, 1)
+  n_words = pl.max_horizontal(text.str.count_matches(r'\S+'), 1)
+  lines = text.str.split("\n").list.eval(pl.element().str.strip_chars()).list.eval(pl.element().filter(pl.element() != ""))
+  measures = [
+    n_chars.alias("chars"),
+    (text.str.count_matches(r'\p{L}') / denominator).alias("alpha_ratio"),
+    (text.str.count_matches(r'\p{N}') / denominator).alias("digit_ratio"),
+    (text.str.count_matches(MARKUP_RE) / denominator).alias("markup_ratio"),
+    ((n_chars - text.str.count_matches(r'\s')) / n_words).alias("avg_word_len"),
+    # share of the non-empty lines which repeat an earlier line, as in menus, cookie notices and lists of links
+    (1 - lines.list.n_unique() / pl.max_horizontal(lines.list.len(), 1)).alias("repeated_lines"),
+  ]
+  profiles = lang_profiles(lang) if lang is not None else {}
+  if profiles:
+    # the trigrams of each language are counted in the lowercased letters of the start of the text, words padded with spaces ; the score is the count of the target language over that of the best language, 1 when the target language matches best
+    letters = pl.concat_str([pl.lit(" "), text.str.slice(0, LANG_SAMPLE_CHARS).str.to_lowercase().str.replace_all(r'[^\p{L}]+', " "), pl.lit(" ")])
+    hits = [letters.str.extract_many(grams, overlapping=True).list.len() for grams in profiles.values()]
+    measures.append((hits[0] / pl.max_horizontal(*hits, 1)).alias("lang_score"))
+  return measures
+
+
+def prefilter(df, lang=None, thresholds=None, text_col="plain_text", url_col="requested_url"):
+  '''
+  Reject the rows whose text is too short, mostly digits, markup or repeated lines, or not in the expected language
+  Inputs:
+  	df : polars DataFrame or LazyFrame : the rows of a shard
+  	lang : str : default = None ; language the text should be in, see `quality_measures`
+  	thresholds : dict : default = None ; thresholds as made by `parse_thresholds`, DEFAULT_THRESHOLDS when None
+  	text_col : str : the column of the text
+  	url_col : str : the column of the url, listed in the report
+  Returns:
+  	kept : polars DataFrame : the rows which pass every threshold, with the columns of df
+  	report : dict : the thresholds, the number of rows kept and rejected, the number of rows rejected by each threshold, and the url and reasons of the rejected rows
+  '''
+  import polars as pl
+  thresholds = DEFAULT_THRESHOLDS if thresholds is None else thresholds
+  columns = df.collect_schema().names()
+  measures = quality_measures(lang, text_col)
+  measured = {measure.meta.output_name() for measure in measures}
+  applied = {name: value for name, value in thresholds.items() if value is not None and MEASURES[name] in measured}
+  reasons = [pl.when(pl.col(MEASURES[name]) < value if name.startswith("min_") else pl.col(MEASURES[name]) > value).then(pl.lit(name)) for name, value in applied.items()]
+  scored = df.lazy().with_columns(measures).with_columns(pl.concat_list(reasons or [pl.lit(None, pl.String)]).list.drop_nulls().alias("reasons")).collect()
+
+  rejected = scored.filter(pl.col("reasons").list.len() > 0)
+  counts = rejected.select(pl.col("reasons").explode().value_counts(sort=True)).unnest("reasons") if rejected.height else None
+  report = {
+    "lang": lang if "lang_score" in measured else None,
+    "thresholds": applied,
+    "rows": scored.height,
+    "kept": scored.height - rejected.height,
+    "rejected": rejected.height,
+    "reasons": {} if counts is None else dict(zip(counts["reasons"], counts["count"])),
+    "rejected_rows": [[url, reasons] for url, reasons in rejected.select(url_col, "reasons").head(REPORT_ROWS).iter_rows()],
+  }
+  kept = scored.filter(pl.col("reasons").list.len() == 0).select(columns)
+  return kept, report
+
+
+def report_path(parquet_file):
+  '''
+  Get the path of the rejection report of a shard, written next to it ; it is not globbed as a parquet or a json file by the steps
+  '''
+  return f'{parquet_file[:-len(".parquet")]}.prefilter.json'
+
+
+def write_report(parquet_file, report):
+  '''
+  Write the rejection report of a shard next to it, as json
+  Returns:
+  	report_file : str : absolute path to the report
+  '''
+  report_file = report_path(parquet_file)
+  with open(report_file, 'w', encoding='UTF-8') as f:
+    json.dump({"file": os.path.basename(parquet_file), **report}, f, ensure_ascii=False, indent=1)
+  return report_file
@@ -0,0 +1,353 @@
+import argparse, glob, hashlib, json, logging, os, time
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+
+import make_conll, run_stanza, send_to_xml
+from profiling import add_profile_arguments, profile_run, profiled
+from compressed_io import add_compression_arguments, set_compression_options, with_compression
+from segmenters import BACKENDS
+from quality_filter import parse_thresholds
+from corpus_stats import STATS_SUFFIX, STORE_NAME, stats_path, merge_stats, drop_stats
+from article_index import index_path
+
+#################################################################################################
+##################################          functions           #################################
+#################################################################################################
+
+## the stages run after the parquet files have been downloaded, in pipeline order, and the folder of the standard hierarchy in which each stage writes its outputs
+STAGES = ["json", "conll", "parse", "xml"]
+STAGE_FOLDERS = {"parquet": "0_raw_parquet", "json": "1_conllised_json", "conll": "2_conllu", "parse": "3_conllu_out", "xml": "4_xml"}
+
+## default number of worker processes for each stage : parsing holds a Stanza model per worker, so it gets the smallest budget
+DEFAULT_WORKERS = {"json": 2, "conll": 4, "parse": 1, "xml": 4}
+
+## per-process state of the stage workers : models are loaded once per worker by the pool initializers
+_worker = {}
+
+
+def init_conll_worker(lang, segmenter="spacy"):
+  '''
+  Pool initializer for the conll stage : load the segmentation backend once per worker
+  '''
+  _worker["nlp"] = make_conll.define_pipe(lang, segmenter)
+
+
+def init_parse_worker(lang, my_size, depparseOnly):
+  '''
+  Pool initializer for the parse stage : load the Stanza pipeline once per worker
+  '''
+  _worker["nlp"] = run_stanza.load_nlp(lang, my_size, depparseOnly)
+
+
+def run_json_stage(input_file, params):
+  '''
+  Step 1 for a single parquet file : filter the rows and export them to json, one file per year
+  Inputs:
+  	input_file : str : absolute path to a parquet file in 0_raw_parquet
+  	params : dict : filter_type, filter_value and mode, as taken by `get_json_from_parquet`, and compression and prefilter if set
+  Returns:
+  	outputs : list : absolute paths to the json files written
+  '''
+  trimmed = make_conll.filter_parquet(input_file, params["filter_type"], params["filter_value"], prefilter=params.get("prefilter"))
+  if len(trimmed) == 0:
+    return []
+  my_arrays = make_conll.make_arrays(trimmed)
+  year = os.path.basename(input_file)[:4]
+  return make_conll.run_exporter_to_json_dict(my_arrays, input_file, params["mode"], year, params["filter_type"], params["filter_value"], compression=params.get("compression"))
+
+
+def run_conll_stage(input_file, params):
+  '''
+  Step 2 for a single json file : segment the articles and write them to conll files
+  Inputs:
+  	input_file : str : absolute path to a json file in 1_conllised_json
+  	params : dict : lang, and compression and segmenter if set
+  Returns:
+  	outputs : list : absolute paths to the conll files written
+  '''
+  return make_conll.process_one_file(input_file, _worker["nlp"], compression=params.get("compression"))
+
+
+def run_parse_stage(input_file, params):
+  '''
+  Step 3 for a single conll file : parse it with Stanza
+  Inputs:
+  	input_file : str : absolute path to a conll file in 2_conllu
+  	params : dict : lang, my_size and depparseOnly, as taken by `load_nlp`, and compression if set
+  Returns:
+  	outputs : list : absolute path to the parsed file, empty if the file was skipped for its sentence length
+  '''
+  output_name = run_stanza.make_output_name(os.path.basename(input_file), '_', params["lang"])
+  output_file = with_compression(input_file.replace(os.path.basename(input_file), output_name).replace(STAGE_FOLDERS["conll"], STAGE_FOLDERS["parse"]), params.get("compression"))
+  tokens, max_len = run_stanza.parse_one_file(_worker["nlp"], input_file, output_file)
+  if tokens is None:
+    print(f'\tSkipping {input_file} : max_len exceeded:: {max_len}')
+    return []
+  return [output_file]
+
+
+def run_xml_stage(input_file, params):
+  '''
+  Step 4 for a single parsed file : convert it to TEI XML
+  Inputs:
+  	input_file : str : absolute path to a parsed conll file in 3_conllu_out
+  	params : dict : year and lang, as taken by `process_file`, and compression if set
+  Returns:
+  	outputs : list : absolute paths to the xml file written and to its statistics
+  '''
+  logger = logging.getLogger("file_processor")
+  if send_to_xml.process_file(input_file, params["year"], params["lang"], logger, params.get("compression")) == 1:
+    raise RuntimeError(f'XML conversion failed for {input_file}')
+  xml_file = send_to_xml.make_xml_name(input_file, params.get("compression"))
+  return [xml_file, stats_path(xml_file)]
+
+
+STAGE_FUNCS = {"json": run_json_stage, "conll": run_conll_stage, "parse": run_parse_stage, "xml": run_xml_stage}
+
+
+def file_hash(input_file, previous=None):
+  '''
+  Get the sha256 of the content of a file, reusing the hash recorded in a previous run when the size and modification time of the file are unchanged
+  Inputs:
+  	input_file : str : absolute path to a file
+  	previous : dict : the state entry of a previous run for this file, or None
+  Returns:
+  	fingerprint : dict : size, mtime and sha256 of the file
+  '''
+  stat = os.stat(input_file)
+  if previous is not None and previous["size"] == stat.st_size and previous["mtime"] == stat.st_mtime:
+    return {"size": stat.st_size, "mtime": stat.st_mtime, "sha256": previous["sha256"]}
+  sha256 = hashlib.sha256()
+  with open(input_file, 'rb') as f:
+    for block in iter(lambda: f.read(1 << 20), b''):
+      sha256.update(block)
+  return {"size": stat.st_size, "mtime": stat.st_mtime, "sha256": sha256.hexdigest()}
+
+
+def params_hash(params):
+  '''
+  Get a hash of the parameters of a stage, so that changing a parameter reruns the stage
+  '''
+  return hashlib.sha256(json.dumps(params, sort_keys=True).encode('utf-8')).hexdigest()
+
+
+def load_state(state_file):
+  '''
+  Load the pipeline state : for each stage and input file, the fingerprint of the input, the hash of the parameters and the outputs produced. The outputs of one stage being the inputs of the next, the state records the lineage of every file as a DAG
+  Inputs:
+  	state_file : str : absolute path to the state file
+  Returns:
+  	state : dict : the state, empty if no previous run
+  '''
+  if os.path.exists(state_file) is False:
+    return {}
+  with open(state_file, 'r', encoding='UTF-8') as f:
+    return json.load(f)
+
+
+def save_state(state, state_file):
+  '''
+  Write the pipeline state, replacing the previous state file atomically so that an interrupted run never leaves a truncated state
+  '''
+  tmp_file = f'{state_file}.tmp'
+  with open(tmp_file, 'w', encoding='UTF-8') as f:
+    json.dump(state, f, indent=1)
+  os.replace(tmp_file, state_file)
+
+
+def run_pipeline(root, year, lang, filter_type, filter_value, mode="X", my_size=1, depparseOnly="F", workers=None, stop_after="xml", compression=None, segmenter="spacy", prefilter=None):
+  '''
+  Run steps 1 to 4 for a year, as each file becomes available : the conll files of a json file are parsed as soon as they are written, and a parsed file is converted to XML while Stanza is still parsing the rest. A stage is skipped for a file when the content of the file and the parameters of the stage are unchanged since the last run and its outputs still exist. When a stage run again no longer produces some of the outputs of the last run, they are removed, with the files made from them by the later stages.
+  Inputs:
+  	root : str : absolute path to the folder holding the year folders, each with the standard hierarchy 0_raw_parquet, 1_conllised_json, 2_conllu, 3_conllu_out, 4_xml
+  	year : str : a year as 4 characters
+  	lang : str : language code, for the spacy and Stanza pipelines and the XML
+  	filter_type : str : `lang` or `domain`, as in `filter_parquet`
+  	filter_value : str : a language code or a domain, as in `filter_parquet`
+  	mode : str : `S` for strict year matching, as in `run_exporter_to_json_dict`
+  	my_size : int, float or str : batch size for Stanza, as in `set_batch_sizes`
+  	depparseOnly : str : `T` to run only the dependency parser, as in `load_nlp`
+  	workers : dict : number of worker processes for each stage ; defaults to DEFAULT_WORKERS
+  	stop_after : str : the last stage to run
+  	compression : str : compression of the files written, see `with_compression` ; by default, json files are not compressed and the files of the later stages are compressed as their input
+  	segmenter : str : segmentation backend of the conll stage, see `define_pipe`
+  	prefilter : dict : default = None ; thresholds of the text quality prefilter of the json stage, see `filter_parquet`
+  Returns:
+  	counts : dict : number of tasks run, skipped and failed
+  '''
+  year_dir = f'{root}/{year}'
+  for folder in STAGE_FOLDERS.values():
+    os.makedirs(f'{year_dir}/{folder}', exist_ok=True)
+  workers = {**DEFAULT_WORKERS, **(workers or {})}
+  last_stage = STAGES.index(stop_after)
+
+  params = {
+    "json": {"filter_type": filter_type, "filter_value": filter_value, "mode": mode},
+    "conll": {"lang": lang},
+    "parse": {"lang": lang, "my_size": str(my_size), "depparseOnly": depparseOnly},
+    "xml": {"year": year, "lang": lang},
+  }
+  # only set when given, so that the parameters, and the state of the files, are unchanged for runs without compression
+  if compression is not None:
+    for stage in STAGES:
+      params[stage]["compression"] = compression
+  # likewise, the conll files are only made again when the backend is not the default one
+  if segmenter != "spacy":
+    params["conll"]["segmenter"] = segmenter
+  # the json files are made again when the prefilter is turned on or its thresholds change
+  if prefilter is not None:
+    params["json"]["prefilter"] = prefilter
+  initializers = {"conll": (init_conll_worker, (lang, segmenter)), "parse": (init_parse_worker, (lang, my_size, depparseOnly))}
+
+  state_file = f'{year_dir}/pipeline_state.json'
+  state = load_state(state_file)
+  executors, pending = {}, {}
+  counts = {"run": 0, "skipped": 0, "failed": 0}
+  # the xml files of this run, whether converted or skipped, and those of past runs removed : only their statistics are merged into the store
+  xml_outputs, removed_xmls = [], []
+
+  def get_executor(stage):
+    # pools are only started for the stages which have work, so that no model is loaded when nothing is to be parsed
+    if stage not in executors:
+      initializer, initargs = initializers.get(stage, (None, ()))
+      executors[stage] = ProcessPoolExecutor(max_workers=workers[stage], initializer=initializer, initargs=initargs)
+    return executors[stage]
+
+  def schedule(stage, input_file):
+    key = f'{stage}:{input_file}'
+    previous = state.get(key)
+    fingerprint = file_hash(input_file, previous)
+    stage_params = params_hash(params[stage])
+    if previous is not None and previous["sha256"] == fingerprint["sha256"] and previous["params"] == stage_params and all(os.path.exists(o) for o in previous["outputs"]):
+      counts["skipped"] += 1
+      # record the new modification time of a file rewritten with the same content, so that it is not hashed again on the next run
+      state[key] = {**previous, **fingerprint}
+      if stage == "xml":
+        xml_outputs.append(previous["outputs"])
+      schedule_outputs(stage, previous["outputs"])
+      return
+    future = get_executor(stage).submit(profiled(STAGE_FUNCS[stage], stage), input_file, params[stage])
+    pending[future] = (stage, input_file, fingerprint, stage_params)
+
+  def schedule_outputs(stage, outputs):
+    if STAGES.index(stage) < last_stage:
+      for output in outputs:
+        schedule(STAGES[STAGES.index(stage) + 1], output)
+
+  def remove_outputs(stage, outputs):
+    # the files a stage no longer produces are removed with their index, and so are the files made from them by the later stages, following the lineage recorded in the state
+    for output in outputs:
+      for stale_file in (output, index_path(output)):
+        if os.path.exists(stale_file):
+          os.remove(stale_file)
+      if stage == "xml" and not output.endswith(STATS_SUFFIX):
+        removed_xmls.append(output)
+      if STAGES.index(stage) < len(STAGES) - 1:
+        next_stage = STAGES[STAGES.index(stage) + 1]
+        previous = state.pop(f'{next_stage}:{output}', None)
+        if previous is not None:
+          remove_outputs(next_stage, previous["outputs"])
+
+  starttime = time.time()
+  for input_file in sorted(glob.glob(f'{year_dir}/{STAGE_FOLDERS["parquet"]}/*.parquet')):
+    schedule("json", input_file)
+
+  try:
+    while pending:
+      done, _ = wait(list(pending), return_when=FIRST_COMPLETED)
+      for future in done:
+        stage, input_file, fingerprint, stage_params = pending.pop(future)
+        try:
+          outputs = future.result()
+        except Exception as e:
+          counts["failed"] += 1
+          print(f'❌ {stage} failed for {input_file}: {e}')
+          # a failed conversion removes the xml file and its statistics : they are taken out of the store too
+          if stage == "xml" and f'{stage}:{input_file}' in state:
+            removed_xmls.extend(state[f'{stage}:{input_file}']["outputs"][:1])
+          continue
+        counts["run"] += 1
+        previous = state.get(f'{stage}:{input_file}')
+        if previous is not None:
+          remove_outputs(stage, [output for output in previous["outputs"] if output not in outputs])
+        state[f'{stage}:{input_file}'] = {**fingerprint, "params": stage_params, "outputs": outputs}
+        if stage == "xml":
+          xml_outputs.append(outputs)
+        save_state(state, state_file)
+        print(f'✅ {stage} : {os.path.basename(input_file)} -> {len(outputs)} file(s)')
+        schedule_outputs(stage, outputs)
+  finally:
+    for executor in executors.values():
+      executor.shutdown()
+    save_state(state, state_file)
+
+  # the statistics of the xml files of this run are merged into the store of the year, and those of the xml files removed are taken out of it ; statistics left in the folder by other runs are not merged
+  if last_stage == STAGES.index("xml"):
+    store = f'{year_dir}/{STORE_NAME}'
+    n_dropped = drop_stats(store, removed_xmls) if removed_xmls and os.path.exists(store) else 0
+    n_merged = merge_stats(store, sorted(stats_file for outputs in xml_outputs for stats_file in outputs[1:]))
+    print(f"{n_merged} files merged into the statistics store {store}, {n_dropped} removed")
+
+  print(f"Pipeline complete in {time.time() - starttime:.0f}s : {counts['run']} run, {counts['skipped']} skipped, {counts['failed']} failed")
+  return counts
+
+
+def parse_workers(workers_arg):
+  '''
+  parse a `stage=n,stage=n` string into a dictionary of worker budgets
+  '''
+  workers = {}
+  for part in workers_arg.split(","):
+    if part.strip():
+      stage, n = part.split("=")
+      if stage.strip() not in STAGES:
+        raise ValueError(f"Unknown stage: {stage}")
+      workers[stage.strip()] = int(n)
+  return workers
+
+#################################################################################################
+############################       actual processing starts here       ##########################
+#################################################################################################
+
+
+def main(argv=None):
+    '''
+    Command line entry point : run with the arguments in argv, or with the arguments of the script if argv is None
+    '''
+
+    parser = argparse.ArgumentParser(
+    	prog='run_pipeline',
+    	formatter_class=argparse.RawTextHelpFormatter,
+    	description='''\
+    Run steps 1 to 4 on the parquet files of a year, skipping the work already done
+
+    Examples of usage:
+    ## filter the French articles of the parquet files in /data/cc_fr/2020/0_raw_parquet, and take them through to XML, with 2 Stanza workers
+    run_pipeline.py -year 2020 -lang fr -root /data/cc_fr -filter_type lang -filter_value fr -size 2 --workers parse=2
+    '''
+    )
+    parser.add_argument("-year", "-y", nargs="+", help="Year or list of years", required=True)
+    parser.add_argument("-lang", type=str, default="en", help="Language code (e.g., en, fr, de)")
+    parser.add_argument("-root", type=str, default=None, help="folder holding the year folders ; default is the cc_LANG folder on the external drive")
+    parser.add_argument("-filter_type", type=str, default="lang", help="filter_type: domain or lang")
+    parser.add_argument("-filter_value", type=str, default=None, help="url or language ; default is the language")
+    parser.add_argument("-mode", default="X", help="Processing mode : S for strict to get only year_matches for source and scrape")
+    parser.add_argument("-size", default="1", help="integer value for size of batch : x for all except pos_batch_max_tokens == 16x")
+    parser.add_argument("-depparseOnly", default="F", help="Run dependency parsing only")
+    parser.add_argument("--workers", type=str, default="", help="worker processes per stage, e.g. json=2,conll=4,parse=1,xml=4")
+    parser.add_argument("--stop_after", type=str, default="xml", choices=STAGES, help="last stage to run")
+    parser.add_argument("--prefilter", nargs="?", const="", default=None, help="reject the articles whose text is too short, mostly digits, markup or repeated lines, or not in the language filtered on, before the conll stage, writing a report next to each parquet file ; optionally comma-separated thresholds over the defaults of quality_filter.py, e.g. min_chars=500,min_lang_score=off")
+    parser.add_argument("--segmenter", type=str, default="spacy", choices=BACKENDS, help="sentence segmentation backend of the conll stage : spacy (reference) or rules (faster regex and abbreviation lists)")
+    add_profile_arguments(parser)
+    add_compression_arguments(parser)
+    args = parser.parse_args(argv)
+    set_compression_options(args.compress_level, args.compress_threads)
+
+    root = args.root if args.root is not None else f'/Volumes/HC3Beta/uncompressed_parquet/cc_{args.lang}'
+    filter_value = args.filter_value if args.filter_value is not None else args.lang
+    with profile_run(args.profile, "run_pipeline", mode=args.profile_mode, top=args.profile_top):
+        for year in make_conll.parse_years(args.year):
+            run_pipeline(root, year, args.lang, args.filter_type, filter_value, mode=args.mode, my_size=args.size, depparseOnly=args.depparseOnly, workers=parse_workers(args.workers), stop_after=args.stop_after, compression=args.compress, segmenter=args.segmenter, prefilter=parse_thresholds(args.prefilter) if args.prefilter is not None else None)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,28 +1,142 @@
-import stanza, glob, time, argparse, os
-from stanza.utils.conll import CoNLL
+## stanza is imported in the functions using it, so that the command line starts without loading torch
+import time, argparse, os
 from tqdm import tqdm
+from conll_reader import read_conll_sentences, count_tokens, max_sentence_length
+from annotation_cache import AnnotationCache, pipeline_signature, CACHE_MAX_BYTES
+from work_queue import seed_queue, claimed_files, mark_failed, queue_status
+from conll_manifest import sort_by_cost
+from corpus_stats import FileStats
+from profiling import add_profile_arguments, profile_run
+from compressed_io import add_compression_arguments, set_compression_options, open_file, with_compression, compression_of, glob_data
 
-def write_annotations_to_file(conll_output, input_file, myletter, lang):
+def make_output_name(input_file, myletter, lang):
+	'''
+	Make the name of the output file for an input file, explicitating that it's output and sending it to the tag_output directory
+	Inputs:
+		input_file : str: absolute path to the file taken as input
+		myletter : str : additional level of nesting or extending of the output path
+		lang : str : the language code of the pipeline
+	Returns:
+		output_file : str : absolute path to the output file
+	'''
+	output_file = input_file.replace('conll',f'{myletter}_{lang}_OUT.conll').replace('tag_input','tag_output')
+	return output_file
+
+def write_annotations_to_file(conll_output, output_file):
 	'''
 	Write the annotated document object to file
 	
 	Inputs: 
 		conll_output : CoNLL Document : a conll document object containing the annotated documents
-		input_file : str: absolute path to the file taken as input. This will be used to create the output file name and path
+		output_file : str: absolute path to the file to write, as made by `make_output_name`
 	Returns:
 		no return object : a file is written to the specified location and confirmation message printed to the console
 	'''
-	## make name of output file and check that the folder containing it exists, creating it if not
-	output_file = input_file.replace('conll',f'{myletter}_{lang}_OUT.conll').replace('tag_input','tag_output')
+	## check that the folder containing the output file exists, creating it if not
 	check_outputpath(output_file)
 	
 	# make a string from the conll_output and write it
 	string = "{:C}".format(conll_output)
-	with open(output_file, 'w', encoding='UTF-8') as w:
+	with open_file(output_file, 'w') as w:
 		_ = w.write(string)
 	print(f":::::			Exported to {output_file}")
 	
 
+def annotate_with_cache(nlp, sentences, cache):
+	'''
+	Annotate sentences, running only the sentences missing from the cache through the pipeline, once each, and splicing the cached annotations back in
+	Inputs:
+		nlp : stanza Pipeline object : the pipeline made by `load_nlp`
+		sentences : list : (comments, token_lines) tuples, as yielded by `read_conll_sentences`
+		cache : AnnotationCache : the cache of the pipeline
+	Returns:
+		annotated : list : (comments, annotated_lines) tuples, where annotated_lines is a string of the annotated token lines of the sentence
+	'''
+	from stanza.utils.conll import CoNLL
+	keys = [cache.key(token_lines) for comments, token_lines in sentences]
+	found = cache.get_many(keys)
+
+	## make a conll string of the sentences missing from the cache, each sentence only once however often it occurs
+	missing = {}
+	for key, (comments, token_lines) in zip(keys, sentences):
+		if key not in found and key not in missing:
+			missing[key] = "\n".join(token_lines)
+	if len(missing) > 0:
+		missing_doc = CoNLL.conll2doc(input_str="\n\n".join(missing.values()) + "\n\n")
+		annotated_doc = nlp(missing_doc)
+		new_annotations = {key: "\n".join([token.to_conll_text() for token in sent.tokens]) for key, sent in zip(missing, annotated_doc.sentences)}
+		cache.put_many(new_annotations)
+		found.update(new_annotations)
+
+	## the comments of each sentence are taken from the input file, with the sent_id Stanza adds when it reads a file
+	annotated = []
+	for index, (key, (comments, token_lines)) in enumerate(zip(keys, sentences)):
+		if not any(comment.startswith('# sent_id = ') for comment in comments):
+			comments = comments + [f'# sent_id = {index}']
+		annotated.append((comments, found[key]))
+	return annotated
+
+def parse_one_file(nlp, input_file, output_file, limit=1600, cache=None, write_conll=True, xml_file=None, year='', lang=''):
+	'''
+	Parse a single file with Stanza and write the annotations, unless a sentence of the file is too long to yield a useful dependency tree
+	Inputs:
+		nlp : stanza Pipeline object : the pipeline made by `load_nlp`
+		input_file : str : absolute path to the conll file to parse
+		output_file : str : absolute path to the conll file to write
+		limit : int : wordlimit after which a sentence is deemed 'too long' ; default = 1600
+		cache : AnnotationCache : default = None ; a sentence annotation cache, so that only the sentences missing from it are parsed
+		write_conll : bool : default = True ; write the annotations to output_file as conll, for archival
+		xml_file : str : default = None ; absolute path to which to write the annotations as TEI XML straight from the annotated document, with the article and sentence layout of send_to_xml, saving a write and parse of the conll ; its statistics are written next to it, see `corpus_stats`
+		year : str : year of the articles, for the XML ; required with xml_file
+		lang : str : language of the articles, for the XML
+	Returns:
+		tokens : int : number of tokens parsed, None if the file was skipped
+		max_len : int : length in tokens of the longest sentence in the file
+	'''
+	## check that no sentence has length exceeding `limit` with a streaming pass over the file, before building the Stanza document
+	max_len = max_sentence_length(input_file)
+	if max_len >= limit:
+		return None, max_len
+
+	if cache is not None:
+		sentences = list(read_conll_sentences(input_file))
+		tokens = sum([count_tokens(token_lines) for comments, token_lines in sentences])
+		print(f"\tProcessing {input_file} :: {tokens} tokens")
+		annotated = [(comments, [annotated_lines]) for comments, annotated_lines in annotate_with_cache(nlp, sentences, cache)]
+		if write_conll:
+			check_outputpath(output_file)
+			with open_file(output_file, 'w') as w:
+				for comments, annotated_lines in annotated:
+					_ = w.write("\n".join(comments + annotated_lines) + "\n\n")
+			print(f":::::			Exported to {output_file}")
+	else:
+		from stanza.utils.conll import CoNLL
+		if compression_of(input_file) is None:
+			source_doc = CoNLL.conll2doc(input_file)
+		else:
+			# Stanza only reads plain files : a compressed file is decompressed to a string
+			with open_file(input_file, 'r') as f:
+				source_doc = CoNLL.conll2doc(input_str=f.read())
+		## print the number of tokens in the doc to the console to allow for guesstimate of how long the doc will take to process, then annotate it
+		tokens = source_doc.num_tokens
+		print(f"\tProcessing {input_file} :: {tokens} tokens")
+
+		## run the nlp pipeline on the document, then write it
+		annotated_document =nlp(source_doc)
+		if write_conll:
+			write_annotations_to_file(annotated_document, output_file)
+		annotated = ((sent.comments, [token.to_conll_text() for token in sent.tokens]) for sent in annotated_document.sentences)
+
+	if xml_file is not None:
+		from send_to_xml import iter_articles, write_tei_xml
+		check_outputpath(xml_file)
+		## count the tokens, sentences and articles of the file on the way to the XML, and write them next to it, as send_to_xml does
+		file_stats = FileStats(year)
+		n_articles = write_tei_xml(iter_articles(file_stats.track(annotated), year, lang), xml_file)
+		file_stats.dump(xml_file, lang)
+		print(f":::::			Exported {n_articles} articles to {xml_file}")
+	return tokens, max_len
+
 def write_log(log_entry, launch_time):
 	'''
 	Simple helper to write-append a log entry to the logfile
@@ -87,6 +201,7 @@ def load_nlp(lang, my_size, depparseOnly):
 	Returns :
 		nlp : an nlp object == stanza Pipeline object is returned.
 	'''
+	import stanza
 	if lang != "grc":
 		mwt_batch_size, pos_batch_size, lemma_batch_size, depparse_batch_size, depparse_second_batch_size, pos_batch_maximum_tokens = set_batch_sizes(my_size)
 	
@@ -120,21 +235,43 @@ def load_nlp(lang, my_size, depparseOnly):
 			nlp = stanza.Pipeline(lang="en", package='ewt', processors="tokenize,mwt,pos,lemma,depparse", tokenize_pretokenized=True, tokenize_ssplit=True, mwt_batch_size = mwt_batch_size, pos_batch_size=pos_batch_size, pos_batch_maximum_tokens=pos_batch_maximum_tokens, lemma_batch_size=lemma_batch_size, depparse_batch_size=depparse_batch_size, depparse_second_batch_size=depparse_second_batch_size)
 	return nlp
 	
-def run_parsing(input_files, lang, my_size, depparseOnly):
+def run_parsing(input_files, lang, my_size, depparseOnly, queue_dir=None, cache_file=None, cache_max_bytes=CACHE_MAX_BYTES, write_conll=True, write_xml=False, year='', compression=None):
 	'''
 	Parse the files with Stanza
 	Inputs:
-		input_files : list : a list of files to process
+		input_files : list : a list of files to process ; with a queue, the list with which to seed the queue
 		lang : string : the 2-3 letter code of the language of the files to be processed as Stanza expects it
 		my_size : int : an integer used to define batch sizes for the processors in the NLP pipeline
 		depparseOnly : string/bool : string (T, True, F, False) or boolean (True, False) determining which processors in the NLP pipeline to call. If True or T, only the dependency parser will be called. For processing to be successful, input data needs to be well-formatted conll with at least POS, LEM annotations present.
+		queue_dir : str : default = None ; absolute path to a work queue shared between nodes, see `work_queue`. The files are added to the queue, then files are claimed from the queue until it is empty, whichever node seeded them
+		cache_file : str : default = None ; absolute path to a sentence annotation cache, see `annotation_cache`. Sentences already annotated by the same pipeline are taken from the cache rather than parsed again
+		cache_max_bytes : int : maximum size of the cache, beyond which the least recently used sentences are evicted
+		write_conll : bool : default = True ; write the annotations as conll
+		write_xml : bool : default = False ; also write the annotations as TEI XML next to the conll output, straight from the annotated documents, so that send_to_xml need not be run
+		year : str : year of the articles, for the XML ; required with write_xml
+		compression : str : default = None ; compression of the files written, see `with_compression` ; by default, files are compressed as their input
 	
 	'''
 
-	# check we have files to process
-	print(f'{len(input_files)} files found')
+	# without any output, the parsed data would be lost while the input files are moved to tag_output as done
+	if not write_conll and not write_xml:
+		raise ValueError("Nothing would be written : write_conll and write_xml are both False")
+	# the date of every article in the XML is made from the year
+	if write_xml and not year:
+		raise ValueError("The year of the articles is needed to write the XML")
+
+	# check we have files to process, and order them from the largest to the smallest in tokens from the manifests written by make_conll, falling back on sizes in bytes
+	input_files, costs = sort_by_cost(input_files)
+	print(f'{len(input_files)} files found :: {sum(costs.values())} tokens or bytes to process')
+	has_work = len(input_files)>0
+	if queue_dir is not None:
+		n_added = seed_queue(queue_dir, input_files)
+		status = queue_status(queue_dir)
+		print(f'{n_added} files added to queue {queue_dir} :: {status}')
+		has_work = status['done'] < status['tasks']
+		input_files = claimed_files(queue_dir)
 
-	if len(input_files)>0:
+	if has_work:
 		# prepare logs
 		log, error_log =[], []
 		launch_time = time.time()
@@ -157,58 +294,85 @@ def run_parsing(input_files, lang, my_size, depparseOnly):
 		batch_sizes= [f'{name}\t{key}\t{value}' for key,value in processor.config.items() if 'batch' in key for name, processor in nlp.processors.items()]
 		batch_sizes_tidy = "\t".join([chunk for chunk in batch_sizes])
 
+		## open the annotation cache for this pipeline
+		cache = None
+		if cache_file is not None:
+			cache = AnnotationCache(cache_file, pipeline_signature(nlp, lang), cache_max_bytes)
+
 	
 		with open(log_file_path ,'a', encoding='UTF-8') as k:
 			for f, input_file	in tqdm(enumerate (input_files)):
 				try:
-					## load input file and check that no sentence has length exceeding `max_len` ; if so, add to log and skip file
+					## parse the file unless a sentence has length exceeding `limit` ; if so, add to log and skip file
 					starttime = time.time()
-					source_doc = CoNLL.conll2doc(input_file)
-					max_len = max([len(sent.tokens) for sent in source_doc.sentences])
-					if max_len >= limit:
+					output_file = with_compression(make_output_name(input_file, myletter, lang), compression)
+					xml_file = output_file.replace('.conll', '.xml') if write_xml else None
+					tokens, max_len = parse_one_file(nlp, input_file, output_file, limit, cache=cache, write_conll=write_conll, xml_file=xml_file, year=year, lang=lang)
+					if tokens is None:
 						report_string = f'\tSkipping {input_file} : max_len exceeded:: {max_len}\n'
 						write_log(str(report_string), launch_time)
 		
-					if max_len < limit:
-						## print the number of tokens in the doc to the console to allow for guesstimate of how long the doc will take to process, then annotate it
-						tokens = source_doc.num_tokens
-						print(f"\tProcessing {input_file} :: {tokens} tokens")
-
-						## run the nlp pipeline on the document
-						annotated_document =nlp(source_doc)
-					
-						## make name for output file explicitating that it's output, sending to appropriate output directory, checking that parent path exists, then write
-						write_annotations_to_file(annotated_document, input_file, myletter, lang)
+					if tokens is not None:
 						source_new_name = input_file.replace('tag_input','tag_output')
 						os.rename(input_file, source_new_name)
 
 						## make reportstring, write to log
-						report_string = f'{starttime}\t{time.time()}\t{tokens}\t{input_file}\t{batch_sizes_tidy}\n'
+						## with a cache, add the running count of sentences found in the cache and parsed
+						cache_stats = f'\tcache_hits={cache.hits}\tcache_misses={cache.misses}\tcache_hit_rate={cache.hit_rate():.3f}' if cache is not None else ''
+						report_string = f'{starttime}\t{time.time()}\t{tokens}\t{input_file}\t{batch_sizes_tidy}{cache_stats}\n'
 						write_log(str(report_string),launch_time)
 				# log exceptions
 				except Exception as e:
 					report_string = f'{input_file}\t{e}\n'
 					print(report_string)
 					write_log(str(report_string), launch_time)		
+					# leave the file to be tried by another worker rather than marking it done
+					if queue_dir is not None:
+						mark_failed(queue_dir, input_file)
 
+		if cache is not None:
+			write_log(f'cache :: {cache.hits} hits, {cache.misses} misses, hit rate {cache.hit_rate():.3f}\n', launch_time)
+			cache.close()
 
-if __name__ == "__main__":
+
+def main(argv=None):
+	'''
+	Command line entry point : run with the arguments in argv, or with the arguments of the script if argv is None
+	'''
 	parser = argparse.ArgumentParser(description="parse conllised texts with LANGUAGE and specified batch SIZE")
 	parser.add_argument("-size",help="integer value for size of batch : x for all except pos_batch_max_tokens == 16x" )
 	parser.add_argument("-lang",help="language : use two/three letter codes that Stanza expects" )
 	parser.add_argument("-depparseOnly",help="Run dependency parsing only" )
 	parser.add_argument("--subf",help="path to subfolder to process",default='' )
-	args = parser.parse_args()
+	parser.add_argument("--cache",help="path to a sentence annotation cache : sentences already annotated by the same pipeline are not parsed again",default=None )
+	parser.add_argument("--cache_size_gb",type=float,help="maximum size of the annotation cache in GB",default=2 )
+	parser.add_argument("--xml",action="store_true",help="also write TEI XML straight from the annotated documents, as send_to_xml would" )
+	parser.add_argument("--no_conll",action="store_true",help="do not write the conll output ; use with --xml" )
+	parser.add_argument("-year",help="year of the articles, for the XML ; required with --xml",default='' )
+	parser.add_argument("--queue",help="path to a work queue directory shared between nodes : the files found are added to the queue, then files are pulled from the queue until it is empty",default=None )
+	add_profile_arguments(parser)
+	add_compression_arguments(parser)
+	args = parser.parse_args(argv)
+	if args.no_conll and not args.xml:
+		parser.error("--no_conll requires --xml, or nothing would be written")
+	if args.xml and not args.year:
+		parser.error("--xml requires -year, for the date of the articles")
+	set_compression_options(args.compress_level, args.compress_threads)
 	subf_name = args.subf
 	if subf_name == '':
-		input_files = sorted(glob.glob(f'/home/username/tag_input/*.conll'))
+		input_files = sorted(glob_data(f'/home/username/tag_input/*.conll'))
 		if len(input_files) ==0:
-			input_files = sorted(glob.glob(f'/home/username/tag_input/*.conllu'))
+			input_files = sorted(glob_data(f'/home/username/tag_input/*.conllu'))
 	if subf_name != '':
-		input_files = sorted(glob.glob(f'/home/username/tag_input/{subf_name}/*.conll'))
+		input_files = sorted(glob_data(f'/home/username/tag_input/{subf_name}/*.conll'))
 		if len(input_files) ==0:
-			input_files = sorted(glob.glob(f'/home/username/tag_input/{subf_name}/*.conllu'))
+			input_files = sorted(glob_data(f'/home/username/tag_input/{subf_name}/*.conllu'))
 	my_size = str(args.size)
 	lang = args.lang
 	depparseOnly = args.depparseOnly
-	run_parsing(input_files, lang, my_size, depparseOnly)
+	with profile_run(args.profile, "run_stanza", mode=args.profile_mode, top=args.profile_top):
+		run_parsing(input_files, lang, my_size, depparseOnly, queue_dir=args.queue, cache_file=args.cache, cache_max_bytes=int(args.cache_size_gb * 1024 ** 3), write_conll=not args.no_conll, write_xml=args.xml, year=args.year, compression=args.compress)
+
+
+if __name__ == "__main__":
+	main()
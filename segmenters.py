@@ -0,0 +1,233 @@
+import re, unicodedata
+
+#################################################################################################
+##############################     sentence segmentation backends     ###########################
+#################################################################################################
+
+## backends of step 2 : `spacy` is the reference, a blank spacy pipeline with a sentencizer ; `rules` is a regex and abbreviation-list tokenizer and sentence splitter, several times faster, which does not build spacy Doc objects
+BACKENDS = ["spacy", "rules"]
+
+## languages without a spacy tokenizer, tokenized with that of the closest language spacy has
+SPACY_FALLBACKS = {"fro": "fr", "frm": "fr", "ang": "en"}
+
+## single-character tokens ending a sentence : those of the spacy sentencizer for the scripts of the corpus ; the Greek question mark (; U+037E, often typed as ;) also ends sentences in grc
+SENTENCE_ENDS = {"!", ".", "?", "‼", "‽", "⁇", "⁈", "⁉", "！", "．", "？", "｡", "。"}
+EXTRA_SENTENCE_ENDS = {"grc": {";", ";"}}
+
+## opening punctuation starts a new sentence after a sentence end, e.g. the « of a quote or the ¿ of a Spanish question ; the spacy sentencizer leaves it at the end of the previous sentence
+OPENING = {"(", "[", "{", "«", "“", "‘", "„", "‹", "¿", "¡"}
+
+## abbreviations which keep their final period, per language ; capitalised forms are added for the lowercase ones, which may start a sentence
+ABBREVIATIONS = {
+  "fr": "J.-C. M. MM. Mme. Mmes. Mlle. Mlles. Dr. Pr. Me. St. Ste. etc. av. apr. cf. env. janv. févr. avr. juill. sept. oct. nov. déc. p. pp. art. vol. éd. chap. fig. tél. hab. max. min.",
+  "en": "Mr. Mrs. Ms. Dr. Prof. Sr. Jr. St. Mt. Inc. Ltd. Co. Corp. Bros. vs. etc. Jan. Feb. Mar. Apr. Jun. Jul. Aug. Sep. Sept. Oct. Nov. Dec. Gov. Sen. Rep. Gen. Col. Lt. Sgt. Capt. Rev. Hon. Calif. Mass. Fla. Ill. Mich. Minn. Wash. No. Nos. approx. dept. est. govt.",
+  "de": "Dr. Prof. Hr. Fr. Nr. Str. bzw. usw. ca. ggf. vgl. evtl. inkl. zzgl. Mio. Mrd. Jh. Abs. S. Tel. Dipl. Ing. geb. gest. bzgl. etc. Mo. Di. Mi. Do. Sa. So. Jan. Feb. Mär. Apr. Jun. Jul. Aug. Sep. Sept. Okt. Nov. Dez. Hrsg. Co.",
+  "it": "sig. sigg. sig.ra sig.na dott. dott.ssa prof. prof.ssa avv. ing. arch. geom. on. sen. dr. ecc. pag. pagg. cfr. tel. n. nr. ca. gen. feb. mar. apr. mag. giu. lug. ago. set. ott. nov. dic.",
+  "es": "Sr. Sra. Srta. Sres. Dr. Dra. Ud. Uds. Vd. Vds. Dña. etc. pág. págs. núm. núms. aprox. Av. Avda. Gral. Lic. Ing. Prof. tel. ene. feb. mar. abr. may. jun. jul. ago. sept. oct. nov. dic. Cía.",
+  "fro": "",
+  "frm": "",
+  "ang": "",
+  "grc": "",
+}
+
+## words keeping an apostrophe inside, in the languages splitting elisions
+ELISION_EXCEPTIONS = {"fr": {"aujourd'hui", "aujourd’hui", "prud'homme", "prud'hommes", "prud’homme", "prud’hommes"}, "it": {"po'"}}
+
+## rules of each language : elisions (l', qu') split from the next word, clitic pronouns split from the verb (-t-il, don't), hyphens split between letters, and elided words keeping their final apostrophe (δ', ἀλλ')
+LANG_RULES = {
+  "fr": {"elision": True, "clitics": r"-(?:t|je|tu|il|ils|elle|elles|on|nous|vous|ce|moi|toi|lui|leur|le|la|les|en|y|là|ci)", "hyphens": False, "ordinals": False, "final_elision": False},
+  "fro": {"elision": True, "clitics": None, "hyphens": False, "ordinals": False, "final_elision": False},
+  "frm": {"elision": True, "clitics": r"-(?:t|je|tu|il|ils|elle|elles|on|nous|vous|ce|moi|toi|lui|le|la|les|en|y)", "hyphens": False, "ordinals": False, "final_elision": False},
+  "it": {"elision": True, "clitics": None, "hyphens": False, "ordinals": False, "final_elision": False},
+  "en": {"elision": False, "clitics": r"(?:'s|'S|’s|n't|N'T|n’t|'ll|'re|'ve|'d|'m|’ll|’re|’ve|’d|’m)", "hyphens": True, "ordinals": False, "final_elision": False},
+  "ang": {"elision": False, "clitics": None, "hyphens": False, "ordinals": False, "final_elision": False},
+  "de": {"elision": False, "clitics": None, "hyphens": False, "ordinals": True, "final_elision": False},
+  "es": {"elision": False, "clitics": None, "hyphens": False, "ordinals": False, "final_elision": False},
+  "grc": {"elision": False, "clitics": None, "hyphens": False, "ordinals": False, "final_elision": True},
+}
+
+PREFIX_RE = re.compile(r"^(?:\.\.\.|…|[\(\[\{\"'«“‘„‹¿¡<*$£€¥#§])")
+SUFFIX_CHARS = r"(?:\.\.\.|…|[\)\]\}\"'»”’“‘›,;:!?%°€$£·\.])"
+ELISION_RE = re.compile(r"^[^\W\d_]{1,6}['’](?=[^\W\d_])")
+## urls and emails are kept whole, once the punctuation after them is split off
+URL_RE = re.compile(r"^(?:(?:https?://|www\.)\S*[\w/#=&%+-]|[\w.+-]+@[\w-]+(?:\.[\w-]+)+)$")
+## dotted abbreviations such as U.S., z.B., S.p.A., EE.UU. and initials such as J.
+DOTTED_RE = re.compile(r"^(?:[^\W\d_]+(?:\.[^\W\d_]+)+\.|[^\W\d_]\.)$")
+INITIAL_RE = re.compile(r"^[^\W\d_]\.$")
+FINAL_ELISION_RE = re.compile(r"^[^\W\d_]+['’ʼ]$")
+ORDINAL_RE = re.compile(r"^\d+\.$")
+DASH_RE = re.compile(r"([—–])")
+HYPHEN_RE = re.compile(r"(?<=[^\W\d_])(-)(?=[^\W\d_])")
+
+## number of whitespace-separated chunks whose tokens are kept in memory : words recur, so most chunks are split only once per worker
+CACHE_SIZE = 200000
+
+
+class Segmenter:
+  '''
+  Interface of the segmentation backends : a backend splits the text of an article into sentences of tokens
+  '''
+  name = None
+
+  def __init__(self, lang):
+    self.lang = lang
+
+  def segment(self, text):
+    '''
+    Split a text into sentences
+    Inputs:
+    	text : str : the text of an article, tidied as by `tidy_text` in make_conll
+    Returns:
+    	sentences : list : a list of tokens, as strings, for each sentence
+    '''
+    raise NotImplementedError
+
+  def segment_batch(self, texts):
+    '''
+    Split texts into sentences, yielding the sentences of each text in turn : backends override it when they are faster on batches of texts
+    '''
+    for text in texts:
+      yield self.segment(text)
+
+
+class SpacySegmenter(Segmenter):
+  '''
+  Reference backend : a blank spacy pipeline, with the tokenizer of the language, and a sentencizer
+  '''
+  name = "spacy"
+
+  def __init__(self, lang, batch_size=256):
+    super().__init__(lang)
+    import spacy
+    try:
+      self.nlp = spacy.blank(SPACY_FALLBACKS.get(lang, lang))
+    except ImportError:
+      raise ValueError(f"lang {lang} not supported by spacy : use the rules backend") from None
+    self.nlp.add_pipe("sentencizer")
+    self.batch_size = batch_size
+
+  def segment(self, text):
+    return [[token.text for token in sentence] for sentence in self.nlp(text).sents]
+
+  def segment_batch(self, texts):
+    for doc in self.nlp.pipe(texts, batch_size=self.batch_size):
+      yield [[token.text for token in sentence] for sentence in doc.sents]
+
+
+def is_punct(token):
+  return all(unicodedata.category(char).startswith("P") for char in token)
+
+
+class RuleSegmenter(Segmenter):
+  '''
+  Fast backend : each whitespace-separated chunk is split into tokens by removing prefixes and suffixes as spacy does, keeping abbreviations, urls and numbers whole, then sentences are split after the sentence-ending punctuation. The tokens of each chunk are cached, so the cost of a batch of articles is mostly that of the chunks not seen before.
+  '''
+  name = "rules"
+
+  def __init__(self, lang):
+    super().__init__(lang)
+    if lang not in LANG_RULES:
+      raise ValueError(f"lang {lang} not supported : the rules backend supports {', '.join(LANG_RULES)}")
+    rules = LANG_RULES[lang]
+    abbreviations = ABBREVIATIONS[lang].split()
+    self.abbreviations = set(abbreviations) | {abbreviation[0].upper() + abbreviation[1:] for abbreviation in abbreviations}
+    self.elision = rules["elision"]
+    self.elision_exceptions = ELISION_EXCEPTIONS.get(lang, set())
+    self.hyphens = rules["hyphens"]
+    self.ordinals = rules["ordinals"]
+    self.final_elision = rules["final_elision"]
+    suffixes = f'(?:{rules["clitics"]}|{SUFFIX_CHARS})' if rules["clitics"] else SUFFIX_CHARS
+    self.suffix_re = re.compile(f'{suffixes}$', re.I if lang in ("fr", "frm") else 0)
+    self.sentence_ends = SENTENCE_ENDS | EXTRA_SENTENCE_ENDS.get(lang, set())
+    self.cache = {}
+
+  def keep_whole(self, chunk):
+    '''
+    Check whether a chunk is a single token : an abbreviation, a dotted abbreviation or an initial, a url or an email, an ordinal in the languages writing them with a period, or an elided word in the languages keeping the apostrophe on it
+    '''
+    if chunk in self.abbreviations or URL_RE.match(chunk):
+      return True
+    if self.final_elision and FINAL_ELISION_RE.match(chunk):
+      return True
+    if DOTTED_RE.match(chunk):
+      # a single letter with a period is taken as an initial only when it is a capital, e.g. not the è of « così è. »
+      return INITIAL_RE.match(chunk) is None or chunk[0].isupper()
+    return self.ordinals and ORDINAL_RE.match(chunk) is not None
+
+  def split_infixes(self, chunk):
+    '''
+    Split the dashes inside a chunk, and the hyphens between letters in the languages splitting them
+    '''
+    tokens = [part for part in DASH_RE.split(chunk) if part] if ("—" in chunk or "–" in chunk) and len(chunk) > 1 else [chunk]
+    if self.hyphens and "-" in chunk and "." not in chunk and not URL_RE.match(chunk):
+      tokens = [part for token in tokens for part in HYPHEN_RE.split(token) if part]
+    return tokens
+
+  def tokenize_chunk(self, chunk):
+    '''
+    Split a whitespace-separated chunk of text into tokens
+    Returns:
+    	tokens : list : the tokens, as strings
+    '''
+    if chunk.isalnum():
+      return [chunk]
+    prefixes, suffixes = [], []
+    while len(chunk) > 1 and not self.keep_whole(chunk):
+      match = PREFIX_RE.match(chunk)
+      if match is None and self.elision and chunk.lower() not in self.elision_exceptions:
+        match = ELISION_RE.match(chunk)
+      if match is not None and match.end() < len(chunk):
+        prefixes.append(match.group())
+        chunk = chunk[match.end():]
+        continue
+      match = self.suffix_re.search(chunk)
+      if match is not None and match.start() > 0:
+        suffixes.append(match.group())
+        chunk = chunk[:match.start()]
+        continue
+      break
+    return prefixes + self.split_infixes(chunk) + suffixes[::-1]
+
+  def tokenize(self, text):
+    tokens = []
+    for chunk in text.split(" "):
+      if not chunk:
+        continue
+      chunk_tokens = self.cache.get(chunk)
+      if chunk_tokens is None:
+        if len(self.cache) >= CACHE_SIZE:
+          self.cache.clear()
+        chunk_tokens = self.cache[chunk] = self.tokenize_chunk(chunk)
+      tokens.extend(chunk_tokens)
+    return tokens
+
+  def segment(self, text):
+    sentences, current, seen_end = [], [], False
+    for token in self.tokenize(text):
+      # as in the spacy sentencizer, a sentence ends after its final punctuation and the closing punctuation following it
+      if seen_end and token not in self.sentence_ends and (token in OPENING or not is_punct(token)):
+        sentences.append(current)
+        current, seen_end = [], False
+      current.append(token)
+      if token in self.sentence_ends:
+        seen_end = True
+    if current:
+      sentences.append(current)
+    return sentences
+
+
+SEGMENTERS = {"spacy": SpacySegmenter, "rules": RuleSegmenter}
+
+
+def get_segmenter(lang, backend="spacy"):
+  '''
+  Make the segmentation backend for a language
+  Inputs:
+  	lang : str : language code
+  	backend : str : one of BACKENDS
+  Returns:
+  	segmenter : Segmenter
+  '''
+  if backend not in SEGMENTERS:
+    raise ValueError(f"Unknown segmentation backend: {backend} ; use one of {BACKENDS}")
+  return SEGMENTERS[backend](lang)
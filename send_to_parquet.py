@@ -0,0 +1,172 @@
+from tqdm import tqdm
+from conll_reader import read_conll_sentences
+from send_to_xml import generate_file_list, define_poolsize
+from profiling import add_profile_arguments, profile_run, profiled
+from compressed_io import strip_compression
+import os, argparse
+from multiprocessing import Pool
+from functools import partial
+
+#################################################################################################
+##################################          functions           #################################
+#################################################################################################
+
+def token_schema():
+  '''
+  Get the schema of the token table : article and sentence metadata, then the conll columns of each word. String columns with few distinct values are dictionary encoded as Categoricals. Polars is imported here, so that the command line starts without loading it
+  '''
+  import polars as pl
+  return {
+    "url_hash": pl.Categorical,
+    "article_num": pl.Int32,
+    "site": pl.Categorical,
+    "publi": pl.Categorical,
+    "yyyy": pl.Categorical,
+    "mm": pl.Categorical,
+    "dd": pl.Categorical,
+    "crawl_date": pl.Categorical,
+    "sent_num": pl.Int32,
+    "id": pl.Int16,
+    "form": pl.String,
+    "lemma": pl.Categorical,
+    "upos": pl.Categorical,
+    "feats": pl.Categorical,
+    "head": pl.Int16,
+    "deprel": pl.Categorical,
+  }
+
+
+## the dataset is partitioned so that scans restricted to a year or site only read the matching files
+PARTITION_COLS = ["yyyy", "site"]
+
+
+def make_token_table(input_file, year):
+  '''
+  Make a table with one row per word of a parsed conll file, with the metadata of its article and sentence
+  Inputs:
+  	input_file : str : absolute path to a parsed conll file
+  	year : str : year of the articles in the file
+  Returns:
+  	token_df : polars df : a dataframe with the columns of `token_schema`
+  Notes:
+  	The metadata is read from the same comment lines as `make_art_metablock` in send_to_xml. Multi-word token ranges and empty nodes are skipped, so that each row is a syntactic word with an integer id and head.
+  '''
+  import polars as pl
+  schema = token_schema()
+  columns = {name: [] for name in schema}
+  for comments, token_lines in read_conll_sentences(input_file):
+    # the url hash is the prefix of the sent_ID of every sentence in the article
+    url_hash, sent_num = comments[1].replace('# sent_ID = ','').rsplit('-', 1)
+    sent_metas = {
+      "url_hash": url_hash,
+      "article_num": int(comments[0].replace("# Article_num = ","")),
+      "site": comments[6].replace("# site=",""),
+      "publi": comments[8].replace("# publi=",""),
+      "yyyy": year,
+      "mm": comments[11].replace("# month=",""),
+      "dd": comments[12].replace("# day=",""),
+      "crawl_date": comments[10].replace("# crawl_date=",""),
+      "sent_num": int(sent_num),
+    }
+    n_words = 0
+    for line in token_lines:
+      fields = line.split('\t')
+      if '-' in fields[0] or '.' in fields[0]:
+        continue
+      columns["id"].append(int(fields[0]))
+      columns["form"].append(fields[1])
+      columns["lemma"].append(fields[2])
+      columns["upos"].append(fields[3])
+      columns["feats"].append(fields[5])
+      columns["head"].append(None if fields[6] == '_' else int(fields[6]))
+      columns["deprel"].append(fields[7])
+      n_words += 1
+    for name, value in sent_metas.items():
+      columns[name].extend([value] * n_words)
+  token_df = pl.DataFrame(columns, schema=schema)
+  return token_df
+
+
+def export_file(input_file, year, dataset_dir):
+  '''
+  The function processing a single file, from which a partial function for the pool can be created.
+  Inputs:
+  	input_file : str : absolute path to the conll file taken as input
+  	year : str : year for which files are to be processed
+  	dataset_dir : str : absolute path to the root of the partitioned parquet dataset
+  Returns:
+  	n_rows : int : number of rows written, or the exception raised, so that the callback is triggered in both cases
+  '''
+  try:
+    token_df = make_token_table(input_file, year)
+    # name the files written in each partition after the input file, so that exporting a file again replaces its rows rather than duplicating them
+    stem = os.path.basename(strip_compression(input_file)).rsplit('.', 1)[0]
+    token_df.write_parquet(dataset_dir, use_pyarrow=True, pyarrow_options={"partition_cols": PARTITION_COLS, "basename_template": f"{stem}-{{i}}.parquet", "existing_data_behavior": "overwrite_or_ignore"})
+    return len(token_df)
+  except Exception as e:
+    print(f"❌ Error processing {input_file}: {e}")
+    return e
+
+
+def run_export(year, mode, lang, nproc, publi):
+  '''
+  Export conll files to a parquet token dataset with a pool of parallel processes
+  Inputs:
+  	year : str: year for which files are to be processed
+  	mode : char : `A`, `E` or `O` to select all, even or odd files, as in `generate_file_list`
+  	lang : str : language code for the language to be processed
+  	nproc : int : number of processors in the pool
+  	publi : char : file pattern to select files to process
+  Returns:
+  	results : list : the number of rows written for each file, or the exception raised
+  '''
+  file_list = generate_file_list(year, lang, mode, publi)
+  print(f"Found {len(file_list)} files to process.")
+  dataset_dir = f'/Volumes/HC3Beta/uncompressed_parquet/cc_{lang}/{year}/4_parquet'
+  os.makedirs(dataset_dir, exist_ok=True)
+
+  pool_size = define_poolsize(nproc, file_list)
+  worker_func = profiled(partial(export_file, year=year, dataset_dir=dataset_dir), "parquet")
+  with Pool(pool_size) as pool:
+    results = list(tqdm(pool.imap(worker_func, file_list), total=len(file_list), desc="Processing", unit="file"))
+  print(f"{sum([r for r in results if isinstance(r, int)])} rows written to {dataset_dir}")
+  return results
+
+#################################################################################################
+############################       actual processing starts here       ##########################
+#################################################################################################
+
+
+def main(argv=None):
+    '''
+    Command line entry point : run with the arguments in argv, or with the arguments of the script if argv is None
+    '''
+
+    parser = argparse.ArgumentParser(
+    	prog='conll_out_to_parquet',
+    	formatter_class=argparse.RawTextHelpFormatter,
+    	description='''\
+    Read conll files and send them to a parquet dataset with one row per token, partitioned by year and site
+
+    Examples of usage:
+    ## use 4 processors in a pool to find all files from 2020 with smh in the filename located in the English subfolder and export them to 4_parquet
+    send_to_parquet.py -year 2020 -mode A -lang en --nproc 4 -publi smh
+
+    ## query the dataset with polars, reading only the columns and partitions needed
+    pl.scan_parquet('.../2020/4_parquet/**/*.parquet', hive_partitioning=True).filter(pl.col('site') == 'smh.com.au').group_by('lemma').len()
+    '''
+    )
+
+    parser.add_argument('-year',help='''Year in cc_corpus/ folder''',default="")
+    parser.add_argument('-mode',help='''E for Even, O for Odd, A for all''',default="A")
+    parser.add_argument("--nproc", type=int, default=4, help="Number of parallel processes")
+    parser.add_argument('-lang',help='''lang''',default="")
+    parser.add_argument('-publi',type=str,default="",help='''file pattern to process''')
+    add_profile_arguments(parser)
+    args = parser.parse_args(argv)
+    with profile_run(args.profile, "send_to_parquet", mode=args.profile_mode, top=args.profile_top):
+        run_export(args.year, args.mode, args.lang, args.nproc, args.publi)
+
+
+if __name__ == "__main__":
+    main()
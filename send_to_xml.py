@@ -1,10 +1,18 @@
 
 from lxml import etree
-from stanza.utils.conll import CoNLL
 from tqdm import tqdm
-import glob, os, argparse, re, logging
-from multiprocessing import Pool, cpu_count
-from functools import partial
+from conll_reader import read_conll_sentences
+from article_index import write_index, index_path
+from work_queue import seed_queue, claimed_files, mark_failed, queue_status
+from conll_manifest import sort_by_cost
+from corpus_stats import FileStats, stats_path, store_path, merge_stats
+from profiling import add_profile_arguments, profile_run, profiled
+from compressed_io import add_compression_arguments, set_compression_options, open_file, with_compression, strip_compression, compression_of, glob_data
+import os, argparse, re, logging, mmap, shutil, time
+from logging.handlers import QueueHandler, QueueListener
+from multiprocessing import Pool, Queue, cpu_count
+from functools import partial, lru_cache
+from copy import deepcopy
 
 #################################################################################################
 ##################################          functions           #################################
@@ -31,17 +39,21 @@ def setup_logger(log_path: str):
 
     return logger
 
-def start_article(art_metas, input_file):
-  '''
-  Make an etree Tree of a prescribed form for a specific parser, add metadata to the header
-  Inputs:
-  	art_metas : list : a list of metadata for each article
-  	input_file : string : absolute path to a parsed conll file
-  Returns:
-  	current_article : etree : an etree element tree with the structure and metadata for the article
-  '''
-  # the raw string to be parsed as an etree
-  raw_str_header= '''
+
+def init_worker_logging(log_queue):
+    '''
+    Pool initializer : send the records of the logger of the worker to the queue of the listener in the main process, so that only one process writes to the log file
+    '''
+    logger = logging.getLogger("file_processor")
+    logger.setLevel(logging.INFO)
+    # a forked worker inherits the file and console handlers of its parent
+    logger.handlers = [QueueHandler(log_queue)]
+
+## number of times a file which failed is processed again before it is reported as failed
+MAX_RETRIES = 2
+
+# the raw string to be parsed as an etree to make the mould of every article
+RAW_STR_HEADER = '''
     
 <TEI.2>
   <teiHeader>
@@ -74,20 +86,127 @@ def start_article(art_metas, input_file):
 </text>
 </TEI.2>
   '''
-  ##  parse the raw string as an etree tree and add the metadata
-  article_mould = etree.fromstring(raw_str_header)
+
+@lru_cache(maxsize=None)
+def load_article_mould():
+  '''
+  Parse the raw article string once per process ; `start_article` copies the parsed mould rather than parsing the string again for each article
+  Returns:
+  	article_mould : etree : the empty article tree, which must not be modified
+  '''
+  return etree.fromstring(RAW_STR_HEADER)
+
+def start_article(art_metas, year, lang):
+  '''
+  Make an etree Tree of a prescribed form for a specific parser, add metadata to the header in its final layout, and add the p element which will hold the s elements of the article
+  Inputs:
+  	art_metas : list : a list of metadata for each article
+  	year : string : year for which files are processed, used as the date of the article
+  	lang : string : language code set as the ident of the language element
+  Returns:
+  	current_article : etree : an etree element tree with the structure and metadata for the article
+  	p_block : etree : the p element, child of body, to which s elements are to be appended
+  '''
+  ##  copy the parsed mould and add the metadata
+  article_mould = deepcopy(load_article_mould())
   article_mould.findall('.//title')[0].text = art_metas[2].replace("# title=","")
   article_mould.findall(".//author")[0].text =art_metas[3].replace("# author=","")
   article_mould.findall(".//publisher")[0].text =art_metas[6].replace("# publi=","")
-  article_mould.findall(".//date")[0].text =os.path.basename(input_file).replace('_out.conllu','')[-4:]
-  
+  article_mould.findall(".//date")[0].text = year
+  article_mould.findall(".//language")[0].set("ident", str(lang))
+
+  # the crawl date and url are stored as attributes of the source_desc element, which loses its placeholder p element
   source_desc_el = article_mould.findall(".//sourceDesc")[0]
-  crawl_dt_el = etree.SubElement(source_desc_el, 'p')
-  crawl_dt_el.text =art_metas[8].replace("# crawl_date=","") 
-  crawl_url_el = etree.SubElement(source_desc_el, 'p')
-  crawl_url_el.text =art_metas[7].replace("# warc_path=","") 
+  source_desc_el.remove(source_desc_el[0])
+  crawl_dt = art_metas[8].replace("# crawl_date=","")
+  source_desc_el.set("datetime", f'{crawl_dt}')
+  source_desc_el.set("month", f'{crawl_dt[5:7]}')
+  source_desc_el.set("day", f'{crawl_dt[8:10]}')
+  source_desc_el.set("ccrawl_url", f'{art_metas[7].replace("# warc_path=","")}')
+
+  # s elements have a parent p element, and p elements have a parent <body> element to ensure tree conforms to expected structure
+  p_block = etree.SubElement(article_mould.findall(".//body")[0], 'p')
   current_article = article_mould
-  return current_article
+  return current_article, p_block
+
+
+def iter_articles(sentences, year, lang):
+  '''
+  Build the article trees from a stream of sentences, yielding each article as soon as its last sentence has been read
+  Inputs:
+  	sentences : iterable : (comments, token_lines) tuples, as yielded by `read_conll_sentences`
+  	year : string : year for which files are to be processed
+  	lang : string : language to be processed
+  Yields:
+  	(art_key, current_article) : tuple : art_key is the (url_hash, article_num, site) of the article, used to index it ; current_article is the complete article, with s elements numbered from 1 across the whole stream
+  '''
+  # reset counter to ensure first iteration will be a new article
+  art_num_prev = -1
+  art_key, current_article = None, None
+  for snum, (comments, token_lines) in enumerate(sentences, start=1):
+    art_num = comments[0]
+    # add article metas if start of new article
+    if art_num_prev != art_num :
+      if current_article is not None:
+        yield art_key, current_article
+      ## get the article metadata for the current sentence and make an etree for this article
+      art_metas = [comments[i] for i in [0,3,4,5,6,7,8,9,10,11,12]]
+      current_article, p_block = start_article(art_metas, year, lang)
+      # the url hash is the prefix of the sent_ID of every sentence in the article
+      url_hash = comments[1].replace('# sent_ID = ','').rsplit('-', 1)[0]
+      art_key = (url_hash, art_metas[0].replace("# Article_num = ",""), art_metas[4].replace("# site=",""))
+    # always run this chunk which adds the token level data in a sequentially numbered s element
+    current_sent_el = etree.SubElement(p_block, 's')
+    current_sent_el.set("id", str(snum))
+    ## get the conll lines for each token, and concatenate them into a single string, then tidy this
+    intermed_text =  "\n" +"\n".join([re.sub("’", "'", line) for line in token_lines]) + '\n'
+    current_sent_el.text = intermed_text.replace('”','"').replace('“','"')
+    art_num_prev = art_num
+  # yield final article as there's no subsequent sentence to trigger it
+  if current_article is not None:
+    yield art_key, current_article
+
+
+def write_tei_xml(articles, outputfile, index=True):
+  '''
+  Write articles to a teiCorpus file incrementally, so that only the article being written is held in memory. The file is written under a temporary name and moved to its path once complete, so that a failure leaves no partial file to be consolidated
+  Inputs:
+  	articles : iterable : (art_key, article) tuples, as yielded by `iter_articles`
+  	outputfile : str : absolute path to the xml file to write
+  	index : bool : default = True ; write a sidecar index with the byte offset and length of each TEI.2 element, see `article_index` ; compressed files have no index, as offsets in the compressed stream cannot be seeked to
+  Returns:
+  	n_articles : int : the number of articles written
+  '''
+  n_articles, entries = 0, []
+  index = index and compression_of(outputfile) is None
+  # the temporary name keeps the compression extension, and is not matched by the globs of the xml files
+  tmp_file = with_compression(f'{strip_compression(outputfile)}.tmp', compression_of(outputfile))
+  try:
+    with open_file(tmp_file, 'wb') as f:
+      with etree.xmlfile(f, encoding='UTF-8') as xf:
+        xf.write_declaration()
+        with xf.element('teiCorpus'):
+          for art_key, article in articles:
+            xf.write('\n  ')
+            # flush the writer around the article to get its offsets in the file
+            if index:
+              xf.flush()
+              offset = f.tell()
+            xf.write(article)
+            if index:
+              xf.flush()
+              entries.append((*art_key, offset, f.tell() - offset))
+            n_articles += 1
+          xf.write('\n')
+      _ = f.write(b'\n')
+  except BaseException:
+    if os.path.exists(tmp_file):
+      os.remove(tmp_file)
+    raise
+  os.replace(tmp_file, outputfile)
+  if index:
+    write_index(outputfile, entries)
+  return n_articles
 
 
 
@@ -129,37 +248,161 @@ def make_art_metablock(art_metas):
   
   return article_block
 
-def consolidate_xmls(lang, year, publi):
+def iter_xml_articles(input_file):
+  '''
+  Stream the TEI.2 articles of an xml file written by `process_file`, clearing each article once the caller has used it so that memory stays constant
+  Inputs:
+  	input_file : str : absolute path to an xml file, compressed or not
+  Yields:
+  	art : etree : a TEI.2 element ; it is only valid until the next article is requested
+  '''
+  with open_file(input_file, 'rb') as f:
+    for event, art in etree.iterparse(f, events=('end',), tag='TEI.2'):
+      yield art
+      art.clear(keep_tail=True)
+      while art.getprevious() is not None:
+        del art.getparent()[0]
+
+
+def renumber_sentences(art, offset):
+  '''
+  Renumber the s elements of an article sequentially from offset+1
+  Inputs:
+  	art : etree : a TEI.2 element
+  	offset : int : the number of sentences preceding this article in the consolidated file
+  Returns:
+  	offset : int : the offset updated with the sentences of this article
+  '''
+  for sentblock in art.iter('s'):
+    offset += 1
+    sentblock.set("id", str(offset))
+  return offset
+
+
+def count_sentences(input_file):
+  '''
+  Count the s elements in an xml file without parsing it : token text is escaped in the xml, so every `<s ` in the raw bytes opens an s element
+  Inputs:
+  	input_file : str : absolute path to an xml file
+  Returns:
+  	n_sents : int : number of s elements in the file
+  '''
+  if compression_of(input_file) is not None:
+    # a compressed file cannot be mapped : count in the decompressed stream, carrying the end of each block over to the next, too short to hold a match counted twice
+    n_sents, tail = 0, b''
+    with open_file(input_file, 'rb') as f:
+      for chunk in iter(lambda: f.read(1 << 20), b''):
+        block = tail + chunk
+        n_sents += block.count(b'<s ')
+        tail = block[-2:]
+    return n_sents
+  with open(input_file, 'rb') as f:
+    with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+      n_sents = 0
+      pos = mm.find(b'<s ')
+      while pos != -1:
+        n_sents += 1
+        pos = mm.find(b'<s ', pos + 3)
+  return n_sents
+
+
+def rewrite_shard(input_file, shard_file, offset):
+  '''
+  Write the articles of an xml file, with sentences renumbered from offset+1, to a shard holding the xml fragment to be concatenated into the consolidated file
+  Inputs:
+  	input_file : str : absolute path to an xml file
+  	shard_file : str : absolute path to the shard to write
+  	offset : int : the number of sentences in the files preceding input_file
+  Returns:
+  	offset : int : the offset updated with the sentences of this file
+  '''
+  with open(shard_file, 'wb') as f:
+    for art in iter_xml_articles(input_file):
+      offset = renumber_sentences(art, offset)
+      _ = f.write(b'\n  ' + etree.tostring(art, encoding='UTF-8', with_tail=False))
+  return offset
+
+
+def consolidate_files(input_files, outputfilename, nproc=1):
+  '''
+  Consolidate XML files to a single file, streaming the articles and renumbering sentences with a running counter
+  Inputs :
+	input_files : list : absolute paths to the xml files to consolidate, in the order in which they are to be written
+	outputfilename : str : absolute path to the consolidated file
+	nproc : int : number of processes ; when greater than 1, the sentence offset of each file is computed up front, the files are rewritten as shards in parallel and the shards are concatenated
+  Returns:
+	n_sents : int : number of sentences in the consolidated file
+  '''
+  if nproc > 1:
+    # the offset of each file is the number of sentences in the files before it
+    counts = [count_sentences(input_file) for input_file in input_files]
+    offsets = [sum(counts[:i]) for i in range(len(counts))]
+    shard_files = [f'{outputfilename}.shard{i:04d}' for i in range(len(input_files))]
+    with Pool(define_poolsize(nproc, input_files)) as pool:
+      _ = pool.starmap(profiled(rewrite_shard, "consolidate"), zip(input_files, shard_files, offsets))
+    with open_file(outputfilename, 'wb') as f:
+      _ = f.write(b"<?xml version='1.0' encoding='UTF-8'?>\n<teiCorpus>")
+      for shard_file in shard_files:
+        with open(shard_file, 'rb') as shard:
+          shutil.copyfileobj(shard, f)
+        os.remove(shard_file)
+      _ = f.write(b'\n</teiCorpus>\n')
+    return sum(counts)
+
+  n_sents = 0
+  with open_file(outputfilename, 'wb') as f:
+    with etree.xmlfile(f, encoding='UTF-8') as xf:
+      xf.write_declaration()
+      with xf.element('teiCorpus'):
+        for input_file in tqdm(input_files):
+          for art in iter_xml_articles(input_file):
+            n_sents = renumber_sentences(art, n_sents)
+            xf.write('\n  ')
+            xf.write(art, with_tail=False)
+        xf.write('\n')
+    _ = f.write(b'\n')
+  return n_sents
+
+
+def consolidate_xmls(lang, year, publi, nproc=1, compression=None):
   '''
   Consolidate XML files for a publication in a year to a single file
   Inputs :
 	year : str: year for which files are to be processed
 	lang : str : language code for the language to be processed
 	publi : str : pattern used to restrict filename matches to those of the desired publication with regex
+	nproc : int : number of processes used to rewrite the files as shards in parallel ; default = 1 streams all files in a single process
+	compression : str : default = None ; compression of the consolidated file, see `with_compression` ; by default, the file is compressed as the first input file
   '''
 
-  input_files = glob.glob(f'/Volumes/HC3Beta/uncompressed_parquet/cc_{lang}/{year}/4_xml/*{publi}*.xml')
+  input_files = sorted(glob_data(f'/Volumes/HC3Beta/uncompressed_parquet/cc_{lang}/{year}/4_xml/*{publi}*.xml'))
   print(f"Consolidating {len(input_files)}")
-  outputfilename = f'{os.path.dirname(input_files[0])}/{year}_{publi}_{lang}.xml'
-  new_tree = etree.Element("teiCorpus")
-  
-  for input_file in tqdm(input_files):
-    input_tree = etree.parse(input_file)
-    articles = input_tree.findall(".//TEI.2")
-    for art in articles:
-      new_tree.append(art)
-  
-  for snum, sentblock in enumerate(new_tree.findall(".//s"), start=1):
-    sentblock.set("id", str(snum))
-  
-  tree_out = etree.ElementTree(new_tree)  
-  tree_out.write(outputfilename, encoding='UTF-8', pretty_print=True, xml_declaration=True)
+  outputfilename = with_compression(f'{os.path.dirname(input_files[0])}/{year}_{publi}_{lang}.xml', compression or compression_of(input_files[0]) or "none")
+  # skip the output of a previous consolidation, which matches the same pattern, whatever its compression
+  input_files = [input_file for input_file in input_files if strip_compression(input_file) != strip_compression(outputfilename)]
+  consolidate_files(input_files, outputfilename, nproc=nproc)
   print(f"{len(input_files)} consolidated into 1 file : {os.path.basename(outputfilename)}")
 
 
 
 
-def process_file(input_file, year, lang, logger):
+def make_xml_name(input_file, compression=None):
+  '''
+  Make the name of the xml file written for a parsed conll file
+  Inputs:
+  	input_file (str) : absolute path to the conll file taken as input
+  	compression (str) : default = None ; compression of the xml file, see `with_compression` ; by default, the xml file is compressed as the conll file
+  Returns:
+  	outputfile (str) : absolute path to the xml file, in the 4_xml folder matching the 3_conllu_out folder of the input file
+  '''
+  ## TODO : remove the hardcoding of these paths ??
+  folder1 = '3_conllu_out'
+  folder2 = '4_xml'
+  outputfile = with_compression(input_file.replace('.conll','.xml').replace(folder1, folder2), compression)
+  return outputfile
+
+
+def process_file(input_file, year, lang, logger, compression=None):
   '''
   The function processing a single file, from which a partial function for the pool can be created.
   Inputs:
@@ -167,94 +410,78 @@ def process_file(input_file, year, lang, logger):
   	year : string : year for which files are to be processed
   	lang : string : language to be processed
     logger : logger : a logger
+    compression : str : default = None ; compression of the xml file, see `make_xml_name`
   Returns:
-    1: 1 is returned in the case of an error in order to trigger callback is triggered 
-    If the function runs successfully, there is no return object, a file is written.
+    1: 1 is returned in the case of an error in order to trigger callback is triggered ; the xml file of the input and its sidecar files are then removed
+    If the function runs successfully, there is no return object, the xml file is written, with its statistics next to it, see `corpus_stats`
   
   '''
   
+  outputfile = make_xml_name(input_file, compression)
   try:
     logger.info(f"Processing: {input_file} ")
 
-    ## TODO : remove the hardcoding of these paths ??
-    folder1 = '3_conllu_out'
-    folder2 = '4_xml'
-    outputfile = input_file.replace('.conll','.xml').replace(folder1, folder2)
-    
-    # load the input file as a conll document
-    input_doc = CoNLL.conll2doc(input_file)
-    # reset counter to ensure first iteration will be 0
-    art_num_prev = -1
-    ## make a tree in which to append the tree for article, 
-    outputtree = etree.fromstring("<teiCorpus></teiCorpus>")
-    current_article, articles_processed = [],[]
-
-
-    # iterate over sents, get the first comment which contains the article number
-    for s, sent in (enumerate(input_doc.sentences)):
-      art_num = sent.comments[0]
-      # add article metas if start of new article
-      if art_num_prev != art_num :
-        if s>0:
-          articles_processed.append(current_article)
-        ## get the article metadata for the current sentence and make an etree for this article
-        art_metas = [sent.comments[i] for i in [0,3,4,5,6,7,8,9,10,11,12]]
-        current_article = start_article(art_metas, input_file)
-      # always run this chunk which adds the sent level metadata and token level data
-      sent_metas = [sent.comments[i] for i in [14,1]]
-      parent = current_article.findall(".//body")[0]
-      current_sent_el = etree.SubElement(parent, 's')
-      ## get the conll strings for each token, and concatenate them into a single string, then tidy this
-      intermed_text =  "\n" +"\n".join([re.sub("’", "'", token.to_conll_text()) for token in sent.tokens]) + '\n'
-      current_sent_el.text = intermed_text.replace('”','"').replace('“','"')
-      current_sent_el.set('uuid', sent_metas[1].replace('# sent_ID = ',''))
-      art_num_prev = art_num
-    # add final article to processed_list as there's no subsequent sentence to call the append
-    articles_processed.append(current_article)
-
-  
-    # when all the articles have been processed, append them to the output tree
-    for item in articles_processed:
-      outputtree.append(item)
-
-  
-    # tidy the output tree by inserting the date and language
-    for el in outputtree.findall(".//date"):
-      el.text = year
-    for el in outputtree.findall(".//language"):
-      el.set("ident", str(lang))
-    # tidy sent_ids by removing the UUIDs and renumbering from 1
-    for snum, sblock in enumerate(outputtree.findall(".//s"), start=1):
-      sblock.set("id", str(snum))
-      _ = sblock.attrib.pop("uuid")
-    
-    # ensure that s elements have a parent p element, and that p elements have a parent <body> element to ensure tree conforms to expected structure
-    body_els = outputtree.findall(".//body")
-    for body_el in body_els:
-      s_blocks = body_el.findall(".//s")
-      p_block = etree.SubElement(body_el, 'p')
-      for s_block in s_blocks:
-        body_el.remove(s_block)
-        p_block.append(s_block)
-    
-    # tidy the custom source_desc xml element by adding date time, month, day and url elements 
-    source_descEls = outputtree.findall(".//sourceDesc")
-    for current_el in source_descEls:
-      subels = current_el.findall(".//*")
-      current_el.set("datetime", f'{subels[1].text}')
-      current_el.set("month", f'{subels[1].text[5:7]}')
-      current_el.set("day", f'{subels[1].text[8:10]}')
-      current_el.set("ccrawl_url", f'{subels[2].text}')
-      for el in subels:
-        current_el.remove(el)
-  
-    final_tree = etree.ElementTree(outputtree)
-    final_tree.write(outputfile, encoding='UTF-8', pretty_print=True, xml_declaration=True)
+    # stream the sents from the input file and write each article as soon as it is complete, counting the tokens on the way
+    file_stats = FileStats(year)
+    sentences = file_stats.track(read_conll_sentences(input_file))
+    write_tei_xml(iter_articles(sentences, year, lang), outputfile)
+    file_stats.dump(outputfile, lang)
 
   except Exception as e:
     logger.error(f"❌ Error processing {input_file}: {e}", exc_info=True)
+    # the xml, index and statistics of an earlier run no longer match the input : they are removed, so that they are neither consolidated nor merged into the statistics store
+    for stale_file in (outputfile, index_path(outputfile), stats_path(outputfile)):
+      if os.path.exists(stale_file):
+        os.remove(stale_file)
     return 1  # Always return something so callback triggers
-  
+
+
+def timed_process_file(input_file, year, lang, compression=None, retries=MAX_RETRIES):
+  '''
+  Process a single file with `process_file`, processing it again up to `retries` times if it fails, from which a partial function for the pool can be created. The records are logged to the `file_processor` logger, which `init_worker_logging` sends to the listener of the main process
+  Inputs:
+  	input_file (str) : absolute path to the conll file taken as input
+  	year : string : year for which files are to be processed
+  	lang : string : language to be processed
+  	compression : str : default = None ; compression of the xml file, see `make_xml_name`
+  	retries : int : number of times a failed file is processed again
+  Returns:
+  	result : dict : the file, its status (`ok` or `failed`), the number of attempts and the duration in seconds of the last attempt
+  '''
+  logger = logging.getLogger("file_processor")
+  for attempt in range(1, retries + 2):
+    starttime = time.time()
+    failed = process_file(input_file, year, lang, logger, compression) == 1
+    duration = time.time() - starttime
+    if failed is False:
+      break
+    if attempt <= retries:
+      logger.warning(f"Retrying {input_file} : attempt {attempt + 1} of {retries + 1}")
+  status = "failed" if failed else "ok"
+  logger.info(f"{'✅' if status == 'ok' else '❌'} {input_file} :: {status} in {duration:.1f}s after {attempt} attempt(s)")
+  return {"file": input_file, "status": status, "attempts": attempt, "duration": duration}
+
+
+def process_queue(queue_dir, year, lang, compression=None, retries=MAX_RETRIES):
+  '''
+  Pull files from a work queue and process them until the queue is empty, from which a partial function for the pool can be created. A file which fails after all its attempts is recorded as failed rather than done, so that a worker of another node tries it again, see `mark_failed`
+  Inputs:
+  	queue_dir (str) : absolute path to the work queue directory, see `work_queue`
+  	year : string : year for which files are to be processed
+  	lang : string : language to be processed
+    compression : str : default = None ; compression of the xml files, see `make_xml_name`
+    retries : int : number of times a failed file is processed again, see `timed_process_file`
+  Returns:
+    results : list : the result of each file processed by this worker, see `timed_process_file`
+  '''
+  results = []
+  for input_file in claimed_files(queue_dir):
+    result = timed_process_file(input_file, year, lang, compression, retries)
+    if result["status"] != "ok":
+      mark_failed(queue_dir, input_file)
+    results.append(result)
+  return results
+
 
 def generate_file_list(year, lang, mode, publi):
     """
@@ -274,13 +501,13 @@ def generate_file_list(year, lang, mode, publi):
     input_folder = f'/Volumes/HC3Beta/uncompressed_parquet/cc_{lang}/{year}/3_conllu_out'
     if mode =="A":
       # files = sorted(glob.glob(input_folder + '*/*_.conllu'))
-      files = sorted(glob.glob(input_folder + f'/{publi}*.conll'))
+      files = sorted(glob_data(input_folder + f'/{publi}*.conll'))
     if mode =="E":
       # files = sorted(glob.glob(input_folder + '*[02468]/*_out.conllu'))
-      files = sorted(glob.glob(input_folder + f'/{publi}*[02468]*.conll'))
+      files = sorted(glob_data(input_folder + f'/{publi}*[02468]*.conll'))
     if mode =="O":
       # files = sorted(glob.glob(input_folder + '*[13579]/*_out.conllu'))
-      files = sorted(glob.glob(input_folder + f'/{publi}*[13579]*.conll'))
+      files = sorted(glob_data(input_folder + f'/{publi}*[13579]*.conll'))
     file_list = files
     return file_list
 
@@ -304,9 +531,44 @@ def define_poolsize(nproc, file_list):
       print(f"Using pool size: {pool_size}")
     return pool_size
 
-def run_processing(year, mode, lang, nproc, log_path, publi):
+def report_results(results, costs, logger, top=5):
+    '''
+    Log the files which failed and the slowest files, with their cost, so that the files to split or to look at are found in the log
+    Inputs:
+    	results : list : the result of each file, see `timed_process_file`
+    	costs : dict : the cost of each file, see `sort_by_cost`
+    	logger : logger : a logger
+    	top : int : number of slowest files logged
+    Returns:
+    	failed : list : the files which failed after all their attempts
+    '''
+    failed = [result["file"] for result in results if result["status"] != "ok"]
+    retried = [result for result in results if result["attempts"] > 1 and result["status"] == "ok"]
+    logger.info(f"{len(results) - len(failed)} files processed in {sum(result['duration'] for result in results):.1f}s of worker time, {len(retried)} after a retry")
+    for result in sorted(results, key=lambda result: result["duration"], reverse=True)[:top]:
+      logger.info(f"slowest :: {result['file']} :: {result['duration']:.1f}s for a cost of {costs.get(result['file'], 0)}")
+    for input_file in failed:
+      logger.error(f"❌ Failed after all attempts: {input_file}")
+    return failed
+
+def merge_file_stats(results, compression, logger):
+    '''
+    Merge the statistics of the files converted into the statistics store of their year, see `corpus_stats`
+    Inputs:
+    	results : list : the result of each file, see `timed_process_file`
+    	compression : str : compression of the xml files, see `make_xml_name`
+    	logger : logger : a logger
+    '''
+    xml_files = [make_xml_name(result["file"], compression) for result in results if result["status"] == "ok"]
+    if len(xml_files) == 0:
+      return
+    store = store_path(xml_files[0])
+    n_merged = merge_stats(store, [stats_path(xml_file) for xml_file in xml_files])
+    logger.info(f"{n_merged} files merged into the statistics store {store}")
+
+def run_processing(year, mode, lang, nproc, log_path, publi, queue_dir=None, compression=None, retries=MAX_RETRIES):
     """
-    Convert conll files to XML with a pool of parallel processes
+    Convert conll files to XML with a pool of parallel processes. The workers log to a queue, from which a listener in this process writes the log, and the largest files are started first
     Inputs:
 		year : str: year for which files are to be processed
 		mode : char. One of three options describing the mode in which to generate files. `A` for All will match all files with the .conll extension. `E` for EVEN will match only those containing an even number before the conll extension.. `O` for ODD will match only those containing an odd number before the conll extension.
@@ -314,32 +576,61 @@ def run_processing(year, mode, lang, nproc, log_path, publi):
     	nproc : int : number of processors in the pool
     	log_path : absolute path to which to write the log
 		publi: char : file pattern to select files to process
+		queue_dir : str : default = None ; absolute path to a work queue shared between nodes, see `work_queue`. The files found are added to the queue, then each processor of the pool pulls files from the queue until it is empty
+		compression : str : default = None ; compression of the xml files, see `make_xml_name`
+		retries : int : default = MAX_RETRIES ; number of times a file which failed is processed again
     Returns:
-    	results : list : a list of results from the pool processors
+    	results : list : the result of each file, with its status, attempts and duration, see `timed_process_file`
     """
     logger = setup_logger(log_path)
 
-    # generate list of files
+    # generate list of files, ordered from the largest to the smallest in tokens from the manifests written by make_conll, falling back on sizes in bytes, so that the largest files are started first
     file_list = generate_file_list(year, lang, mode, publi)
+    file_list, costs = sort_by_cost(file_list)
     logger.info(f"Found {len(file_list)} files to process.")
 
-    # create the pool with sanity checks
-    pool_size = define_poolsize(nproc, file_list)
-
-    ## make worker 
-    worker_func = partial(process_file,  year=year, lang=lang, logger=logger)
-
-    # map the work to the pool
-    with Pool(pool_size) as pool, tqdm(total=len(file_list), desc="Processing", unit="file") as pbar:
-        results = []
+    # the workers only hold a handler putting records on the queue ; the handlers of the logger write them from the listener thread
+    log_queue = Queue()
+    listener = QueueListener(log_queue, *logger.handlers, respect_handler_level=True)
+    listener.start()
+    try:
+      if queue_dir is not None:
+        n_added = seed_queue(queue_dir, file_list)
+        status = queue_status(queue_dir)
+        logger.info(f"{n_added} files added to queue {queue_dir} :: {status}")
+        # every processor pulls from the queue, so the pool is sized on the files still to process on all nodes
+        if status['tasks'] - status['done'] <= 0:
+          logger.info(f"✅ Nothing left to process in queue {queue_dir}.")
+          return []
+        pool_size = define_poolsize(nproc, range(status['tasks'] - status['done']))
+        worker_func = profiled(partial(process_queue, queue_dir, year=year, lang=lang, compression=compression, retries=retries), "xml")
+        with Pool(pool_size, initializer=init_worker_logging, initargs=(log_queue,)) as pool:
+          results = [result for r in [pool.apply_async(worker_func) for _ in range(pool_size)] for result in r.get()]
+        logger.info(f"✅ {len(results)} files processed from queue.")
+        report_results(results, costs, logger)
+        merge_file_stats(results, compression, logger)
+        return results
+
+      # create the pool with sanity checks
+      pool_size = define_poolsize(nproc, file_list)
+
+      ## make worker 
+      worker_func = profiled(partial(timed_process_file, year=year, lang=lang, compression=compression, retries=retries), "xml")
+
+      # map the work to the pool, in the order of file_list : the largest files first
+      with Pool(pool_size, initializer=init_worker_logging, initargs=(log_queue,)) as pool, tqdm(total=len(file_list), desc="Processing", unit="file") as pbar:
+        async_results = []
         for file_path in file_list:
-            # Submit tasks asynchronously
-            r = pool.apply_async(worker_func, (file_path,), callback=lambda _: pbar.update(1))
-            results.append(r)
+          # Submit tasks asynchronously
+          r = pool.apply_async(worker_func, (file_path,), callback=lambda _: pbar.update(1))
+          async_results.append(r)
 
         # Wait for all tasks to complete
-        for r in results:
-            r.wait()
+        results = [r.get() for r in async_results]
+    finally:
+      listener.stop()
+    report_results(results, costs, logger)
+    merge_file_stats(results, compression, logger)
     logger.info("✅ All processing complete.")
     print("Processing complete.")
 
@@ -352,7 +643,10 @@ def run_processing(year, mode, lang, nproc, log_path, publi):
 
 
 
-if __name__ == "__main__":
+def main(argv=None):
+    '''
+    Command line entry point : run with the arguments in argv, or with the arguments of the script if argv is None
+    '''
 
     parser = argparse.ArgumentParser(
     	prog='conll_out_to_article_xml',
@@ -378,15 +672,25 @@ if __name__ == "__main__":
     parser.add_argument("--log", type=str, default="/Users/Adam/Desktop/processing2.log", help="Path to log file")
     parser.add_argument('-consolidate',type=bool,default=False,help='''When done, consolidate to single XML file''')
     parser.add_argument('-publi',type=str,default="",help='''file pattern to process''')
-    args = parser.parse_args()
+    parser.add_argument('--queue',type=str,default=None,help='''path to a work queue directory shared between nodes : the files found are added to the queue, then files are pulled from the queue until it is empty''')
+    parser.add_argument('--retries',type=int,default=MAX_RETRIES,help='''number of times a file which failed is processed again before it is reported as failed''')
+    parser.add_argument('--parallel_consolidate',action='store_true',help='''Consolidate by rewriting files as shards with --nproc processes, then concatenating the shards''')
+    add_profile_arguments(parser)
+    add_compression_arguments(parser)
+    args = parser.parse_args(argv)
+    set_compression_options(args.compress_level, args.compress_threads)
     year=args.year
     mode=args.mode
     lang = args.lang
     nproc = args.nproc
     consolidate = args.consolidate
     publi = args.publi
-    run_processing(year, mode, lang, nproc, args.log, publi)
-    if consolidate ==True:
-        consolidate_xmls(lang, year, publi)
-	
+    with profile_run(args.profile, "send_to_xml", mode=args.profile_mode, top=args.profile_top):
+        run_processing(year, mode, lang, nproc, args.log, publi, queue_dir=args.queue, compression=args.compress, retries=args.retries)
+        if consolidate ==True:
+            consolidate_nproc = nproc if args.parallel_consolidate else 1
+            consolidate_xmls(lang, year, publi, nproc=consolidate_nproc, compression=args.compress)
+
 
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,285 @@
+import hashlib, json, os, socket, threading, time
+
+#################################################################################################
+###############################     shared-directory work queue     #############################
+#################################################################################################
+
+## the queue is a directory shared by all the nodes, holding one subfolder per state of a task
+## tasks/ : one json file per file to process, written when the queue is seeded
+## leases/ : one file per task being processed, created atomically by the worker claiming it and touched regularly while it works
+## done/ : one marker per task completed
+## failed/ : one marker per worker which failed a task, named after the task and the worker
+QUEUE_FOLDERS = ["tasks", "leases", "done", "failed"]
+
+## default lease duration in seconds : a lease not touched for this long belongs to a dead worker and can be reclaimed
+LEASE_SECONDS = 600
+
+## interval in seconds at which a worker waiting for the tasks held by other workers checks the leases, from their names and modification times alone
+POLL_SECONDS = 10
+
+## number of workers which fail a task before it is no longer claimed : each worker tries a task once, so that a file failing on one node for a passing reason is tried on another
+MAX_FAILURES = 2
+
+
+def task_id(input_file):
+  '''
+  Make the id of the task for a file : a hash of its absolute path
+  '''
+  return hashlib.sha1(os.path.abspath(input_file).encode('utf-8')).hexdigest()
+
+
+def worker_name():
+  '''
+  Make a name identifying the current process across nodes
+  '''
+  return f'{socket.gethostname()}-{os.getpid()}'
+
+
+def seed_queue(queue_dir, file_list):
+  '''
+  Add files to the queue ; files already in the queue, whether pending, in progress or done, are not added again, so that every node can seed the queue with its own glob
+  Inputs:
+  	queue_dir : str : absolute path to the queue directory
+  	file_list : list : absolute paths to the files to process, in the order in which they are to be claimed
+  Returns:
+  	n_added : int : number of files added to the queue
+  '''
+  for folder in QUEUE_FOLDERS:
+    os.makedirs(f'{queue_dir}/{folder}', exist_ok=True)
+  n_added = 0
+  for position, input_file in enumerate(file_list):
+    task_file = f'{queue_dir}/tasks/{task_id(input_file)}.json'
+    try:
+      fd = os.open(task_file, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+    except FileExistsError:
+      continue
+    with os.fdopen(fd, 'w', encoding='UTF-8') as f:
+      json.dump({"file": os.path.abspath(input_file), "position": position, "seeded": time.time()}, f)
+    n_added += 1
+  return n_added
+
+
+def load_tasks(queue_dir):
+  '''
+  Load the tasks of the queue, in the order in which they were seeded
+  Inputs:
+  	queue_dir : str : absolute path to the queue directory
+  Returns:
+  	tasks : list : (task_id, file) tuples
+  '''
+  tasks = []
+  for name in os.listdir(f'{queue_dir}/tasks'):
+    try:
+      with open(f'{queue_dir}/tasks/{name}', 'r', encoding='UTF-8') as f:
+        task = json.load(f)
+    except (ValueError, FileNotFoundError):
+      # a task being written by another node
+      continue
+    tasks.append((task["position"], task["seeded"], name[:-len('.json')], task["file"]))
+  return [(tid, input_file) for position, seeded, tid, input_file in sorted(tasks)]
+
+
+def try_claim(queue_dir, tid, lease_seconds=LEASE_SECONDS):
+  '''
+  Try to claim a task by creating its lease file ; a lease which has not been touched for `lease_seconds` is reclaimed
+  Inputs:
+  	queue_dir : str : absolute path to the queue directory
+  	tid : str : the id of the task
+  	lease_seconds : int : lease duration
+  Returns:
+  	lease_file : str : absolute path to the lease, None if the task is done or held by a live worker
+  '''
+  if os.path.exists(f'{queue_dir}/done/{tid}'):
+    return None
+  lease_file = f'{queue_dir}/leases/{tid}'
+  try:
+    fd = os.open(lease_file, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+  except FileExistsError:
+    try:
+      expired = os.stat(lease_file)
+    except FileNotFoundError:
+      return None
+    if time.time() - expired.st_mtime < lease_seconds:
+      return None
+    # the lease has expired : renaming it away is atomic, so only one of the workers reclaiming it succeeds, and it then creates a fresh lease
+    stale_file = f'{lease_file}.stale.{worker_name()}'
+    try:
+      os.rename(lease_file, stale_file)
+    except FileNotFoundError:
+      return None
+    # a worker which saw the same expired lease may have reclaimed it and created a fresh lease between the check and the rename : the file renamed is then that fresh lease, which is put back, as linking it fails rather than replacing a lease created since
+    renamed = os.stat(stale_file)
+    if (renamed.st_ino, renamed.st_mtime) != (expired.st_ino, expired.st_mtime):
+      try:
+        os.link(stale_file, lease_file)
+      except FileExistsError:
+        pass
+      os.remove(stale_file)
+      return None
+    os.remove(stale_file)
+    return try_claim(queue_dir, tid, lease_seconds)
+  with os.fdopen(fd, 'w', encoding='UTF-8') as f:
+    _ = f.write(f'{worker_name()}\t{time.time()}\n')
+  # the task may have been completed between the check and the claim
+  if os.path.exists(f'{queue_dir}/done/{tid}'):
+    os.remove(lease_file)
+    return None
+  return lease_file
+
+
+class Heartbeat:
+  '''
+  Context manager touching a lease file from a background thread while a task is processed, so that the lease does not expire however long the task takes
+  '''
+  def __init__(self, lease_file, lease_seconds=LEASE_SECONDS):
+    self.lease_file = lease_file
+    self.interval = max(lease_seconds / 4, 1)
+    self.stopped = threading.Event()
+    self.thread = threading.Thread(target=self.beat, daemon=True)
+
+  def beat(self):
+    while not self.stopped.wait(self.interval):
+      try:
+        os.utime(self.lease_file)
+      except FileNotFoundError:
+        return
+
+  def __enter__(self):
+    self.thread.start()
+    return self
+
+  def __exit__(self, *exc):
+    self.stopped.set()
+    self.thread.join()
+    return False
+
+
+def holds_lease(lease_file):
+  '''
+  Check that a lease is still held by the current process : a lease which expired, during a long pause or a stall of the shared storage, may have been reclaimed by another worker
+  '''
+  try:
+    with open(lease_file, 'r', encoding='UTF-8') as f:
+      return f.read().split('\t')[0] == worker_name()
+  except FileNotFoundError:
+    return False
+
+
+def release(lease_file):
+  '''
+  Release a lease held by the current process, so that another worker can claim the task
+  '''
+  if holds_lease(lease_file):
+    os.remove(lease_file)
+
+
+def complete(queue_dir, tid, lease_file):
+  '''
+  Mark a task as done and release its lease, unless the lease was reclaimed by another worker, which then completes the task itself
+  Returns:
+  	completed : bool : whether the task was marked done by this worker
+  '''
+  if not holds_lease(lease_file):
+    return False
+  with open(f'{queue_dir}/done/{tid}', 'w', encoding='UTF-8') as f:
+    _ = f.write(f'{worker_name()}\t{time.time()}\n')
+  os.remove(lease_file)
+  return True
+
+
+def mark_failed(queue_dir, input_file):
+  '''
+  Record that the current worker failed a task : the task is not marked done, and is released when the caller asks for the next file, so that another worker can try it, until MAX_FAILURES workers have failed it
+  '''
+  os.makedirs(f'{queue_dir}/failed', exist_ok=True)
+  with open(f'{queue_dir}/failed/{task_id(input_file)}.{worker_name()}', 'w', encoding='UTF-8') as f:
+    _ = f.write(f'{os.path.abspath(input_file)}\t{time.time()}\n')
+
+
+def load_failures(queue_dir):
+  '''
+  Load the workers which failed each task
+  Returns:
+  	failures : dict : the set of the names of the workers which failed each task, by task id
+  '''
+  failures = {}
+  if os.path.isdir(f'{queue_dir}/failed'):
+    for name in os.listdir(f'{queue_dir}/failed'):
+      tid, _, worker = name.partition('.')
+      failures.setdefault(tid, set()).add(worker)
+  return failures
+
+
+def pending_tasks(queue_dir, failures=None):
+  '''
+  Get the ids of the tasks left for the current worker, from the names of the files of the queue alone : the tasks not done, leaving out those the worker failed and those failed by MAX_FAILURES workers
+  '''
+  failures = load_failures(queue_dir) if failures is None else failures
+  done = set(os.listdir(f'{queue_dir}/done'))
+  tids = [name[:-len('.json')] for name in os.listdir(f'{queue_dir}/tasks') if name.endswith('.json')]
+  return [tid for tid in tids if tid not in done and worker_name() not in failures.get(tid, ()) and len(failures.get(tid, ())) < MAX_FAILURES]
+
+
+def held_by_others(queue_dir, tids, lease_seconds=LEASE_SECONDS):
+  '''
+  Check that every task of a list is held under a live lease : when a task was released, or its lease expired, it can be claimed
+  '''
+  now = time.time()
+  for tid in tids:
+    try:
+      if now - os.path.getmtime(f'{queue_dir}/leases/{tid}') >= lease_seconds:
+        return False
+    except FileNotFoundError:
+      return False
+  return True
+
+
+def claimed_files(queue_dir, lease_seconds=LEASE_SECONDS):
+  '''
+  Pull files from the queue until every task is done or failed. Each file is held under a lease kept alive by a heartbeat while the caller processes it, and is marked done when the caller asks for the next file, unless the caller marked it as failed with `mark_failed` ; if the caller stops with an exception, the lease is released so that another worker can claim the file. While other workers hold the last tasks, their leases are checked every POLL_SECONDS, and the queue is scanned again once a task is released or a lease expires, so that the task of a worker which died is reclaimed.
+  Inputs:
+  	queue_dir : str : absolute path to the queue directory
+  	lease_seconds : int : lease duration
+  Yields:
+  	input_file : str : absolute path to a file claimed by this worker
+  '''
+  while True:
+    # the tasks are loaded once per pass, and claimed in their order from where the pass stands
+    claimed = False
+    failures = load_failures(queue_dir)
+    for tid, input_file in load_tasks(queue_dir):
+      if worker_name() in failures.get(tid, ()) or len(failures.get(tid, ())) >= MAX_FAILURES:
+        continue
+      lease_file = try_claim(queue_dir, tid, lease_seconds)
+      if lease_file is None:
+        continue
+      claimed = True
+      try:
+        with Heartbeat(lease_file, lease_seconds):
+          yield input_file
+      except BaseException:
+        release(lease_file)
+        raise
+      if os.path.exists(f'{queue_dir}/failed/{tid}.{worker_name()}'):
+        release(lease_file)
+      else:
+        complete(queue_dir, tid, lease_file)
+    # the tasks left are held by other workers : wait until one of them is released, such as a task another worker failed, or its lease expires, before scanning again
+    while True:
+      pending = pending_tasks(queue_dir)
+      if len(pending) == 0:
+        return
+      if claimed or not held_by_others(queue_dir, pending, lease_seconds):
+        break
+      time.sleep(min(POLL_SECONDS, max(lease_seconds / 4, 1)))
+
+
+def queue_status(queue_dir):
+  '''
+  Count the tasks of the queue by state
+  Inputs:
+  	queue_dir : str : absolute path to the queue directory
+  Returns:
+  	status : dict : number of tasks, of leases held, of tasks done and of failures
+  '''
+  return {folder: len([name for name in os.listdir(f'{queue_dir}/{folder}') if '.stale.' not in name]) if os.path.isdir(f'{queue_dir}/{folder}') else 0 for folder in QUEUE_FOLDERS}